@@ -0,0 +1,286 @@
+"""
+Comic Upscale - Cost-aware Watchdog
+Decides when a run should stop paying for the GPU and asks the engine (or
+the worker supervisor) to drain: no new jobs are claimed, in-flight jobs
+finish, DB writes are flushed and the process exits with a policy-specific
+code.
+
+Utilization comes from a pluggable probe (NVML, torch, nvidia-smi, or a fake
+for tests); cost is tracked from the instance's hourly rate. Policies:
+    - IdleTimeoutPolicy: GPU below threshold and nothing in flight for N seconds
+    - BudgetCapPolicy:   accrued cost would pass a USD cap
+    - DeadlinePolicy:    wall-clock deadline reached
+"""
+
+import asyncio
+import logging
+import subprocess
+import time
+
+logger = logging.getLogger(__name__)
+
+# Process exit codes, so wrappers (idle_watchdog.sh) can tell why the run stopped
+EXIT_IDLE = 10
+EXIT_BUDGET = 11
+EXIT_DEADLINE = 12
+
+
+# ---------------------------------------------------------------------------
+# Utilization probes
+# ---------------------------------------------------------------------------
+
+class UtilizationProbe:
+    """Returns GPU utilization in percent, or None when it can't be measured."""
+    name = 'none'
+
+    def sample(self):
+        return None
+
+
+class NvmlProbe(UtilizationProbe):
+    """NVML via pynvml; reports the busiest visible GPU."""
+    name = 'nvml'
+
+    def __init__(self):
+        import pynvml
+        pynvml.nvmlInit()
+        self._nvml = pynvml
+        self._handles = [pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())]
+
+    def sample(self):
+        if not self._handles:
+            return None
+        return float(max(self._nvml.nvmlDeviceGetUtilizationRates(h).gpu for h in self._handles))
+
+
+class TorchProbe(UtilizationProbe):
+    """torch.cuda.utilization (needs pynvml underneath as well)."""
+    name = 'torch'
+
+    def __init__(self):
+        import torch
+        if not torch.cuda.is_available():
+            raise RuntimeError('CUDA not available')
+        self._torch = torch
+
+    def sample(self):
+        count = self._torch.cuda.device_count()
+        return float(max(self._torch.cuda.utilization(i) for i in range(count)))
+
+
+class NvidiaSmiProbe(UtilizationProbe):
+    """Shells out to nvidia-smi (slowest, but needs nothing installed)."""
+    name = 'smi'
+
+    def __init__(self):
+        self.sample()
+
+    def sample(self):
+        result = subprocess.run(
+            ['nvidia-smi', '--query-gpu=utilization.gpu', '--format=csv,noheader,nounits'],
+            capture_output=True,
+            text=True,
+            timeout=10
+        )
+        return float(max(float(line) for line in result.stdout.split()))
+
+
+class FakeProbe(UtilizationProbe):
+    """Replays scripted readings (last one repeats); for tests and CPU boxes."""
+    name = 'fake'
+
+    def __init__(self, readings=(0.0,)):
+        self._readings = list(readings)
+
+    def sample(self):
+        if len(self._readings) > 1:
+            return self._readings.pop(0)
+        return self._readings[0]
+
+
+PROBES = {
+    'nvml': NvmlProbe,
+    'torch': TorchProbe,
+    'smi': NvidiaSmiProbe,
+    'fake': FakeProbe,
+    'none': UtilizationProbe,
+}
+
+
+def make_probe(name: str = 'auto') -> UtilizationProbe:
+    """Build a probe by name; 'auto' tries NVML, torch, nvidia-smi in turn."""
+    if name != 'auto':
+        return PROBES[name]()
+    for candidate in ('nvml', 'torch', 'smi'):
+        try:
+            return PROBES[candidate]()
+        except Exception:
+            continue
+    logger.warning("No GPU utilization probe available, idle detection uses in-flight jobs only")
+    return UtilizationProbe()
+
+
+# ---------------------------------------------------------------------------
+# Cost tracking
+# ---------------------------------------------------------------------------
+
+class CostTracker:
+    """Accrued instance cost since start, from the hourly rate."""
+
+    def __init__(self, hourly_rate: float = 0.0, clock=time.monotonic):
+        self.hourly_rate = hourly_rate
+        self._clock = clock
+        self.started_at = clock()
+        self.idle_cost = 0.0
+
+    def elapsed(self) -> float:
+        return self._clock() - self.started_at
+
+    def cost(self, extra_seconds: float = 0.0) -> float:
+        """Cost so far (optionally projected extra_seconds ahead), in USD."""
+        return (self.elapsed() + extra_seconds) * self.hourly_rate / 3600
+
+    def add_idle(self, seconds: float):
+        """Book seconds spent idle, to report what idling cost."""
+        self.idle_cost += seconds * self.hourly_rate / 3600
+
+
+# ---------------------------------------------------------------------------
+# Policies
+# ---------------------------------------------------------------------------
+
+class IdleTimeoutPolicy:
+    """Stop after the GPU has been idle (and no job in flight) for timeout seconds."""
+    name = 'idle'
+    exit_code = EXIT_IDLE
+
+    def __init__(self, timeout: float = 300):
+        self.timeout = timeout
+
+    def check(self, state: dict):
+        if state['idle_seconds'] >= self.timeout:
+            return f"idle for {state['idle_seconds']:.0f}s (limit {self.timeout:.0f}s)"
+        return None
+
+
+class BudgetCapPolicy:
+    """Stop before accrued cost passes max_usd (leaving one poll for the drain)."""
+    name = 'budget'
+    exit_code = EXIT_BUDGET
+
+    def __init__(self, max_usd: float):
+        self.max_usd = max_usd
+
+    def check(self, state: dict):
+        if state['projected_cost'] >= self.max_usd:
+            return f"cost ${state['cost']:.4f} reaching budget ${self.max_usd:.4f}"
+        return None
+
+
+class DeadlinePolicy:
+    """Stop once the run has used its wall-clock allowance (leaving one poll for the drain)."""
+    name = 'deadline'
+    exit_code = EXIT_DEADLINE
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def check(self, state: dict):
+        if state['elapsed'] + state['drain_grace'] >= self.seconds:
+            return f"deadline of {self.seconds / 60:.0f} min reached"
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Watchdog
+# ---------------------------------------------------------------------------
+
+class Watchdog:
+    """Samples utilization, tracks cost and evaluates shutdown policies."""
+
+    def __init__(self, probe: UtilizationProbe, policies: list, cost: CostTracker,
+                 poll_interval: float = 30, gpu_threshold: float = 5.0, clock=time.monotonic):
+        self.probe = probe
+        self.policies = policies
+        self.cost = cost
+        self.poll_interval = poll_interval
+        self.gpu_threshold = gpu_threshold
+        self._clock = clock
+        self._last_poll = clock()
+        self.idle_seconds = 0.0
+        self.shutdown = None  # {'policy', 'reason', 'exit_code'} once triggered
+
+    def due(self) -> bool:
+        return self._clock() - self._last_poll >= self.poll_interval
+
+    def poll(self, in_flight: int):
+        """Take one reading; returns the shutdown decision (or None)."""
+        now = self._clock()
+        interval = now - self._last_poll
+        self._last_poll = now
+
+        try:
+            gpu_percent = self.probe.sample()
+        except Exception as e:
+            logger.warning(f"Could not get GPU stats: {e}")
+            gpu_percent = None
+
+        gpu_idle = gpu_percent is None or gpu_percent < self.gpu_threshold
+        if gpu_idle and in_flight == 0:
+            self.idle_seconds += interval
+            self.cost.add_idle(interval)
+        else:
+            self.idle_seconds = 0.0
+
+        state = {
+            'gpu_percent': gpu_percent,
+            'in_flight': in_flight,
+            'idle_seconds': self.idle_seconds,
+            'elapsed': self.cost.elapsed(),
+            'cost': self.cost.cost(),
+            'projected_cost': self.cost.cost(extra_seconds=self.poll_interval),
+            'drain_grace': self.poll_interval
+        }
+        gpu_text = f"{gpu_percent:.0f}%" if gpu_percent is not None else 'n/a'
+        logger.info(
+            f"Watchdog: GPU {gpu_text} | in-flight {in_flight} | idle {self.idle_seconds:.0f}s | "
+            f"cost ${state['cost']:.4f} (${self.cost.hourly_rate:.2f}/h, idle ${self.cost.idle_cost:.4f})"
+        )
+
+        for policy in self.policies:
+            reason = policy.check(state)
+            if reason:
+                self.shutdown = {'policy': policy.name, 'reason': reason, 'exit_code': policy.exit_code}
+                logger.info(f"Watchdog: {reason}, draining...")
+                return self.shutdown
+        return None
+
+    async def run(self, engine):
+        """Watch an in-process UpscaleEngine; drains it when a policy fires."""
+        logger.info(
+            f"Watchdog started (probe={self.probe.name}, "
+            f"policies={', '.join(p.name for p in self.policies) or 'none'})"
+        )
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if self.poll(engine.processing_count):
+                engine.request_drain()
+                return self.shutdown
+
+
+def build_watchdog(args):
+    """Watchdog from upscale.py CLI arguments."""
+    policies = []
+    if args.idle_timeout > 0:
+        policies.append(IdleTimeoutPolicy(args.idle_timeout))
+    if args.budget:
+        policies.append(BudgetCapPolicy(args.budget))
+    if args.deadline:
+        policies.append(DeadlinePolicy(args.deadline * 60))
+    return Watchdog(
+        probe=make_probe(args.probe),
+        policies=policies,
+        cost=CostTracker(args.hourly_rate),
+        poll_interval=args.poll_interval,
+        gpu_threshold=args.gpu_threshold
+    )
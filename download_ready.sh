@@ -3,7 +3,8 @@
 # Creates tar.gz on server, downloads one file
 # Usage: ./download_ready.sh [--clear-old]
 # Options:
-#   --clear-old    After download, prompt to clear remote data (requires YES confirmation)
+#   --clear-old    After download, archive completed jobs and delete their outputs on the server
+#                  (shows a dry-run report first, requires YES confirmation)
 
 set -e
 
@@ -71,60 +72,27 @@ if [ "$CLEAR_OLD" = true ]; then
     echo ""
     echo "============================================== Clear Remote Data =============================================="
     echo ""
-    echo "This will DELETE from server:"
-    echo "  - Completed output files in: $OUTPUT_DIR"
-    echo "  - Completed job entries from database"
+    RETENTION="cd $PROJECT_DIR && $PYTHON -m webui.retention --days 0 --status completed --outputs delete"
+
+    # Dry run first: what would be archived and reclaimed
+    ssh -o StrictHostKeyChecking=no -p $SSH_PORT "$REMOTE_USER@$REMOTE_IP" "$RETENTION"
+
+    echo "This will, on the server:"
+    echo "  - Move completed job entries to the archive database (db/archive.db)"
+    echo "  - DELETE their output files in: $OUTPUT_DIR"
+    echo "  - Compact the queue database"
     echo ""
     echo "PRESERVED:"
     echo "  - Directories (input/, output/, db/)"
-    echo "  - Pending/processing jobs"
+    echo "  - Pending/processing/failed jobs"
     echo ""
     echo "Type 'YES' to confirm clearing COMPLETED jobs only:"
     read -r CONFIRM
     
     if [ "$CONFIRM" = "YES" ]; then
-        # Create remote cleanup script
-        REMOTE_SCRIPT="/tmp/clear_completed_$$.sh"
-        
-        cat > "$REMOTE_SCRIPT" << 'REMOTE_EOF'
-#!/bin/bash
-cd /workspace
-/workspace/venv/main/bin/python -c "
-import os
-from webui.app import create_app
-from webui.models import db, ImageJob
-
-app = create_app()
-with app.app_context():
-    # Get completed jobs
-    jobs = ImageJob.query.filter_by(status='completed').all()
-    count = len(jobs)
-    
-    # Remove output files
-    for job in jobs:
-        if job.output_path and os.path.exists(job.output_path):
-            os.remove(job.output_path)
-            print(f'Removed: {os.path.basename(job.output_path)}')
-    
-    # Delete from database
-    for job in jobs:
-        db.session.delete(job)
-    db.session.commit()
-    
-    print(f'Deleted {count} completed jobs from database')
-"
-REMOTE_EOF
-        
         echo ""
         echo "Clearing completed jobs from server..."
-        
-        COMPLETED_COUNT=$(ssh -o StrictHostKeyChecking=no -p $SSH_PORT "$REMOTE_USER@$REMOTE_IP" \
-            "chmod +x /tmp/clear_completed_$$.sh && bash /tmp/clear_completed_$$.sh")
-        
-        rm -f "$REMOTE_SCRIPT"
-        
-        echo "  ✓ Cleared $COMPLETED_COUNT completed jobs"
-        echo "  ✓ Removed output files"
+        ssh -o StrictHostKeyChecking=no -p $SSH_PORT "$REMOTE_USER@$REMOTE_IP" "$RETENTION --apply"
         echo ""
         echo "Server ready for new batch!"
     else
@@ -0,0 +1,196 @@
+"""
+Comic Upscale - Face Gate for GFPGAN
+Cheap face-detection pre-pass that decides whether GFPGAN is worth running.
+
+Detection runs on the low-resolution input (further downscaled), with the
+RetinaFace detector GFPGAN already carries (facexlib). Pages without faces
+skip GFPGAN entirely; pages with faces only send the (padded) face regions
+of the upscaled output through GFPGAN instead of the whole 4x image.
+
+Results are keyed by the input's content hash: an in-process LRU in front
+of a small SQLite file (FACE_CACHE_PATH) that all worker processes on the
+host share and that outlives the run, so retries, re-runs and requeued
+jobs of the same page don't detect twice.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+DETECT_MAX_SIDE = 640  # detection resolution; faces below ~24px here are ignored anyway
+FACE_MARGIN = 0.5  # extra context around each box, as a fraction of its size
+FACE_CACHE_PATH = os.environ.get('FACE_CACHE_PATH', '/workspace/data/db/face_cache.db')
+
+
+def file_hash(path: str) -> str:
+    """Content hash of an input file (cache key)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def retinaface_detector(face_enhancer, conf_threshold: float = 0.8):
+    """Detector using the RetinaFace model inside a loaded GFPGANer."""
+    face_det = face_enhancer.face_helper.face_det
+
+    def detect(img):
+        if img.ndim == 2:
+            import cv2
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        found = face_det.detect_faces(img, conf_threshold)
+        return [(int(x0), int(y0), int(x1 - x0), int(y1 - y0)) for x0, y0, x1, y1 in (f[:4] for f in found)]
+    return detect
+
+
+class FaceStore:
+    """Face boxes per content hash in a SQLite file shared by processes and runs."""
+
+    def __init__(self, path: str = FACE_CACHE_PATH):
+        self.path = path
+        self._local = threading.local()  # sqlite3 connections are per thread
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().execute('CREATE TABLE IF NOT EXISTS faces (hash TEXT PRIMARY KEY, boxes TEXT NOT NULL)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def get(self, key: str):
+        """Stored boxes for a hash, or None if it was never detected."""
+        row = self._conn().execute('SELECT boxes FROM faces WHERE hash = ?', (key,)).fetchone()
+        return [tuple(box) for box in json.loads(row[0])] if row else None
+
+    def put(self, key: str, boxes: list):
+        self._conn().execute('INSERT OR REPLACE INTO faces VALUES (?, ?)', (key, json.dumps(boxes)))
+
+
+class FaceGate:
+    """Detects faces on input images, cached by content hash (LRU + optional FaceStore)."""
+
+    def __init__(self, detector, cache_size: int = 10000, store: FaceStore = None, lock: Lock = None):
+        """
+        Args:
+            detector: callable(img) -> [(x, y, w, h)], e.g. retinaface_detector()
+            cache_size: input hashes remembered in memory
+            store: persistent cache behind the LRU (None = this process only)
+            lock: serialises the detector; pass the lock guarding GFPGANer when
+                the detector is its RetinaFace (they share face_helper)
+        """
+        self._detector = detector
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._store = store
+        self._lock = Lock()  # cache and stats
+        self._detect_lock = lock or Lock()  # one detector shared by the worker threads
+        self.stats = {'checked': 0, 'with_faces': 0, 'skipped': 0, 'cache_hits': 0}
+
+    def detect(self, img) -> list:
+        """Face boxes (x, y, w, h) in input-image coordinates."""
+        import cv2
+        h, w = img.shape[:2]
+        ratio = min(1.0, DETECT_MAX_SIDE / max(h, w))
+        if ratio < 1.0:
+            img = cv2.resize(img, (int(w * ratio), int(h * ratio)), interpolation=cv2.INTER_AREA)
+        with self._detect_lock:
+            found = self._detector(img)
+        return [tuple(int(v / ratio) for v in box) for box in found]
+
+    def faces_for(self, input_path: str, img) -> list:
+        """Cached face boxes for an input file."""
+        key = file_hash(input_path)
+        with self._lock:
+            self.stats['checked'] += 1
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                boxes = self._cache[key]
+            else:
+                boxes = None
+
+        if boxes is None and self._store is not None:
+            try:
+                boxes = self._store.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Face cache read failed: {e}")
+            if boxes is not None:
+                with self._lock:
+                    self.stats['cache_hits'] += 1
+
+        if boxes is None:
+            boxes = self.detect(img)
+            if self._store is not None:
+                try:
+                    self._store.put(key, boxes)
+                except sqlite3.Error as e:
+                    logger.warning(f"Face cache write failed: {e}")
+
+        with self._lock:
+            self._cache[key] = boxes
+            self._cache.move_to_end(key)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        with self._lock:
+            self.stats['with_faces' if boxes else 'skipped'] += 1
+        return boxes
+
+
+def _face_regions(boxes: list, scale: float, width: int, height: int) -> list:
+    """Scale input boxes to the output, pad them and merge overlaps."""
+    regions = []
+    for x, y, w, h in boxes:
+        pad_x, pad_y = w * FACE_MARGIN, h * FACE_MARGIN
+        regions.append([
+            max(0, int((x - pad_x) * scale)),
+            max(0, int((y - pad_y) * scale)),
+            min(width, int((x + w + pad_x) * scale)),
+            min(height, int((y + h + pad_y) * scale)),
+        ])
+
+    merged = []
+    for region in sorted(regions):
+        if merged and region[0] <= merged[-1][2] and region[1] <= merged[-1][3] and region[3] >= merged[-1][1]:
+            last = merged[-1]
+            merged[-1] = [min(last[0], region[0]), min(last[1], region[1]),
+                          max(last[2], region[2]), max(last[3], region[3])]
+        else:
+            merged.append(region)
+    return merged
+
+
+def enhance_face_regions(face_enhancer, output, boxes: list, scale: float, lock: Lock):
+    """Run GFPGAN on the face regions of an upscaled image only (in place).
+
+    GFPGANer.enhance keeps its faces and landmarks in the shared face_helper,
+    so concurrent calls must hold lock.
+    """
+    import cv2
+    height, width = output.shape[:2]
+    for x0, y0, x1, y1 in _face_regions(boxes, scale, width, height):
+        crop = output[y0:y1, x0:x1]
+        with lock:
+            _, _, restored = face_enhancer.enhance(
+                crop,
+                has_aligned=False,
+                only_center_face=False,
+                paste_back=True
+            )
+        if restored is None:
+            continue
+        if restored.shape[:2] != crop.shape[:2]:
+            restored = cv2.resize(restored, (crop.shape[1], crop.shape[0]), interpolation=cv2.INTER_AREA)
+        output[y0:y1, x0:x1] = restored
+    return output
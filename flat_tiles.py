@@ -0,0 +1,127 @@
+"""
+Comic Upscale - Flat Tile Skipping
+Keeps uniform regions (gutters, margins, balloon interiors, flat fills) out
+of the network.
+
+The input is cut into FLAT_TILE px tiles and every tile's per-channel
+standard deviation is computed in one vectorized pass. Tiles below the
+threshold are taken from a cheap bicubic upscale of the whole image;
+textured tiles are merged into rectangles, run through the model with
+CONTEXT px of surrounding input, and feathered into the bicubic base over
+that context margin so no seam shows where the two meet.
+
+Context and the model's own pre_pad make every region bigger than its
+tiles, so scattered texture can cost more than one whole-image pass. The
+padded area of all regions is summed before anything runs; unless it is
+at most MAX_MODEL_FRACTION of the whole-image pass, the image goes through
+the model in one call. The reported saving is model pixels actually
+saved against that pass, not the flat area.
+"""
+
+import numpy as np
+
+FLAT_TILE = 64  # classifier tile size, input pixels
+CONTEXT = 16  # input pixels of context around model regions (also the blend ramp)
+MIN_SKIP = 0.05  # below this flat fraction, run the whole image through the model
+MAX_MODEL_FRACTION = 0.8  # region passes must stay under this share of a whole-image pass
+
+
+def flat_tiles(img, tile: int = FLAT_TILE, threshold: float = 2.0):
+    """Boolean (rows, cols) grid, True where a tile's std-dev is below threshold (0-255 scale)."""
+    h, w = img.shape[:2]
+    rows, cols = -(-h // tile), -(-w // tile)
+    pixels = img.reshape(h, w, -1)
+    pixels = np.pad(pixels, ((0, rows * tile - h), (0, cols * tile - w), (0, 0)), mode='edge')
+    blocks = pixels.reshape(rows, tile, cols, tile, -1).astype(np.float32)
+    if img.dtype == np.uint16:
+        blocks /= 257.0
+    std = blocks.std(axis=(1, 3)).max(axis=-1)
+    return std < threshold
+
+
+def _regions(textured) -> list:
+    """Textured tiles as (row0, row1, col0, col1) rectangles: row runs, merged downwards."""
+    regions, open_runs = [], {}
+    for row, line in enumerate(textured):
+        runs, col = [], 0
+        while col < len(line):
+            if line[col]:
+                start = col
+                while col < len(line) and line[col]:
+                    col += 1
+                runs.append((start, col))
+            col += 1
+        still_open = {}
+        for run in runs:
+            if run in open_runs:
+                still_open[run] = open_runs.pop(run)
+            else:
+                still_open[run] = row
+        regions.extend((start_row, row, c0, c1) for (c0, c1), start_row in open_runs.items())
+        open_runs = still_open
+    regions.extend((start_row, len(textured), c0, c1) for (c0, c1), start_row in open_runs.items())
+    return regions
+
+
+def _ramp(length: int, before: int, after: int):
+    """Blend weights along one axis: 0 -> 1 over the leading context, 1 -> 0 over the trailing."""
+    weights = np.ones(length, dtype=np.float32)
+    if before:
+        weights[:before] = np.linspace(0.0, 1.0, before + 2, dtype=np.float32)[1:-1]
+    if after:
+        weights[length - after:] = np.linspace(1.0, 0.0, after + 2, dtype=np.float32)[1:-1]
+    return weights
+
+
+def _model_boxes(flat, h: int, w: int) -> list:
+    """Model input boxes for the textured regions: ((y0, y1, x0, x1) kept, (py0, py1, px0, px1) with context)."""
+    boxes = []
+    for row0, row1, col0, col1 in _regions(~flat):
+        y0, y1 = row0 * FLAT_TILE, min(h, row1 * FLAT_TILE)
+        x0, x1 = col0 * FLAT_TILE, min(w, col1 * FLAT_TILE)
+        boxes.append(((y0, y1, x0, x1),
+                      (max(0, y0 - CONTEXT), min(h, y1 + CONTEXT), max(0, x0 - CONTEXT), min(w, x1 + CONTEXT))))
+    return boxes
+
+
+def enhance_skipping_flat(model, img, outscale: int, threshold: float = 2.0, pool=None):
+    """
+    model.enhance() on the textured parts of img only (bicubic base from pool, if given).
+    Returns:
+        (output, fraction of a whole-image model pass saved)
+    """
+    import cv2
+    from buffer_pool import pooled
+    h, w = img.shape[:2]
+    flat = flat_tiles(img, FLAT_TILE, threshold)
+    flat_area = flat.astype(np.float32)
+    flat_area[-1, :] *= (h - (flat.shape[0] - 1) * FLAT_TILE) / FLAT_TILE
+    flat_area[:, -1] *= (w - (flat.shape[1] - 1) * FLAT_TILE) / FLAT_TILE
+    if float(flat_area.sum()) * FLAT_TILE * FLAT_TILE / (h * w) < MIN_SKIP:
+        output, _ = model.enhance(img, outscale=outscale)
+        return output, 0.0
+
+    # What the model would really see: regions plus context, plus its pre_pad per call
+    pre_pad = getattr(model, 'pre_pad', 0)
+    boxes = _model_boxes(flat, h, w)
+    model_area = sum((py1 - py0 + pre_pad) * (px1 - px0 + pre_pad) for _, (py0, py1, px0, px1) in boxes)
+    full_area = (h + pre_pad) * (w + pre_pad)
+    if model_area > MAX_MODEL_FRACTION * full_area:
+        output, _ = model.enhance(img, outscale=outscale)
+        return output, 0.0
+
+    output = cv2.resize(img, (w * outscale, h * outscale), pooled(pool, (h * outscale, w * outscale) + img.shape[2:], img.dtype),
+                        interpolation=cv2.INTER_CUBIC)
+    for (y0, y1, x0, x1), (py0, py1, px0, px1) in boxes:
+        enhanced, _ = model.enhance(img[py0:py1, px0:px1], outscale=outscale)
+        weight = np.outer(
+            _ramp(enhanced.shape[0], (y0 - py0) * outscale, (py1 - y1) * outscale),
+            _ramp(enhanced.shape[1], (x0 - px0) * outscale, (px1 - x1) * outscale)
+        )
+        if enhanced.ndim == 3:
+            weight = weight[..., None]
+
+        target = output[py0 * outscale:py1 * outscale, px0 * outscale:px1 * outscale]
+        blended = target * (1.0 - weight) + enhanced * weight
+        target[...] = np.clip(blended, 0, np.iinfo(output.dtype).max).round().astype(output.dtype)
+    return output, 1.0 - model_area / full_area
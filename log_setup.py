@@ -0,0 +1,180 @@
+"""
+Comic Upscale - Logging Setup
+Keeps log I/O off the inference threads.
+
+Every process logs into a queue (QueueHandler); one listener thread in the
+main process does the formatting and writing, to a size-rotated file of
+JSON lines and a plain-text console. Worker processes spawned by the
+supervisor log into a multiprocessing queue that the main process drains
+into the same handlers.
+
+JSON lines carry the usual fields plus any structured extras a call site
+passes (job_id, worker_id, stages = per-stage durations in seconds), so a
+10k-image run can be queried with jq instead of grep. In rate-limited mode
+INFO/DEBUG records above N per second are dropped (and counted) before
+they are even queued; warnings, errors and records marked keep=True (the
+per-job completion lines, worker start / finish / restart) always pass.
+The limit only applies while jobs run: end_rate_limit() lifts it before
+the run summary and logs how many records were dropped in total.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Structured extras copied into JSON lines when a record carries them
+EXTRA_FIELDS = ('job_id', 'worker_id', 'stages', 'suppressed')
+
+# extra= for records that must survive --log-rate (lifecycle lines)
+KEEP = {'keep': True}
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'process': record.processName,
+            'thread': record.threadName,
+        }
+        for field in EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket for INFO/DEBUG records; reports how many were dropped."""
+
+    def __init__(self, per_second: float):
+        super().__init__()
+        self.rate = per_second
+        self._allowance = per_second
+        self._last = time.monotonic()
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, 'keep', False):
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            if self._allowance < 1.0:
+                self._dropped += 1
+                return False
+            self._allowance -= 1.0
+            if self._dropped:
+                record.suppressed = self._dropped
+                self._dropped = 0
+        return True
+
+    def take_dropped(self) -> int:
+        """Records dropped since the last one that got through (and reset)."""
+        with self._lock:
+            dropped, self._dropped = self._dropped, 0
+        return dropped
+
+
+class _QueueHandler(QueueHandler):
+    """QueueHandler that keeps args/extras intact for the listener's formatters."""
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _route_to_queue(log_queue, level: int, rate_limit: float):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = _QueueHandler(log_queue)
+    if rate_limit:
+        handler.addFilter(RateLimitFilter(rate_limit))
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def end_rate_limit():
+    """Lift --log-rate (run finished) and log how many records it dropped since the last one passed."""
+    dropped = 0
+    for handler in logging.getLogger().handlers:
+        for log_filter in [f for f in handler.filters if isinstance(f, RateLimitFilter)]:
+            handler.removeFilter(log_filter)
+            dropped += log_filter.take_dropped()
+    if dropped:
+        logger.info(f"Log rate limit: {dropped} more INFO record(s) suppressed", extra={'suppressed': dropped})
+
+
+def setup_logging(log_file: str, json_lines: bool = True, rate_limit: float = 0.0,
+                  max_bytes: int = 50 * 1024 * 1024, backups: int = 5, level: int = logging.INFO) -> QueueListener:
+    """
+    Route all logging through a queue to a listener thread.
+    Args:
+        log_file: rotating log file (JSON lines or text)
+        json_lines: JSON lines in the file (the console always gets text)
+        rate_limit: max INFO/DEBUG records per second, 0 = unlimited
+        max_bytes, backups: rotation size and number of old files kept
+    Returns:
+        the started listener (stopped automatically at exit)
+    """
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backups)
+    file_handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT))
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, console, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    atexit.register(end_rate_limit)  # runs first: the count still reaches the listener
+    _route_to_queue(log_queue, level, rate_limit)
+    return listener
+
+
+def setup_worker_logging(log_queue, rate_limit: float = 0.0, level: int = logging.INFO):
+    """In a spawned worker process: send records to the main process's queue."""
+    _route_to_queue(log_queue, level, rate_limit)
+
+
+class _Forward(logging.Handler):
+    """Re-dispatches records arriving from worker processes in this process."""
+
+    def handle(self, record):
+        logging.getLogger(record.name).handle(record)
+        return True
+
+    def emit(self, record):
+        pass
+
+
+def forward_worker_logs(mp_queue) -> QueueListener:
+    """Drain a multiprocessing queue of worker records into this process's logging."""
+    listener = QueueListener(mp_queue, _Forward())
+    listener.start()
+    return listener
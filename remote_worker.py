@@ -0,0 +1,303 @@
+"""
+Comic Upscale - Remote Worker
+Pull-based worker for machines without the queue's SQLite file: leases jobs
+from the Flask app's worker API (webui/worker_api.py), downloads the inputs,
+upscales them locally and uploads the results.
+
+A background thread renews the leases of the jobs in hand; if the node dies
+the leases run out and the server requeues the jobs. The head node going
+away (restart, network drop) doesn't kill the worker: the job in hand is
+handed back (or its lease left to run out) and claims back off until the
+server answers again. Only the standard library (urllib) is used for HTTP.
+
+Usage (through upscale.py):
+    WORKER_TOKEN=secret python upscale.py --remote-worker http://head:5800 --model RealESRGAN_x4plus_anime
+"""
+
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+logger = logging.getLogger(__name__)
+
+RETRIES = 3  # per request, on connection errors and 5xx
+BACKOFF_MAX = 60.0  # seconds between claims while the server is unreachable
+OUTAGE_LIMIT = 1800.0  # without --follow, give up after the server was gone this long
+LOAD_ATTEMPTS = 4  # consecutive model load failures before a non-following worker stops
+
+# Errors that mean "server unreachable or answering garbage" (ValueError: a
+# proxy's HTML error page where JSON was expected), not "this job is bad"
+NETWORK_ERRORS = (urllib.error.URLError, TimeoutError, ConnectionError, ValueError)
+
+
+class RemoteWorker:
+    """Drains a remote queue through the job-lease API."""
+
+    def __init__(self, url: str, token: str, engine, worker_id: str = None, batch_size: int = 2,
+                 follow: bool = False, poll_interval: float = 5.0, watchdog=None):
+        """
+        Args:
+            url: base URL of the Flask app, e.g. http://head:5800
+            token: shared WORKER_TOKEN
+            engine: UpscaleEngine doing the actual work
+            worker_id: lease owner name (default host:remote:pid)
+            batch_size: jobs leased per claim
+            follow: keep polling when the queue is empty
+            poll_interval: seconds between claims on an empty queue
+            watchdog: optional cost_watchdog.Watchdog deciding when to stop
+        """
+        self.url = url.rstrip('/') + '/api/worker'
+        self.token = token
+        self.engine = engine
+        self.worker_id = worker_id or f"{socket.gethostname()}:remote:{os.getpid()}"
+        self.batch_size = batch_size
+        self.follow = follow
+        self.poll_interval = poll_interval
+        self.watchdog = watchdog
+        self.lease_seconds = 120
+        self.stats = {'completed': 0, 'failed': 0, 'lost': 0, 'released': 0, 'seconds': 0.0, 'pixels': 0}
+        self._held = set()  # job ids currently leased to us
+        self._lost = set()  # leases the server took back
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _request(self, path: str, payload: dict = None, body: bytes = None, content_type: str = None,
+                 raw: bool = False, timeout: float = 300):
+        """HTTP call with token auth and retries; returns parsed JSON (or bytes if raw)."""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        if payload is not None:
+            body = json.dumps(payload).encode()
+            content_type = 'application/json'
+        if content_type:
+            headers['Content-Type'] = content_type
+
+        for attempt in range(RETRIES):
+            request = urllib.request.Request(self.url + path, data=body, headers=headers,
+                                             method='POST' if body is not None else 'GET')
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    data = response.read()
+                return data if raw else json.loads(data)
+            except urllib.error.HTTPError as e:
+                if e.code < 500 or attempt == RETRIES - 1:
+                    raise
+            except (urllib.error.URLError, TimeoutError, ConnectionError):
+                if attempt == RETRIES - 1:
+                    raise
+            time.sleep(2 ** attempt)
+
+    def _post_file(self, path: str, fields: dict, file_field: str, file_path: str):
+        """multipart/form-data upload."""
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in fields.items():
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            )
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+            f'filename="{os.path.basename(file_path)}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n'
+        )
+        parts.append(f'--{boundary}--\r\n'.encode())
+        return self._request(path, body=b''.join(parts), content_type=f'multipart/form-data; boundary={boundary}')
+
+    def _heartbeat_loop(self):
+        """Renew leases at a third of their length until stopped."""
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                held = list(self._held)
+            if not held:
+                continue
+            try:
+                reply = self._request('/heartbeat', {'worker_id': self.worker_id, 'job_ids': held})
+            except Exception as e:
+                logger.warning(f"Heartbeat failed: {e}")
+                continue
+            if reply['lost']:
+                logger.warning(f"Lost lease on job(s) {reply['lost']}")
+                with self._lock:
+                    self._lost.update(reply['lost'])
+                    self._held.difference_update(reply['lost'])
+
+    def _run_job(self, job: dict, work_dir: str):
+        """Fetch, upscale and upload one leased job."""
+        job_id = job['id']
+        input_path = os.path.join(work_dir, f"{job_id}_{os.path.basename(job['filename'])}")
+        output_path = os.path.join(work_dir, f"{job_id}_out.png")
+        try:
+            query = urllib.parse.urlencode({'worker_id': self.worker_id})
+            data = self._request(f"/jobs/{job_id}/input?{query}", raw=True)
+            with open(input_path, 'wb') as f:
+                f.write(data)
+
+            start = time.time()
+            try:
+                result = self.engine._process_image(input_path, output_path, job_id, self.worker_id)
+            except Exception as e:
+                logger.error(f"Job {job_id}: processing raised {e}", exc_info=True)
+                result = {'success': False, 'error': str(e)}
+            elapsed = time.time() - start
+
+            with self._lock:
+                lost = job_id in self._lost
+            if lost:
+                self.stats['lost'] += 1
+                return
+            if result['success']:
+                self._post_file(f"/jobs/{job_id}/result", {
+                    'worker_id': self.worker_id,
+                    'skipped_fraction': result.get('skipped_fraction', 0.0),
+                    'is_grayscale': int(bool(result.get('is_grayscale')))
+                }, 'output', output_path)
+                self.stats['completed'] += 1
+                self.stats['seconds'] += elapsed
+                self.stats['pixels'] += result.get('pixels', 0)
+            else:
+                self._request(f"/jobs/{job_id}/fail", {'worker_id': self.worker_id, 'error': result['error']})
+                self.stats['failed'] += 1
+        except urllib.error.HTTPError as e:
+            # 409: lease expired and the job went to someone else
+            logger.error(f"Job {job_id}: server answered {e.code} {e.reason}")
+            if e.code == 409:
+                self.stats['lost'] += 1
+            elif e.code < 500:
+                # 410: input gone on the server, retrying won't bring it back
+                self._release([job], f"Server answered {e.code} {e.reason}")
+                self.stats['failed'] += 1
+            else:
+                self._release([job])
+                self.stats['released'] += 1
+        except (*NETWORK_ERRORS, OSError) as e:
+            # Server unreachable (or local disk trouble): give the job back for
+            # a retry; if the server can't be reached either, its lease runs out
+            logger.error(f"Job {job_id}: {e}, handing it back")
+            self._release([job])
+            self.stats['released'] += 1
+        finally:
+            with self._lock:
+                self._held.discard(job_id)
+            for path in (input_path, output_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _release(self, jobs: list, error: str = None):
+        """Give leased jobs back (error = fail them instead)."""
+        for job in jobs:
+            payload = {'worker_id': self.worker_id, 'retry': error is None, 'error': error}
+            try:
+                self._request(f"/jobs/{job['id']}/fail", payload)
+            except Exception as e:
+                logger.warning(f"Could not release job {job['id']}: {e}")
+            with self._lock:
+                self._held.discard(job['id'])
+
+    def _should_stop(self) -> bool:
+        if self.engine.draining:
+            return True
+        if self.watchdog and self.watchdog.due() and self.watchdog.poll(len(self._held)):
+            self.engine.request_drain()
+            return True
+        return False
+
+    def _claim(self):
+        """One /claim call; None if the server can't be reached right now."""
+        try:
+            return self._request('/claim', {
+                'worker_id': self.worker_id,
+                'max_jobs': self.batch_size,
+                'params': self.engine.params
+            })
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                raise  # bad token, API disabled: retrying won't help
+            logger.warning(f"Claim failed: server answered {e.code} {e.reason}")
+        except (*NETWORK_ERRORS, OSError) as e:
+            logger.warning(f"Claim failed: {e}")
+        return None
+
+    def _load_failed(self, jobs: list, params: dict, failures: int):
+        """Handle claimed jobs whose model didn't load; returns seconds to back off.
+
+        None means the model is unknown: the jobs were failed, nothing to retry.
+        """
+        from upscale import AVAILABLE_MODELS
+        if params['model_name'] not in AVAILABLE_MODELS:
+            self._release(jobs, f"Unknown model: {params['model_name']}")
+            return None
+        # Download hiccup, out of memory on this node: the jobs aren't at fault
+        self._release(jobs)
+        delay = min(self.poll_interval * 2 ** failures, BACKOFF_MAX)
+        logger.warning(f"Could not load {params['model_name']}, released {len(jobs)} job(s), retrying in {delay:.0f}s")
+        return delay
+
+    def run(self) -> dict:
+        """Claim and process jobs until the queue is empty (or drained)."""
+        logger.info(f"Remote worker {self.worker_id} pulling from {self.url}")
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='lease-heartbeat', daemon=True)
+        heartbeat.start()
+        started = time.time()
+        outage_since, misses, load_failures = None, 0, 0
+        try:
+            with tempfile.TemporaryDirectory(prefix='upscale-remote-') as work_dir:
+                while not self._should_stop():
+                    reply = self._claim()
+                    if reply is None:
+                        outage_since = outage_since or time.time()
+                        if not self.follow and time.time() - outage_since >= OUTAGE_LIMIT:
+                            logger.error(f"Server unreachable for {OUTAGE_LIMIT / 60:.0f} min, giving up")
+                            break
+                        misses += 1
+                        time.sleep(min(self.poll_interval * 2 ** (misses - 1), BACKOFF_MAX))
+                        continue
+                    if outage_since:
+                        logger.info(f"Server reachable again after {time.time() - outage_since:.0f}s")
+                    outage_since, misses = None, 0
+
+                    self.lease_seconds = reply['lease_seconds']
+                    jobs = reply['jobs']
+                    if not jobs:
+                        if not self.follow:
+                            break
+                        time.sleep(self.poll_interval)
+                        continue
+
+                    with self._lock:
+                        self._held.update(job['id'] for job in jobs)
+                    if not self.engine.configure(reply['params']):
+                        delay = self._load_failed(jobs, reply['params'], load_failures)
+                        if delay is None:
+                            continue
+                        load_failures += 1
+                        if not self.follow and load_failures >= LOAD_ATTEMPTS:
+                            logger.error(f"Could not load {reply['params']['model_name']} "
+                                         f"{load_failures} times, stopping")
+                            break
+                        time.sleep(delay)
+                        continue
+                    load_failures = 0
+
+                    for index, job in enumerate(jobs):
+                        if self.engine.draining:
+                            self._release(jobs[index:])
+                            break
+                        self._run_job(job, work_dir)
+        finally:
+            self._stop.set()
+
+        self.stats['elapsed'] = time.time() - started
+        logger.info(
+            f"Remote worker done: {self.stats['completed']} completed, {self.stats['failed']} failed, "
+            f"{self.stats['lost']} lost lease(s), {self.stats['released']} handed back"
+        )
+        return self.stats
@@ -52,20 +52,26 @@ pkill -f 'gunicorn.*wsgi:app' 2>/dev/null && echo 'Killed gunicorn' || echo 'No
 sleep 1
 pkill -f 'upscale.py' 2>/dev/null && echo 'Killed upscale.py' || echo 'No upscale.py to kill'
 sleep 1
+pkill -f 'webui.retention' 2>/dev/null && echo 'Killed retention' || echo 'No retention to kill'
 
 echo ""
 echo "=== Starting Flask UI ==="
 nohup $GUNICORN --bind 0.0.0.0:5800 --workers 2 --access-logfile $LOG_DIR/gunicorn.log --error-logfile $LOG_DIR/gunicorn.err wsgi:app > $LOG_DIR/flask.log 2>&1 &
 echo "Flask UI started"
 
+echo ""
+echo "=== Starting Retention (daily archive + DB compaction) ==="
+nohup $PYTHON -m webui.retention --apply --every 24 --days ${RETENTION_DAYS:-30} > $LOG_DIR/retention.log 2>&1 &
+echo "Retention started (days=${RETENTION_DAYS:-30})"
+
 echo ""
 echo "=== Starting Upscaling ==="
 # Build command with face enhance option
 if [ "$FACE_ENHANCE" = "true" ]; then
-    nohup $PYTHON $PROJECT_DIR/upscale.py --input $INPUT_DIR --output $OUTPUT_DIR --scale $SCALE --workers $WORKERS --model "$MODEL" --face-enhance > $LOG_DIR/upscale.log 2>&1 &
+    nohup $PYTHON $PROJECT_DIR/upscale.py --input $INPUT_DIR --output $OUTPUT_DIR --scale $SCALE --workers $WORKERS --model "$MODEL" --face-enhance > $LOG_DIR/upscale.out 2>&1 &
     echo "Upscaling started (scale=$SCALE, workers=$WORKERS, model=$MODEL, face-enhance=true)"
 else
-    nohup $PYTHON $PROJECT_DIR/upscale.py --input $INPUT_DIR --output $OUTPUT_DIR --scale $SCALE --workers $WORKERS --model "$MODEL" > $LOG_DIR/upscale.log 2>&1 &
+    nohup $PYTHON $PROJECT_DIR/upscale.py --input $INPUT_DIR --output $OUTPUT_DIR --scale $SCALE --workers $WORKERS --model "$MODEL" > $LOG_DIR/upscale.out 2>&1 &
     echo "Upscaling started (scale=$SCALE, workers=$WORKERS, model=$MODEL)"
 fi
 
@@ -74,8 +80,8 @@ echo "=== After restart ==="
 ps aux | grep -E 'gunicorn|upscale.py' | grep -v grep || echo 'No processes running'
 
 echo ""
-echo "=== Last 10 lines of upscale.log ==="
-tail -10 $LOG_DIR/upscale.log 2>/dev/null || echo 'No upscale log'
+echo "=== Last 10 lines of upscale.out ==="
+tail -10 $LOG_DIR/upscale.out 2>/dev/null || echo 'No upscale log'
 REMOTE_EOF
 
 log_info "Checking SSH..."
@@ -114,9 +120,9 @@ fi
 echo ""
 echo "Logs:"
 echo "  Flask: $LOG_DIR/flask.log"
-echo "  Upscale: $LOG_DIR/upscale.log"
+echo "  Upscale: $LOG_DIR/upscale.out (console), $LOG_DIR/upscale.log (JSON lines)"
 echo ""
 echo "Tail logs remotely:"
-echo "  ssh -p $SSH_PORT $REMOTE_USER@$REMOTE_IP 'tail -f $LOG_DIR/upscale.log'"
+echo "  ssh -p $SSH_PORT $REMOTE_USER@$REMOTE_IP 'tail -f $LOG_DIR/upscale.out'"
 echo ""
 echo "Admin UI: http://$REMOTE_IP:5800 (use SSH tunnel)"
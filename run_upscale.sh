@@ -1,6 +1,7 @@
 #!/bin/bash
 # run_upscale.sh - Start the upscaling process on vast.ai VM
-# Usage: ./run_upscale.sh <remote_user> <remote_ip> <scale> <workers>
+# Usage: ./run_upscale.sh <remote_user> <remote_ip> <scale> <workers> [procs] [devices]
+#   procs/devices: worker processes and their devices (default: one per GPU)
 
 set -e
 
@@ -8,12 +9,15 @@ REMOTE_USER="${1:-root}"
 REMOTE_IP="${2:-}"
 SCALE="${3:-2.5}"
 WORKERS="${4:-4}"
+PROCS="${5:-1}"
+DEVICES="${6:-auto}"
 CONTAINER_NAME="comic_upscale"
 
 echo "=== Comic Upscale - Start ==="
 echo "Remote: $REMOTE_USER@$REMOTE_IP"
 echo "Scale: ${SCALE}x"
 echo "Workers: $WORKERS"
+echo "Processes: $PROCS ($DEVICES)"
 
 if [ -z "$REMOTE_IP" ]; then
     echo "Error: Remote IP not specified"
@@ -44,13 +48,14 @@ ssh -o StrictHostKeyChecking=no "$REMOTE_USER@$REMOTE_IP" "
         -v /app/logs:/app/logs \
         -e FLASK_SECRET_KEY=\$(openssl rand -hex 32) \
         -e ADMIN_PASSWORD=\$(openssl rand -hex 16) \
-        -e CUDA_VISIBLE_DEVICES=0 \
         yourname/comic_upscale:latest \
         python /app/upscale.py \
             --input /app/data/input \
             --output /app/data/output \
             --scale $SCALE \
-            --workers $WORKERS
+            --workers $WORKERS \
+            --procs $PROCS \
+            --devices $DEVICES
 "
 
 echo "Container started!"
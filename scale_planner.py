@@ -0,0 +1,135 @@
+"""
+Comic Upscale - Scale Planner
+Picks the cheapest way to reach a (fractional) output scale.
+
+Real-ESRGAN models have a fixed native scale (x4 or x2). The naive way to
+get 2.5x is a full x4 pass followed by a downscale, which spends 16 output
+pixels of compute per input pixel and throws away 60% of them. Routes:
+
+    native     model scale == requested scale; one pass, nothing wasted.
+    downscale  full model pass, then area-downscale to the target.
+               Best quality (all input detail reaches the model), full cost.
+    upscale    smaller model (x2 for 2.5x), then a Lanczos resize by the
+               remaining factor. ~1/3 of the x4 cost; slightly softer
+               edges, since the last 1.25x is interpolated.
+    prescale   area-downscale the input to scale/native first, then a model
+               pass lands exactly on the target. Cost scales with
+               (scale/native)^2, ~0.4x at 2.5x; fine detail below the
+               shrunken input's resolution is lost, so it is only used
+               when that input is still large.
+
+--quality picks which routes are allowed:
+    max        native / downscale with the job's model (previous behaviour)
+    balanced   adds upscale when the residual resize is <= 1.5x, and
+               prescale when the shrunken input keeps a short side of
+               PRESCALE_MIN_SIDE px (high-resolution scans)
+    fast       every route; the cheapest wins
+"""
+
+from dataclasses import dataclass
+
+QUALITY_LEVELS = ('max', 'balanced', 'fast')
+
+# Native scale of the x2 models (everything else is x4)
+NATIVE_SCALE = {
+    'RealESRGAN_x2plus': 2,
+    'realesrgan-x2plus': 2,
+}
+
+# Smaller model that produces the same look, for the 'upscale' route
+COMPANION_MODEL = {
+    'RealESRGAN_x4plus': 'RealESRGAN_x2plus',
+}
+
+MAX_RESIDUAL_UPSCALE = 1.5  # balanced: largest interpolated factor after the model
+PRESCALE_MIN_SIDE = 1200  # balanced: shortest side the shrunken input must keep
+
+
+def native_scale(model_name: str) -> int:
+    """Native upscale factor of a model."""
+    return NATIVE_SCALE.get(model_name, 4)
+
+
+def _model_cost(model_name: str) -> float:
+    from webui.scheduler import MODEL_COST
+    return MODEL_COST.get(model_name, 1.0)
+
+
+@dataclass(frozen=True)
+class Route:
+    """How one image reaches its output scale."""
+    name: str
+    model_name: str
+    prescale: float  # input resize before the model (1.0 = none)
+    cost: float  # relative inference cost per input megapixel
+
+    def describe(self, scale: float) -> str:
+        model_scale = native_scale(self.model_name)
+        steps = []
+        if self.prescale != 1.0:
+            steps.append(f"input x{self.prescale:.2f}")
+        steps.append(f"{self.model_name} x{model_scale}")
+        residual = scale / (self.prescale * model_scale)
+        if abs(residual - 1.0) > 1e-6:
+            steps.append(f"resize x{residual:.2f}")
+        return f"{self.name}: {' -> '.join(steps)}"
+
+
+def select_model(model_name: str, scale: float, quality: str = 'balanced') -> str:
+    """Model to load for a parameter group: the job's model or its smaller companion."""
+    companion = COMPANION_MODEL.get(model_name)
+    if quality == 'max' or companion is None:
+        return model_name
+    if scale >= native_scale(model_name):
+        return model_name  # the full model is needed anyway
+    if quality == 'balanced' and scale / native_scale(companion) > MAX_RESIDUAL_UPSCALE:
+        return model_name
+    return companion if _model_cost(companion) < _model_cost(model_name) else model_name
+
+
+def plan_route(model_name: str, scale: float, height: int, width: int, quality: str = 'balanced') -> Route:
+    """Cheapest allowed route for one image with the loaded model."""
+    model_scale = native_scale(model_name)
+    cost = _model_cost(model_name)
+
+    if abs(scale - model_scale) < 1e-6:
+        return Route('native', model_name, 1.0, cost)
+    if scale > model_scale:
+        return Route('upscale', model_name, 1.0, cost)
+
+    prescale = scale / model_scale
+    if quality == 'fast' or (quality == 'balanced' and min(height, width) * prescale >= PRESCALE_MIN_SIDE):
+        return Route('prescale', model_name, prescale, cost * prescale ** 2)
+    return Route('downscale', model_name, 1.0, cost)
+
+
+def apply_route(model, route: Route, img, scale: float, flat_threshold: float = 0.0, pool=None):
+    """
+    Run an image through a route; output is exactly int(w*scale) x int(h*scale).
+    With flat_threshold > 0, uniform tiles skip the model (see flat_tiles.py).
+    Resize results go to buffers from pool (see buffer_pool.py) if given.
+    Returns:
+        (output, fraction of a whole-image model pass saved by flat tiles)
+    """
+    import cv2
+    from buffer_pool import pooled
+    height, width = img.shape[:2]
+    target = (int(width * scale), int(height * scale))
+
+    if route.prescale != 1.0:
+        small = (max(1, round(width * route.prescale)), max(1, round(height * route.prescale)))
+        img = cv2.resize(img, small, pooled(pool, small[::-1] + img.shape[2:], img.dtype),
+                         interpolation=cv2.INTER_AREA)
+
+    if flat_threshold > 0:
+        from flat_tiles import enhance_skipping_flat
+        output, skipped = enhance_skipping_flat(model, img, native_scale(route.model_name), flat_threshold, pool)
+    else:
+        output, _ = model.enhance(img, outscale=native_scale(route.model_name))
+        skipped = 0.0
+
+    if (output.shape[1], output.shape[0]) != target:
+        shrinking = output.shape[1] > target[0]
+        output = cv2.resize(output, target, pooled(pool, target[::-1] + output.shape[2:], output.dtype),
+                            interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LANCZOS4)
+    return output, skipped
@@ -0,0 +1,384 @@
+"""
+Comic Upscale - Multi-process Worker Supervisor
+Spawns one worker process per device slot (GPU or CPU thread-slice). Every
+worker claims jobs from the shared SQLite queue via ImageJob.claim_next, so
+several GPUs / CPU cores drain one queue in parallel.
+
+The supervisor restarts crashed workers (returning their in-flight jobs to
+the queue), reports aggregate throughput and, when its cost watchdog fires,
+drains all workers (they finish their current job and exit).
+
+Usage (through upscale.py):
+    python upscale.py -i in -o out --procs 2 --devices cuda:0,cuda:1
+    python upscale.py -i in -o out --procs 4 --devices cpu --backend stub
+"""
+
+import logging
+import multiprocessing as mp
+import os
+import queue
+import socket
+import subprocess
+import time
+
+from log_setup import KEEP, forward_worker_logs
+from webui.models import MAX_CRASHES
+
+logger = logging.getLogger(__name__)
+
+
+def _gpu_count() -> int:
+    """Number of GPUs visible to this process (0 if no NVIDIA driver)."""
+    visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+    if visible is not None:
+        return len([d for d in visible.split(',') if d.strip()])
+    try:
+        result = subprocess.run(['nvidia-smi', '-L'], capture_output=True, text=True, timeout=10)
+        return len([line for line in result.stdout.splitlines() if line.startswith('GPU ')])
+    except Exception:
+        return 0
+
+
+def plan_devices(spec: str, procs: int) -> list:
+    """
+    Turn a --devices spec into one slot per worker process.
+    Args:
+        spec: 'auto', 'cpu' or a comma list like 'cuda:0,cuda:1'
+        procs: requested process count (1 = one per device)
+    Returns:
+        list of {'device': 'cuda:N' | 'cpu', 'threads': int | None}
+    """
+    if spec == 'auto':
+        gpus = _gpu_count()
+        devices = [f'cuda:{i}' for i in range(gpus)] or ['cpu']
+    else:
+        devices = [d.strip() for d in spec.split(',') if d.strip()]
+
+    count = procs if procs > 1 else len(devices)
+    assigned = [devices[i % len(devices)] for i in range(count)]
+
+    # CPU workers split the cores between them instead of oversubscribing
+    cpu_slots = assigned.count('cpu')
+    threads = max(1, (os.cpu_count() or 1) // cpu_slots) if cpu_slots else None
+
+    return [{'device': d, 'threads': threads if d == 'cpu' else None} for d in assigned]
+
+
+def _bind_device(slot: dict) -> str:
+    """Restrict this (fresh) process to its slot; must run before torch is imported."""
+    device = slot['device']
+    if device.startswith('cuda'):
+        index = int(device.split(':')[1]) if ':' in device else 0
+        visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+        if visible:
+            index = visible.split(',')[index].strip()
+        os.environ['CUDA_VISIBLE_DEVICES'] = str(index)
+        return 'cuda'
+
+    os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    threads = str(slot['threads'] or 1)
+    os.environ['OMP_NUM_THREADS'] = threads
+    os.environ['MKL_NUM_THREADS'] = threads
+    return 'cpu'
+
+
+def _worker_main(worker_id: str, slot: dict, config: dict, events, drain, log_queue):
+    """Worker process: claim → upscale → record, until the queue is drained."""
+    from log_setup import end_rate_limit, setup_worker_logging
+    setup_worker_logging(log_queue, config.get('log_rate', 0), config.get('log_level', logging.INFO))
+
+    device = _bind_device(slot)
+    os.environ['DATABASE_PATH'] = config['db']
+
+    if slot['threads']:
+        try:
+            import cv2
+            cv2.setNumThreads(slot['threads'])
+            import torch
+            torch.set_num_threads(slot['threads'])
+        except ImportError:
+            pass
+
+    from upscale import UpscaleEngine
+    from webui.app import create_app
+    from webui.models import ImageJob
+    from webui.scheduler import execution_plan, next_group, preempted, LoadBackoff
+
+    app = create_app()
+    with app.app_context():
+        # Jobs left over from a previous incarnation of this slot
+        stale, failed = ImageJob.requeue_worker(worker_id)
+        if stale or failed:
+            logger.info(f"[{worker_id}] Requeued {stale} stale job(s), failed {failed}", extra=KEEP)
+
+        engine = UpscaleEngine(
+            scale=config['scale'],
+            workers=1,
+            model_name=config['model_name'],
+            denoise_strength=config['denoise_strength'],
+            face_enhance=config['face_enhance'],
+            tile_size=config['tile_size'],
+            face_gate=config['face_gate'],
+            quality=config['quality'],
+            flat_threshold=config['flat_threshold'],
+            gray_tolerance=config['gray_tolerance'],
+            gray_mode=config['gray_mode'],
+            compile_mode=config.get('compile_mode', 'off'),
+            pool_mb=config.get('pool_mb', 0),
+            device=device,
+            backend=config['backend']
+        )
+        logger.info(f"[{worker_id}] Ready on {slot['device']}", extra=KEEP)
+
+        # Same execution plan as the in-process engine: one parameter group
+        # at a time, re-planned whenever a group is exhausted, preempted or
+        # has used its quantum
+        backoff = LoadBackoff(config['follow'])
+        poll_interval = config.get('poll_interval', 5)
+        while not drain.is_set():
+            ImageJob.requeue_expired()  # remote leases that ran out
+            plan = execution_plan()
+            ready = backoff.ready(plan)
+            if not ready:
+                wait = backoff.wait(plan) if plan else None
+                if wait is None and not config['follow']:
+                    break
+                drain.wait(min(wait, poll_interval) if wait is not None else poll_interval)
+                continue
+
+            group = next_group(ready, engine.params)
+            if not engine.configure(group['params']):
+                engine.load_failed(group['params'], backoff)
+                continue
+            backoff.loaded(group['params'])
+
+            started, claimed = time.time(), 0
+            while not drain.is_set() and not preempted(group['params'], group['priority'], started, claimed):
+                job = ImageJob.claim_next(worker_id, params=group['params'])
+                if job is None:
+                    break
+                claimed += 1
+                _run_job(engine, job, config, worker_id, events)
+
+        events.put(dict(engine.run_stats(), type='stats', worker_id=worker_id))
+    end_rate_limit()
+
+
+def _run_job(engine, job, config: dict, worker_id: str, events):
+    """Upscale one claimed job and record the result."""
+    from datetime import datetime
+    from upscale import default_output_path
+    from webui.models import db
+
+    events.put({'type': 'claim', 'worker_id': worker_id})
+
+    output_path = job.output_path or default_output_path(
+        config['output_dir'], engine.scale, job.original_path
+    )
+
+    start = time.time()
+    result = engine._process_image(job.original_path, output_path, job.id, worker_id)
+    elapsed = time.time() - start
+
+    if result['success']:
+        job.status = 'completed'
+        job.progress_percent = 100
+        job.output_path = result['output_path']
+        job.skipped_fraction = result['skipped_fraction']
+        job.is_grayscale = result['is_grayscale']
+        job.completed_at = datetime.utcnow()
+    else:
+        job.status = 'failed'
+        job.error_message = result['error']
+    db.session.commit()
+
+    events.put({
+        'type': 'job',
+        'worker_id': worker_id,
+        'success': result['success'],
+        'seconds': elapsed,
+        'pixels': result.get('pixels', 0)
+    })
+
+
+def _sum_stats(dicts) -> dict:
+    """Add up per-worker counters."""
+    total = {}
+    for stats in dicts:
+        for key, value in stats.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+class WorkerSupervisor:
+    """Runs and babysits worker processes sharing the SQLite job queue."""
+
+    def __init__(self, slots: list, worker_config: dict, on_crash=None,
+                 max_restarts: int = 3, report_interval: float = 30.0, watchdog=None):
+        """
+        Args:
+            slots: output of plan_devices()
+            worker_config: engine/queue settings passed to every worker
+            on_crash: callback(worker_id, crashed) to requeue a dead worker's jobs;
+                returns (requeued, failed), see ImageJob.requeue_worker
+            max_restarts: restarts per slot before giving up on it
+            report_interval: seconds between throughput log lines
+            watchdog: optional cost_watchdog.Watchdog deciding when to drain
+        """
+        self.slots = slots
+        self.worker_config = worker_config
+        self.on_crash = on_crash
+        self.max_restarts = max_restarts
+        self.report_interval = report_interval
+        self.watchdog = watchdog
+
+        self._ctx = mp.get_context('spawn')  # CUDA cannot be forked
+        self._events = None
+        self._drain = None
+        self._log_queue = None
+        self._in_flight = {}
+        self._procs = {}
+        self._restarts = {}
+        self.stats = {}
+        self.engine_stats = {}
+        self.started_at = None
+
+        host = socket.gethostname()
+        self._worker_ids = [f"{host}:{i}" for i in range(len(slots))]
+
+    def _start(self, index: int):
+        worker_id = self._worker_ids[index]
+        proc = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.slots[index], self.worker_config, self._events, self._drain, self._log_queue),
+            name=f"upscale-worker-{index}",
+            daemon=False
+        )
+        proc.start()
+        self._procs[index] = proc
+        logger.info(f"Started worker {worker_id} (pid {proc.pid}) on {self.slots[index]['device']}", extra=KEEP)
+
+    def _drain_events(self, timeout: float = 0.0):
+        """Fold worker job events into per-worker stats."""
+        while True:
+            try:
+                event = self._events.get(timeout=timeout)
+            except queue.Empty:
+                return
+            timeout = 0.0
+            if event['type'] == 'claim':
+                self._in_flight[event['worker_id']] = 1
+                continue
+            if event['type'] == 'stats':
+                self.engine_stats[event['worker_id']] = event
+                continue
+            self._in_flight[event['worker_id']] = 0
+            stats = self.stats.setdefault(event['worker_id'], {
+                'completed': 0, 'failed': 0, 'seconds': 0.0, 'pixels': 0
+            })
+            stats['completed' if event['success'] else 'failed'] += 1
+            stats['seconds'] += event['seconds']
+            stats['pixels'] += event['pixels']
+
+    def _reap(self):
+        """Handle exited workers: restart crashes, retire clean exits."""
+        for index, proc in list(self._procs.items()):
+            if proc.is_alive():
+                continue
+            proc.join()
+            del self._procs[index]
+            worker_id = self._worker_ids[index]
+            self._in_flight[worker_id] = 0
+
+            if proc.exitcode == 0:
+                logger.info(f"Worker {worker_id} finished (queue drained)", extra=KEEP)
+                continue
+            logger.warning(f"Worker {worker_id} crashed (exit code {proc.exitcode})")
+            if self.on_crash:
+                requeued, failed = self.on_crash(worker_id, True)
+                logger.info(f"Requeued {requeued} job(s) from {worker_id}", extra=KEEP)
+                if failed:
+                    logger.error(f"Failed {failed} job(s) that crashed a worker {MAX_CRASHES} times")
+
+            restarts = self._restarts.get(index, 0)
+            if self._drain.is_set():
+                logger.info(f"Draining, not restarting {worker_id}", extra=KEEP)
+            elif restarts < self.max_restarts:
+                self._restarts[index] = restarts + 1
+                logger.info(f"Restarting {worker_id} ({restarts + 1}/{self.max_restarts})", extra=KEEP)
+                self._start(index)
+            else:
+                logger.error(f"Worker {worker_id} exceeded {self.max_restarts} restarts, giving up on slot")
+
+    def request_drain(self):
+        """Workers finish their current job and exit without claiming more."""
+        self._drain.set()
+
+    def summary(self) -> dict:
+        """Aggregate throughput across all workers."""
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        completed = sum(s['completed'] for s in self.stats.values())
+        failed = sum(s['failed'] for s in self.stats.values())
+        pixels = sum(s['pixels'] for s in self.stats.values())
+        return {
+            'completed': completed,
+            'failed': failed,
+            'elapsed': elapsed,
+            'images_per_sec': completed / elapsed if elapsed > 0 else 0.0,
+            'mpix_per_sec': pixels / 1e6 / elapsed if elapsed > 0 else 0.0,
+            'workers_alive': len(self._procs),
+            'restarts': sum(self._restarts.values()),
+            'plan': _sum_stats(s['plan'] for s in self.engine_stats.values()),
+            'routes': _sum_stats(s['routes'] for s in self.engine_stats.values()),
+            'flat': _sum_stats(s['flat'] for s in self.engine_stats.values()),
+            'gray': _sum_stats(s['gray'] for s in self.engine_stats.values()),
+            'face': _sum_stats(s['face'] for s in self.engine_stats.values()),
+            'compile': _sum_stats(s.get('compile', {}) for s in self.engine_stats.values()),
+            'pool': _sum_stats(s.get('pool', {}) for s in self.engine_stats.values()),
+            'per_worker': self.stats
+        }
+
+    def _report(self):
+        s = self.summary()
+        logger.info(
+            f"Throughput: {s['images_per_sec']:.2f} img/s ({s['mpix_per_sec']:.2f} MP/s) | "
+            f"done {s['completed']}, failed {s['failed']} | "
+            f"workers {s['workers_alive']}/{len(self.slots)}, restarts {s['restarts']}"
+        )
+
+    def run(self) -> dict:
+        """Start all workers and block until every slot has exited."""
+        self._events = self._ctx.Queue()
+        self._drain = self._ctx.Event()
+        # Worker processes log into this queue; records land in our handlers
+        self._log_queue = self._ctx.Queue()
+        log_forwarder = forward_worker_logs(self._log_queue)
+        self.started_at = time.time()
+        for index in range(len(self.slots)):
+            self._start(index)
+
+        last_report = time.time()
+        try:
+            while self._procs:
+                self._drain_events(timeout=1.0)
+                self._reap()
+                if time.time() - last_report >= self.report_interval:
+                    self._report()
+                    last_report = time.time()
+                if self.watchdog and not self._drain.is_set() and self.watchdog.due():
+                    if self.watchdog.poll(sum(self._in_flight.values())):
+                        self.request_drain()
+        except KeyboardInterrupt:
+            logger.warning("Interrupted, terminating workers...")
+            for index, proc in self._procs.items():
+                proc.terminate()
+                proc.join()
+                if self.on_crash:
+                    self.on_crash(self._worker_ids[index], False)
+            raise
+        finally:
+            log_forwarder.stop()
+
+        self._drain_events()
+        self._report()
+        return self.summary()
@@ -0,0 +1,62 @@
+"""
+Shared fixtures: a Flask app on a throwaway SQLite queue and small test pages.
+Everything runs on CPU with the stub backend (no weights; only the compiled
+inference tests need torch, and skip without it).
+"""
+
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import webui.app  # noqa: E402
+from webui.models import db, ImageJob  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'upscale.db')
+
+
+@pytest.fixture
+def app(db_path, monkeypatch):
+    """App bound to a fresh queue database, with an app context pushed."""
+    monkeypatch.setattr(webui.app, 'DATABASE_PATH', db_path)
+    monkeypatch.setenv('DATABASE_PATH', db_path)
+    app = webui.app.create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+def write_page(path, width=64, height=48, seed=0):
+    """Small noisy color page (never flat, never grayscale)."""
+    rng = np.random.default_rng(seed)
+    cv2.imwrite(str(path), rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    return str(path)
+
+
+def add_jobs(count, tmp_path, sched_tag=None, **params):
+    """Pending jobs over real input files; returns their ids."""
+    os.makedirs(tmp_path / 'in', exist_ok=True)
+    ids = []
+    for i in range(count):
+        path = write_page(tmp_path / 'in' / f'page_{len(ids)}_{os.urandom(4).hex()}.png', seed=i)
+        job = ImageJob(
+            filename=os.path.basename(path), original_path=path, status='pending',
+            sched_tag=i if sched_tag is None else sched_tag + i,
+            **dict({'model_name': 'RealESRGAN_x4plus_anime', 'scale_factor': 2, 'tile_size': 0,
+                    'face_enhance': False, 'denoising_level': 0}, **params)
+        )
+        db.session.add(job)
+        db.session.flush()
+        ids.append(job.id)
+    db.session.commit()
+    return ids
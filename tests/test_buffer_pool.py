@@ -0,0 +1,22 @@
+"""
+Buffer pool: off by default, reuses buffers across leases when enabled.
+"""
+
+import numpy as np
+
+from buffer_pool import BufferPool
+from upscale import UpscaleEngine
+
+
+def test_pool_is_opt_in():
+    assert UpscaleEngine(backend='stub', device='cpu').buffer_pool is None
+    assert UpscaleEngine(backend='stub', device='cpu', pool_mb=64).buffer_pool is not None
+
+
+def test_lease_returns_buffers_for_reuse():
+    pool = BufferPool(16 * 1024 * 1024)
+    for _ in range(3):
+        with pool.lease():
+            pool.acquire((480, 640, 3), np.uint8)
+    assert pool.stats['misses'] == 1 and pool.stats['hits'] == 2
+    assert pool.stats['in_use_bytes'] == 0
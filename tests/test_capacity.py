@@ -0,0 +1,78 @@
+"""
+Capacity planner: throughput fit from job durations and the forecast.
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import add_jobs
+from webui.capacity import estimate, fit_throughput
+from webui.models import ImageJob, db
+from webui.retention import archive_jobs
+
+ANIME = 'RealESRGAN_x4plus_anime'
+T0 = datetime(2025, 1, 1, 12, 0, 0)
+
+
+def _complete(tmp_path, batch_id, worker_id, durations, start=T0, megapixels=1.0, model=ANIME):
+    """Completed jobs run back to back on one worker slot from start."""
+    ids = add_jobs(len(durations), tmp_path, model_name=model)
+    for job_id, seconds in zip(ids, durations):
+        job = db.session.get(ImageJob, job_id)
+        job.status, job.batch_id, job.worker_id = 'completed', batch_id, worker_id
+        job.pixel_count = int(megapixels * 1e6)
+        job.started_at, job.completed_at = start, start + timedelta(seconds=seconds)
+        start = job.completed_at
+    db.session.commit()
+    return ids
+
+
+def test_fit_ignores_idle_gaps_and_stragglers(app, tmp_path):
+    # Host a: 4 x 1 MP in 10 s each. Host b starts an hour later and runs 4 more.
+    _complete(tmp_path, 'B1', 'a:main:0', [10] * 4)
+    _complete(tmp_path, 'B1', 'b:remote:1', [10] * 4, start=T0 + timedelta(hours=1))
+    rate = fit_throughput()[ANIME]
+    assert rate['mp_per_sec'] == pytest.approx(0.1)
+    assert rate['samples'] == 1
+
+
+def test_fit_divides_slot_time_by_concurrency(app, tmp_path):
+    # Two slots on one host in parallel, 20 s per 1 MP job each: the node does 0.1 MP/s
+    for slot in range(2):
+        _complete(tmp_path, 'B1', f'a:main:{slot}', [20] * 3)
+    assert fit_throughput()[ANIME]['mp_per_sec'] == pytest.approx(0.1)
+
+
+def test_fit_keeps_history_after_archiving(app, tmp_path):
+    _complete(tmp_path, 'B1', 'a:main:0', [10] * 4, start=datetime.utcnow() - timedelta(days=60))
+    # Same slot, same batch: two jobs archived, two still live
+    _complete(tmp_path, 'B2', 'a:main:0', [10] * 2, start=datetime.utcnow() - timedelta(days=60))
+    archive_jobs(days=30)
+    _complete(tmp_path, 'B2', 'a:main:0', [10] * 2)
+    assert ImageJob.query.count() == 2
+
+    rate = fit_throughput()[ANIME]
+    assert rate['mp_per_sec'] == pytest.approx(0.1)
+    assert rate['samples'] == 2
+
+
+def test_fit_needs_min_jobs_per_run(app, tmp_path):
+    _complete(tmp_path, 'B1', 'a:main:0', [10] * 2)
+    assert fit_throughput() == {}
+
+
+def test_estimate_uses_fit_for_pending_work(app, tmp_path):
+    _complete(tmp_path, 'B1', 'a:main:0', [10] * 4)
+    add_jobs(5, tmp_path, model_name=ANIME)
+    for job in ImageJob.query.filter_by(status='pending'):
+        job.pixel_count = 2_000_000
+    db.session.commit()
+
+    report = estimate(hourly_rate=1.0, max_nodes=2)
+    assert report['pending_jobs'] == 5
+    assert report['pending_megapixels'] == pytest.approx(10.0)
+    assert report['throughput'][ANIME]['source'] == 'history'
+    single, double = report['options']
+    assert single['wall_seconds'] == pytest.approx(60 + 100)  # startup + 10 MP at 0.1 MP/s
+    assert double['wall_seconds'] == pytest.approx(60 + 50)
@@ -0,0 +1,84 @@
+"""
+Compiled inference on CPU: TorchScript buckets against eager, padding and
+cropping, late buckets and rebucketing after a tile size change.
+"""
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from compiled_infer import BucketedModel, bucket_sides, new_compile_stats  # noqa: E402
+
+SCALE = 2
+EDGE = 8  # input pixels near the padded bottom/right edge that may differ from eager
+
+
+def _network():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(3, 8, 3, padding=1), torch.nn.LeakyReLU(0.2),
+        torch.nn.Conv2d(8, 3 * SCALE ** 2, 3, padding=1), torch.nn.PixelShuffle(SCALE)
+    ).eval()
+
+
+@pytest.fixture(scope='module')
+def bucketed():
+    """Eager network and its warmed-up script-mode BucketedModel over sides 8, 16, 32."""
+    network = _network()
+    model = BucketedModel(_network(), 'script', bucket_sides(20, tile_pad=6), SCALE, new_compile_stats())
+    model.warm_up()
+    return network, model
+
+
+def _eager(network, x):
+    with torch.no_grad():
+        return network(x)
+
+
+def test_warm_up_compiles_every_bucket(bucketed):
+    _, model = bucketed
+    assert model.sides == [8, 16, 32]
+    assert model.stats['buckets'] == 9 and model.stats['late_buckets'] == 0
+    assert model.stats['bench_runs'] > 0
+
+
+def test_bucket_sized_input_matches_eager(bucketed):
+    network, model = bucketed
+    x = torch.rand(1, 3, 16, 32)
+    assert torch.allclose(model(x), _eager(network, x), atol=1e-5)
+
+
+def test_padded_input_is_cropped_and_matches_eager_inside(bucketed):
+    network, model = bucketed
+    before = dict(model.stats)
+    x = torch.rand(1, 3, 13, 27)  # padded to the 16x32 bucket
+    output = model(x)
+    assert output.shape == (1, 3, 13 * SCALE, 27 * SCALE)
+    assert output.is_contiguous() and not output.is_inference()
+
+    eager = _eager(network, x)
+    interior = (slice(None), slice(None), slice(0, (13 - EDGE) * SCALE), slice(0, (27 - EDGE) * SCALE))
+    assert torch.allclose(output[interior], eager[interior], atol=1e-5)
+    assert model.stats['calls'] == before['calls'] + 1
+    assert model.stats['pixels'] - before['pixels'] == 13 * 27
+    assert model.stats['padded_pixels'] - before['padded_pixels'] == 16 * 32 - 13 * 27
+
+
+def test_oversized_input_compiles_a_late_bucket():
+    network = _network()
+    model = BucketedModel(network, 'script', [8, 16], SCALE, new_compile_stats())
+    model.warm_up()
+    x = torch.rand(1, 3, 20, 130)  # beyond every bucket: rounded up to 128 x 256
+    output = model(x)
+    assert output.shape == (1, 3, 20 * SCALE, 130 * SCALE)
+    assert (128, 256) in model._warm and model.stats['late_buckets'] == 1
+
+
+def test_rebucket_compiles_new_sides_lazily():
+    model = BucketedModel(_network(), 'script', [8, 16], SCALE, new_compile_stats())
+    model.warm_up()
+    model.rebucket([24, 12])
+    assert model.sides == [12, 24]
+    model(torch.rand(1, 3, 20, 10))
+    assert (24, 12) in model._warm
+    assert model.stats['buckets'] == 5 and model.stats['late_buckets'] == 1
@@ -0,0 +1,144 @@
+"""
+Cost watchdog policies, driven by FakeProbe and a fake clock.
+"""
+
+import asyncio
+import json
+from argparse import Namespace
+
+import pytest
+
+from cost_watchdog import (
+    EXIT_BUDGET, EXIT_DEADLINE, EXIT_IDLE, BudgetCapPolicy, CostTracker, DeadlinePolicy, FakeProbe,
+    IdleTimeoutPolicy, Watchdog, build_watchdog
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def make_watchdog(readings, policies, hourly_rate=3600.0, poll_interval=30):
+    """Watchdog on a fake clock; hourly_rate=3600 makes cost == elapsed seconds in USD."""
+    clock = FakeClock()
+    watchdog = Watchdog(FakeProbe(readings), policies, CostTracker(hourly_rate, clock=clock),
+                        poll_interval=poll_interval, gpu_threshold=5.0, clock=clock)
+    return watchdog, clock
+
+
+def run_polls(watchdog, clock, polls, in_flight=0):
+    """Advance one poll interval at a time; returns (poll index, decision) of the first shutdown."""
+    for index in range(polls):
+        clock.advance(watchdog.poll_interval)
+        assert watchdog.due()
+        decision = watchdog.poll(in_flight)
+        if decision:
+            return index, decision
+    return None, None
+
+
+def test_idle_policy_fires_after_timeout():
+    watchdog, clock = make_watchdog([0.0], [IdleTimeoutPolicy(90)])
+    index, decision = run_polls(watchdog, clock, 10)
+    assert index == 2  # 30 + 30 + 30 s idle
+    assert decision['policy'] == 'idle' and decision['exit_code'] == EXIT_IDLE == 10
+    assert watchdog.shutdown is decision
+    assert watchdog.cost.idle_cost == pytest.approx(90.0)
+
+
+def test_busy_gpu_resets_idle_timer():
+    watchdog, clock = make_watchdog([0.0, 0.0, 80.0, 0.0, 0.0, 0.0], [IdleTimeoutPolicy(90)])
+    index, decision = run_polls(watchdog, clock, 10)
+    assert index == 5  # the busy reading at poll 2 restarted the count
+    assert decision['exit_code'] == EXIT_IDLE
+
+
+def test_jobs_in_flight_are_never_idle():
+    watchdog, clock = make_watchdog([0.0], [IdleTimeoutPolicy(60)])
+    assert run_polls(watchdog, clock, 10, in_flight=1) == (None, None)
+    assert watchdog.idle_seconds == 0.0
+
+
+def test_failing_probe_counts_as_idle():
+    class BrokenProbe(FakeProbe):
+        def sample(self):
+            raise RuntimeError('driver gone')
+
+    watchdog, clock = make_watchdog([0.0], [IdleTimeoutPolicy(60)])
+    watchdog.probe = BrokenProbe()
+    index, decision = run_polls(watchdog, clock, 5)
+    assert index == 1 and decision['exit_code'] == EXIT_IDLE
+
+
+def test_budget_fires_one_poll_before_the_cap():
+    watchdog, clock = make_watchdog([90.0], [BudgetCapPolicy(100.0)], poll_interval=30)
+    index, decision = run_polls(watchdog, clock, 10)
+    assert index == 2  # $60 spent + $30 projected for the drain < $100; $90 + $30 >= $100
+    assert decision['policy'] == 'budget' and decision['exit_code'] == EXIT_BUDGET == 11
+    assert watchdog.cost.cost() < 100.0
+
+
+def test_deadline_leaves_a_poll_for_the_drain():
+    watchdog, clock = make_watchdog([90.0], [DeadlinePolicy(150)], poll_interval=30)
+    index, decision = run_polls(watchdog, clock, 10)
+    assert index == 3  # 120 s elapsed + 30 s grace reaches the 150 s deadline
+    assert decision['policy'] == 'deadline' and decision['exit_code'] == EXIT_DEADLINE == 12
+
+
+def test_first_policy_to_fire_wins():
+    watchdog, clock = make_watchdog([0.0], [IdleTimeoutPolicy(30), DeadlinePolicy(60)])
+    _, decision = run_polls(watchdog, clock, 1)
+    assert decision['policy'] == 'idle'
+
+
+def test_no_policies_never_shut_down():
+    watchdog, clock = make_watchdog([0.0], [])
+    assert run_polls(watchdog, clock, 20) == (None, None)
+    assert watchdog.shutdown is None
+
+
+def test_run_drains_engine():
+    class Engine:
+        processing_count = 0
+        draining = False
+
+        def request_drain(self):
+            self.draining = True
+
+    watchdog = Watchdog(FakeProbe([0.0]), [IdleTimeoutPolicy(0.02)], CostTracker(1.0), poll_interval=0.01)
+    engine = Engine()
+    decision = asyncio.run(asyncio.wait_for(watchdog.run(engine), timeout=5))
+    assert engine.draining and decision['exit_code'] == EXIT_IDLE
+
+
+def test_finish_shutdown_records_exit_code(tmp_path):
+    from upscale import finish_shutdown
+
+    watchdog, clock = make_watchdog([0.0], [IdleTimeoutPolicy(30)], hourly_rate=1.8)
+    run_polls(watchdog, clock, 1)
+    args = Namespace(shutdown_file=str(tmp_path / 'logs' / 'watchdog_shutdown.json'))
+    assert finish_shutdown(args, watchdog, completed=7) == EXIT_IDLE
+    record = json.loads(open(args.shutdown_file).read())
+    assert record['policy'] == 'idle' and record['exit_code'] == EXIT_IDLE and record['completed'] == 7
+
+    quiet, _ = make_watchdog([0.0], [])
+    assert finish_shutdown(args, quiet, completed=7) == 0
+
+
+def test_build_watchdog_from_cli_args():
+    args = Namespace(idle_timeout=300, budget=2.5, deadline=90, probe='fake', hourly_rate=0.5,
+                     poll_interval=15, gpu_threshold=5.0)
+    watchdog = build_watchdog(args)
+    assert [p.name for p in watchdog.policies] == ['idle', 'budget', 'deadline']
+    assert watchdog.policies[2].seconds == 90 * 60
+    assert watchdog.probe.name == 'fake'
+
+    args.idle_timeout, args.budget, args.deadline = 0, None, None
+    assert build_watchdog(args).policies == []
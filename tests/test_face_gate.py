@@ -0,0 +1,71 @@
+"""
+Face gate: detections shared through the on-disk cache, GFPGAN calls serialised.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from face_gate import FaceGate, FaceStore, enhance_face_regions
+
+
+class CountingDetector:
+    def __init__(self, boxes):
+        self.boxes = boxes
+        self.calls = 0
+
+    def __call__(self, img):
+        self.calls += 1
+        return self.boxes
+
+
+def test_store_shares_detections_between_gates(tmp_path):
+    page = tmp_path / 'page.png'
+    page.write_bytes(b'same content')
+    img = np.zeros((100, 80, 3), np.uint8)
+    path = str(tmp_path / 'face_cache.db')
+
+    first = CountingDetector([(10, 20, 30, 40)])
+    assert FaceGate(first, store=FaceStore(path)).faces_for(str(page), img) == [(10, 20, 30, 40)]
+
+    # Another worker process, or the next run: same file, fresh memory
+    second = CountingDetector([])
+    gate = FaceGate(second, store=FaceStore(path))
+    assert gate.faces_for(str(page), img) == [(10, 20, 30, 40)]
+    assert second.calls == 0 and gate.stats['cache_hits'] == 1
+
+
+def test_pages_without_faces_are_cached_too(tmp_path):
+    page = tmp_path / 'page.png'
+    page.write_bytes(b'no faces here')
+    img = np.zeros((10, 10, 3), np.uint8)
+    detector = CountingDetector([])
+    store = FaceStore(str(tmp_path / 'face_cache.db'))
+    FaceGate(detector, store=store).faces_for(str(page), img)
+    FaceGate(detector, store=store).faces_for(str(page), img)
+    assert detector.calls == 1
+
+
+def test_face_regions_hold_the_gfpgan_lock():
+    class Enhancer:
+        active = 0
+        overlapped = False
+
+        def enhance(self, crop, **kwargs):
+            Enhancer.active += 1
+            Enhancer.overlapped |= Enhancer.active > 1
+            time.sleep(0.01)
+            Enhancer.active -= 1
+            return None, None, crop
+
+    lock = threading.Lock()
+    output = np.zeros((400, 400, 3), np.uint8)
+    boxes = [(0, 0, 10, 10), (60, 60, 10, 10), (150, 150, 10, 10)]
+    threads = [threading.Thread(target=enhance_face_regions, args=(Enhancer(), output, boxes, 2.0, lock))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not Enhancer.overlapped
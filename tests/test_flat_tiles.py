@@ -0,0 +1,83 @@
+"""
+Flat tile skipping: the tile classifier, region merging, the feathered blend
+and the fallback to one model call when regions would cost more than a
+whole-image pass.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from flat_tiles import CONTEXT, FLAT_TILE, _regions, enhance_skipping_flat, flat_tiles
+
+
+class FakeModel:
+    """enhance() paints a constant over a nearest-neighbour upscale; records input shapes."""
+
+    def __init__(self, pre_pad=10, value=200):
+        self.pre_pad, self.value, self.calls = pre_pad, value, []
+
+    def enhance(self, img, outscale):
+        self.calls.append(img.shape[:2])
+        h, w = img.shape[:2]
+        output = cv2.resize(img, (w * outscale, h * outscale), interpolation=cv2.INTER_NEAREST)
+        output[...] = self.value
+        return output, None
+
+
+def _page(textured_tiles, size=512, seed=0):
+    """Flat gray page with noise in the given (row, col) tiles."""
+    rng = np.random.default_rng(seed)
+    page = np.full((size, size, 3), 100, dtype=np.uint8)
+    for row, col in textured_tiles:
+        block = page[row * FLAT_TILE:(row + 1) * FLAT_TILE, col * FLAT_TILE:(col + 1) * FLAT_TILE]
+        block[...] = rng.integers(0, 256, block.shape, dtype=np.uint8)
+    return page
+
+
+def test_classifier_marks_only_textured_tiles():
+    page = _page([(1, 2)], size=200)  # 4x4 grid, partial last row/column
+    expected = np.ones((4, 4), dtype=bool)
+    expected[1, 2] = False
+    assert (flat_tiles(page) == expected).all()
+    assert (flat_tiles(page.astype(np.uint16) * 257) == expected).all()
+
+
+def test_regions_merge_row_runs_downwards():
+    textured = np.zeros((4, 5), dtype=bool)
+    textured[0:3, 1:3] = True  # 3x2 block
+    textured[2, 3] = True  # widens the last row: a new run, not part of the block
+    textured[3, 0] = True
+    assert sorted(_regions(textured)) == [(0, 2, 1, 3), (2, 3, 1, 4), (3, 4, 0, 1)]
+
+
+def test_mostly_flat_page_reports_model_pixels_saved():
+    model = FakeModel(pre_pad=10)
+    output, saved = enhance_skipping_flat(model, _page([(2, 2)]), outscale=2)
+    side = FLAT_TILE + 2 * CONTEXT
+    assert model.calls == [(side, side)]
+    assert output.shape == (1024, 1024, 3)
+    assert saved == pytest.approx(1 - (side + 10) ** 2 / (512 + 10) ** 2)
+
+
+def test_scattered_texture_falls_back_to_one_call():
+    # Half the page is flat, but every textured tile drags in context on all sides
+    checkerboard = [(row, col) for row in range(8) for col in range(8) if (row + col) % 2]
+    model = FakeModel()
+    output, saved = enhance_skipping_flat(model, _page(checkerboard), outscale=2)
+    assert model.calls == [(512, 512)]
+    assert saved == 0.0 and (output == 200).all()
+
+
+def test_blend_feathers_over_the_context_margin():
+    output, _ = enhance_skipping_flat(FakeModel(), _page([(2, 2)]), outscale=2)
+    line = output[320, :, 0].astype(int)  # through the middle of the textured tile
+    start, end = 2 * FLAT_TILE * 2, 3 * FLAT_TILE * 2
+    context = CONTEXT * 2
+    step = 100 // 8  # a seam would jump by up to 100; bicubic bleed near the tile adds a little
+    assert (line[:start - context] == 100).all() and (line[end + context:] == 100).all()
+    assert (line[start:end] == 200).all()
+    ramp = line[start - context - 1:start + 1]
+    assert (np.diff(ramp) > 0).all() and np.abs(np.diff(ramp)).max() <= step
+    ramp = line[end - 1:end + context + 1]
+    assert (np.diff(ramp) < 0).all() and np.abs(np.diff(ramp)).max() <= step
@@ -0,0 +1,39 @@
+"""
+Grayscale detection: small colored areas keep a page in color, JPEG noise doesn't.
+"""
+
+import cv2
+import numpy as np
+
+from grayscale import is_grayscale
+
+
+def _gray_page(height=2000, width=1400, seed=0):
+    rng = np.random.default_rng(seed)
+    gray = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def test_gray_page_is_grayscale():
+    assert is_grayscale(_gray_page())
+    assert is_grayscale(_gray_page()[:, :, 0])
+
+
+def test_small_colored_block_keeps_page_in_color():
+    page = _gray_page()
+    page[100:150, 200:420] = (0, 0, 255)  # red title block, 0.39% of the page
+    assert not is_grayscale(page)
+
+
+def test_colored_detail_between_sample_points_is_found():
+    page = _gray_page()
+    page[101:103, 301:303] = (255, 0, 0)  # 2x2 px, off the stride-4 sample grid
+    assert not is_grayscale(page)
+
+
+def test_jpeg_chroma_noise_stays_within_tolerance():
+    page = _gray_page(400, 300)
+    page = cv2.GaussianBlur(page, (5, 5), 0)  # JPEG-like smooth content
+    ok, data = cv2.imencode('.jpg', page, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    decoded = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    assert is_grayscale(decoded, tolerance=6.0)
@@ -0,0 +1,34 @@
+"""
+Header probe: accepted formats match what the worker's decoder reads.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from webui.image_probe import SUPPORTED_EXTENSIONS, ProbeError, check_image, probe_image
+
+
+@pytest.mark.parametrize('ext', sorted(SUPPORTED_EXTENSIONS))
+def test_accepted_formats_decode(tmp_path, ext):
+    path = str(tmp_path / f'page{ext}')
+    ok, data = cv2.imencode('.jpg' if ext == '.jfif' else ext, np.full((30, 40, 3), 128, np.uint8))
+    with open(path, 'wb') as f:
+        f.write(data.tobytes())
+    info = probe_image(path)
+    assert (info['width'], info['height']) == (40, 30)
+    assert cv2.imread(path) is not None
+
+
+def test_gif_is_rejected(tmp_path):
+    path = tmp_path / 'page.gif'
+    path.write_bytes(b'GIF89a' + (40).to_bytes(2, 'little') + (30).to_bytes(2, 'little') + b'\x00' * 16)
+    with pytest.raises(ProbeError, match='GIF'):
+        probe_image(str(path))
+
+
+def test_oversized_image_is_rejected(tmp_path):
+    path = str(tmp_path / 'page.png')
+    cv2.imwrite(path, np.zeros((100, 100), np.uint8))
+    with pytest.raises(ProbeError, match='limit'):
+        check_image(path, max_megapixels=0.001)
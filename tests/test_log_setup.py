@@ -0,0 +1,68 @@
+"""
+Log rate limiting: lifecycle lines and the run summary survive --log-rate.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from conftest import ROOT, write_page
+from log_setup import KEEP, RateLimitFilter, end_rate_limit
+
+
+class Capture(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_end_rate_limit_lifts_filter_and_reports_drops():
+    root = logging.getLogger()
+    handler = Capture()
+    handler.addFilter(RateLimitFilter(1))
+    root.addHandler(handler)
+    level = root.level
+    root.setLevel(logging.INFO)
+    try:
+        log = logging.getLogger('test.rate')
+        for i in range(10):
+            log.info(f"job {i}")
+        log.info("worker finished", extra=KEEP)
+        end_rate_limit()
+        log.info("summary")
+    finally:
+        root.removeHandler(handler)
+        root.setLevel(level)
+
+    messages = [r.getMessage() for r in handler.records]
+    assert messages[0] == 'job 0' and 'job 9' not in messages
+    assert 'worker finished' in messages and messages[-1] == 'summary'
+    (report,) = [r for r in handler.records if getattr(r, 'suppressed', None)]
+    assert report.suppressed == 9
+    assert not handler.filters
+
+
+def test_run_summary_is_logged_under_log_rate(tmp_path):
+    os.makedirs(tmp_path / 'in')
+    for i in range(8):
+        write_page(tmp_path / 'in' / f'page_{i}.png', seed=i)
+    log_file = tmp_path / 'upscale.log'
+    result = subprocess.run([
+        sys.executable, os.path.join(ROOT, 'upscale.py'),
+        '-i', str(tmp_path / 'in'), '-o', str(tmp_path / 'out'), '--db', str(tmp_path / 'upscale.db'),
+        '--device', 'cpu', '--backend', 'stub', '--scale', '2', '--tile', '0', '--log-rate', '1',
+        '--log-file', str(log_file), '--shutdown-file', str(tmp_path / 'shutdown.json')
+    ], cwd=tmp_path, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    messages = [json.loads(line)['msg'] for line in log_file.read_text().splitlines()]
+    summary = messages[messages.index('=== Upscaling Complete ===') + 1:]
+    assert 'Completed: 8' in summary and 'Failed: 0' in summary
+    assert any(m.startswith('Execution plan:') for m in summary)
+    assert any(m.startswith('Cost:') for m in summary)
+    assert any('suppressed' in m for m in messages)
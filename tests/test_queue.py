@@ -0,0 +1,92 @@
+"""
+Shared SQLite queue: claim races between processes, crash requeue, and a
+multi-process supervisor run with the stub backend.
+"""
+
+import multiprocessing as mp
+import os
+import subprocess
+import sys
+
+from conftest import ROOT, add_jobs, write_page
+from webui.models import MAX_CRASHES, ImageJob, db
+
+
+def _claim_all(db_path, worker_id, out):
+    """Child process: claim until the queue is empty, report the ids."""
+    import webui.app
+    webui.app.DATABASE_PATH = db_path
+    with webui.app.create_app().app_context():
+        claimed = []
+        while (job := ImageJob.claim_next(worker_id)) is not None:
+            claimed.append(job.id)
+    out.put(claimed)
+
+
+def test_claim_race_hands_each_job_out_once(app, db_path, tmp_path):
+    ids = add_jobs(60, tmp_path)
+    ctx = mp.get_context('spawn')
+    out = ctx.Queue()
+    procs = [ctx.Process(target=_claim_all, args=(db_path, f'test:{i}', out)) for i in range(4)]
+    for proc in procs:
+        proc.start()
+    claimed = [job_id for _ in procs for job_id in out.get(timeout=60)]
+    for proc in procs:
+        proc.join(timeout=60)
+
+    assert sorted(claimed) == sorted(ids)
+    assert ImageJob.query.filter_by(status='processing').count() == len(ids)
+
+
+def test_claim_follows_fair_share_order(app, tmp_path):
+    late = add_jobs(2, tmp_path, sched_tag=10)
+    early = add_jobs(2, tmp_path, sched_tag=0)
+    order = [ImageJob.claim_next('test:0').id for _ in range(4)]
+    assert order == early + late
+
+
+def test_crashed_worker_jobs_are_requeued_then_failed(app, tmp_path):
+    (poison,) = add_jobs(1, tmp_path)
+    for attempt in range(1, MAX_CRASHES + 1):
+        assert ImageJob.claim_next('test:0').id == poison
+        requeued, failed = ImageJob.requeue_worker('test:0')
+        job = db.session.get(ImageJob, poison)
+        assert job.crashes == attempt
+        if attempt < MAX_CRASHES:
+            assert (requeued, failed) == (1, 0)
+            assert job.status == 'pending' and job.worker_id is None
+        else:
+            assert (requeued, failed) == (0, 1)
+            assert job.status == 'failed' and 'died' in job.error_message
+    assert ImageJob.claim_next('test:0') is None
+
+
+def test_interrupted_worker_jobs_do_not_count_as_crashes(app, tmp_path):
+    (job_id,) = add_jobs(1, tmp_path)
+    for _ in range(MAX_CRASHES + 1):
+        ImageJob.claim_next('test:0')
+        assert ImageJob.requeue_worker('test:0', crashed=False) == (1, 0)
+    job = db.session.get(ImageJob, job_id)
+    assert job.status == 'pending' and not job.crashes
+
+
+def test_supervisor_drains_queue_with_stub_workers(tmp_path):
+    os.makedirs(tmp_path / 'in')
+    for i in range(12):
+        write_page(tmp_path / 'in' / f'page_{i:02d}.png', seed=i)
+    db_path = str(tmp_path / 'upscale.db')
+    result = subprocess.run([
+        sys.executable, os.path.join(ROOT, 'upscale.py'),
+        '-i', str(tmp_path / 'in'), '-o', str(tmp_path / 'out'), '--db', db_path,
+        '--procs', '2', '--devices', 'cpu', '--backend', 'stub', '--scale', '2', '--tile', '0',
+        '--log-file', str(tmp_path / 'upscale.log'), '--shutdown-file', str(tmp_path / 'shutdown.json')
+    ], cwd=tmp_path, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    import sqlite3
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute('SELECT status, worker_id, output_path FROM image_job').fetchall()
+    assert len(rows) == 12
+    assert {status for status, _, _ in rows} == {'completed'}
+    assert len({worker_id for _, worker_id, _ in rows}) == 2
+    assert all(os.path.exists(path) for _, _, path in rows)
@@ -0,0 +1,86 @@
+"""
+Retention: archive export, output disposal and recovery from a pass that
+stopped between the copy and the delete.
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+
+from conftest import add_jobs, write_page
+from webui.models import ImageJob, db
+from webui.retention import ARCHIVE_TABLE, _attached, archive_jobs, archive_path, archived_filenames
+
+
+def _finish(job_ids, tmp_path, days_ago=40):
+    for job_id in job_ids:
+        job = db.session.get(ImageJob, job_id)
+        job.status = 'completed'
+        job.completed_at = datetime.utcnow() - timedelta(days=days_ago)
+        job.output_path = write_page(tmp_path / f'out_{job_id}.png')
+    db.session.commit()
+
+
+def _archived():
+    with sqlite3.connect(archive_path()) as conn:
+        return conn.execute(f'SELECT id, output_state FROM {ARCHIVE_TABLE} ORDER BY archive_id').fetchall()
+
+
+def test_archive_moves_old_rows_and_deletes_outputs(app, tmp_path):
+    old = add_jobs(3, tmp_path)
+    recent = add_jobs(1, tmp_path)
+    _finish(old, tmp_path)
+    _finish(recent, tmp_path, days_ago=1)
+
+    result = archive_jobs(days=30, outputs='delete')
+    assert result['archived'] == 3 and result['outputs'] == {'deleted': 3}
+    assert [job.id for job in ImageJob.query.all()] == recent
+    assert _archived() == [(job_id, 'deleted') for job_id in old]
+
+
+def test_archive_finishes_an_interrupted_pass(app, tmp_path):
+    ids = add_jobs(2, tmp_path)
+    _finish(ids, tmp_path)
+
+    # A pass that died after committing the copy: rows in both files, outputs untouched
+    with _attached() as conn:
+        conn.exec_driver_sql(
+            f'INSERT INTO archive.{ARCHIVE_TABLE} (id, filename, status, output_path, created_at) '
+            f'SELECT id, filename, status, output_path, created_at FROM {ImageJob.__tablename__}'
+        )
+        conn.commit()
+
+    result = archive_jobs(days=30, outputs='keep')
+    assert result['archived'] == 2
+    assert ImageJob.query.count() == 0
+    assert _archived() == [(job_id, 'kept') for job_id in ids]
+
+
+def test_reused_job_ids_get_their_own_archive_rows(app, tmp_path):
+    # Emptying the queue lets SQLite hand out the same ids again
+    first = add_jobs(2, tmp_path)
+    _finish(first, tmp_path)
+    names = {db.session.get(ImageJob, job_id).filename for job_id in first}
+    archive_jobs(days=30)
+
+    second = add_jobs(2, tmp_path)
+    assert second == first
+    _finish(second, tmp_path)
+    names |= {db.session.get(ImageJob, job_id).filename for job_id in second}
+    assert archive_jobs(days=30)['archived'] == 2
+
+    assert [job_id for job_id, _ in _archived()] == first + second
+    assert archived_filenames() == names
+
+
+def test_archive_from_before_archive_id_is_migrated(app, tmp_path):
+    with sqlite3.connect(archive_path()) as conn:
+        conn.execute(f'CREATE TABLE {ARCHIVE_TABLE} (id INTEGER PRIMARY KEY, filename VARCHAR(255), '
+                     f'status VARCHAR(20), created_at DATETIME, archived_at DATETIME, output_state VARCHAR(10))')
+        conn.execute(f"INSERT INTO {ARCHIVE_TABLE} VALUES (1, 'old.png', 'completed', '2024-01-01', "
+                     f"'2024-02-01', 'kept')")
+    ids = add_jobs(1, tmp_path)
+    _finish(ids, tmp_path)
+
+    archive_jobs(days=30)
+    assert _archived() == [(1, 'kept'), (ids[0], 'kept')]
+    assert 'old.png' in archived_filenames()
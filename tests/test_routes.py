@@ -0,0 +1,34 @@
+"""
+Admin UI form validation.
+"""
+
+import io
+
+import pytest
+
+from webui.models import ImageJob
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    return client
+
+
+@pytest.mark.parametrize('priority', ['abc', '99', '-5', ''])
+def test_upload_rejects_unknown_priority(client, priority):
+    response = client.post('/upload', data={
+        'preset': 'art', 'priority': priority,
+        'images': (io.BytesIO(b'not read'), 'page.png')
+    }, content_type='multipart/form-data', follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Unknown priority' in response.data
+    assert ImageJob.query.count() == 0
+
+
+def test_batch_priority_rejects_non_numeric(client):
+    response = client.post('/batch/upload-1/priority', data={'priority': 'abc'})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert ('error', 'Unknown priority: abc') in session['_flashes']
@@ -0,0 +1,61 @@
+"""
+Scale planner: route choice per quality level, the companion model switch
+and output sizes for every route.
+"""
+
+import numpy as np
+import pytest
+
+from scale_planner import apply_route, native_scale, plan_route, select_model
+from upscale import StubUpscaler
+
+X4, X2 = 'RealESRGAN_x4plus', 'RealESRGAN_x2plus'
+
+
+@pytest.mark.parametrize('model, scale, quality, expected', [
+    (X4, 2.5, 'balanced', X2),  # residual 1.25x after the x2 model
+    (X4, 3.5, 'balanced', X4),  # residual 1.75x is too soft
+    (X4, 3.5, 'fast', X2),
+    (X4, 2.5, 'max', X4),
+    (X4, 4, 'fast', X4),  # the full model is needed anyway
+    ('RealESRGAN_x4plus_anime', 2.5, 'fast', 'RealESRGAN_x4plus_anime'),  # no companion
+])
+def test_select_model(model, scale, quality, expected):
+    assert select_model(model, scale, quality) == expected
+
+
+@pytest.mark.parametrize('model, scale, size, quality, name, prescale', [
+    (X4, 4, 500, 'balanced', 'native', 1.0),
+    (X2, 2.5, 500, 'balanced', 'upscale', 1.0),
+    (X4, 2.5, 500, 'balanced', 'downscale', 1.0),
+    (X4, 2.5, 2000, 'max', 'downscale', 1.0),
+    (X4, 2.5, 2000, 'balanced', 'prescale', 0.625),  # shrunken input keeps 1250 px
+    (X4, 2.5, 1900, 'balanced', 'downscale', 1.0),  # 1187 px is below PRESCALE_MIN_SIDE
+    (X4, 2.5, 500, 'fast', 'prescale', 0.625),
+])
+def test_plan_route(model, scale, size, quality, name, prescale):
+    route = plan_route(model, scale, size, size, quality)
+    assert (route.name, route.model_name, route.prescale) == (name, model, prescale)
+
+
+def test_prescale_cost_scales_with_area():
+    assert plan_route(X4, 2.5, 500, 500, 'fast').cost == pytest.approx(0.625 ** 2)
+    assert plan_route(X4, 2.5, 500, 500, 'max').cost == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize('model, scale, quality, flat_threshold', [
+    (X4, 4, 'balanced', 0.0),  # native
+    (X2, 2.5, 'balanced', 0.0),  # upscale
+    (X4, 2.5, 'max', 0.0),  # downscale
+    (X4, 2.5, 'fast', 0.0),  # prescale
+    (X4, 2.5, 'fast', 2.0),  # prescale with flat tiles skipped
+    (X2, 3, 'balanced', 2.0),
+])
+def test_apply_route_hits_target_size(model, scale, quality, flat_threshold):
+    rng = np.random.default_rng(0)
+    img = np.full((301, 203, 3), 255, dtype=np.uint8)
+    img[:64, :64] = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    route = plan_route(model, scale, *img.shape[:2], quality)
+    output, skipped = apply_route(StubUpscaler(native_scale(model)), route, img, scale, flat_threshold)
+    assert output.shape == (int(301 * scale), int(203 * scale), 3)
+    assert (skipped > 0) == (flat_threshold > 0)
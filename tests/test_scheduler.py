@@ -0,0 +1,149 @@
+"""
+Execution plan: fair interleaving of parameter groups and model-load back-off.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+import webui.scheduler as scheduler
+from conftest import add_jobs
+from upscale import UpscaleEngine
+from webui.models import ImageJob, db
+from webui.scheduler import (
+    GROUP_QUANTUM_JOBS, LOAD_ATTEMPTS, LoadBackoff, execution_plan, next_group, preempted, schedule_batch
+)
+
+ANIME = {'model_name': 'RealESRGAN_x4plus_anime'}
+X4PLUS = {'model_name': 'RealESRGAN_x4plus'}
+
+
+def _batch(count, tmp_path, batch_id, **params):
+    ids = add_jobs(count, tmp_path, **params)
+    jobs = [db.session.get(ImageJob, job_id) for job_id in ids]
+    for job in jobs:
+        job.sched_tag = None
+    schedule_batch(jobs, batch_id)
+    db.session.commit()
+    return ids
+
+
+def _drain(engine_params=None, worker_id='test:0'):
+    """Single worker following the plan the way run_queue does; returns job ids in claim order."""
+    order, params = [], engine_params
+    while plan := execution_plan():
+        group = next_group(plan, params)
+        params, started, claimed = group['params'], time.time(), 0
+        while not preempted(params, group['priority'], started, claimed):
+            job = ImageJob.claim_next(worker_id, params=params)
+            if job is None:
+                break
+            claimed += 1
+            job.status = 'completed'
+            db.session.commit()
+            order.append(job.id)
+    return order
+
+
+def test_next_group_prefers_oldest_tag_over_current_params(app, tmp_path):
+    add_jobs(3, tmp_path, sched_tag=5, **ANIME)
+    add_jobs(3, tmp_path, sched_tag=1, **X4PLUS)
+    plan = execution_plan()
+    current = next(g['params'] for g in plan if g['params']['model_name'] == ANIME['model_name'])
+    assert next_group(plan, current)['params']['model_name'] == X4PLUS['model_name']
+
+
+def test_next_group_breaks_ties_by_switch_cost(app, tmp_path):
+    add_jobs(2, tmp_path, sched_tag=1, **ANIME)
+    add_jobs(2, tmp_path, sched_tag=1, **X4PLUS)
+    plan = execution_plan()
+    for group in plan:
+        assert next_group(plan, group['params']) is group
+
+
+def test_quantum_bounds_a_group_run(app, tmp_path):
+    add_jobs(20, tmp_path, sched_tag=0, **ANIME)
+    add_jobs(3, tmp_path, sched_tag=2, **X4PLUS)
+    anime = execution_plan()[0]['params']
+    assert anime['model_name'] == ANIME['model_name']
+
+    # Other group's head (2) is older than ours only after we've claimed past it
+    for _ in range(3):
+        ImageJob.claim_next('test:0', params=anime).status = 'completed'
+    db.session.commit()
+    assert not preempted(anime, 0)  # no quantum given: only priority preempts
+    assert not preempted(anime, 0, started=9e99, jobs=GROUP_QUANTUM_JOBS - 1)
+    assert preempted(anime, 0, started=9e99, jobs=GROUP_QUANTUM_JOBS)
+    assert preempted(anime, 0, started=0.0, jobs=0)  # time quantum used up
+
+
+def test_higher_priority_preempts_immediately(app, tmp_path):
+    add_jobs(5, tmp_path, sched_tag=0, **ANIME)
+    anime = execution_plan()[0]['params']
+    assert not preempted(anime, 0)
+    (urgent,) = add_jobs(1, tmp_path, sched_tag=100, **X4PLUS)
+    db.session.get(ImageJob, urgent).priority = 2
+    db.session.commit()
+    assert preempted(anime, 0)
+
+
+def test_equal_priority_batches_interleave(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, 'GROUP_QUANTUM_JOBS', 4)
+    big = add_jobs(20, tmp_path, sched_tag=0, **ANIME)  # tags 0..19
+    small = add_jobs(3, tmp_path, sched_tag=0.5, **X4PLUS)  # tags 0.5, 1.5, 2.5
+    running = next(g['params'] for g in execution_plan() if g['params']['model_name'] == ANIME['model_name'])
+
+    # A worker already on the big batch's group gives way after its quantum
+    order = _drain(engine_params=running)
+    assert order == big[:4] + small + big[4:]
+
+
+def test_fair_share_tags_interleave_batches(app, tmp_path):
+    big = _batch(20, tmp_path, 'A', **ANIME)
+    small = _batch(3, tmp_path, 'B', **X4PLUS)
+    order = _drain()
+    assert sorted(order) == sorted(big + small)
+    assert max(order.index(job_id) for job_id in small) < len(order) - 1  # B doesn't wait for all of A
+
+
+def test_transient_load_failure_keeps_jobs_pending(app, tmp_path, monkeypatch):
+    ids = add_jobs(4, tmp_path, **ANIME)
+    engine = UpscaleEngine(backend='stub', pool_mb=0)
+    monkeypatch.setattr(engine, 'load_model', lambda: False)
+    monkeypatch.setattr(scheduler, 'LOAD_RETRY_SECONDS', 0.0)
+
+    asyncio.run(engine.run_queue(db.session, ImageJob, str(tmp_path / 'out')))
+    statuses = {db.session.get(ImageJob, job_id).status for job_id in ids}
+    assert statuses == {'pending'}
+
+
+def test_unknown_model_fails_its_group(app, tmp_path):
+    ids = add_jobs(3, tmp_path, model_name='NoSuchModel')
+    engine = UpscaleEngine(backend='stub', pool_mb=0)
+    engine.load_failed(execution_plan()[0]['params'], LoadBackoff())
+    jobs = [db.session.get(ImageJob, job_id) for job_id in ids]
+    assert {job.status for job in jobs} == {'failed'}
+    assert 'Unknown model' in jobs[0].error_message
+
+
+def test_load_backoff_grows_then_gives_up(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler.time, 'time', lambda: now[0])
+    group = {'params': dict(ANIME, scale_factor=2)}
+    backoff = LoadBackoff()
+
+    delays = [backoff.failed(group['params']) for _ in range(LOAD_ATTEMPTS - 1)]
+    assert delays == sorted(delays) and delays[1] == 2 * delays[0]
+    assert backoff.ready([group]) == []
+    assert backoff.wait([group]) == pytest.approx(delays[-1])
+    now[0] += delays[-1]
+    assert backoff.ready([group]) == [group]
+
+    backoff.failed(group['params'])
+    assert backoff.gave_up(group['params'])
+    assert backoff.wait([group]) is None
+    assert not LoadBackoff(follow=True).gave_up(group['params'])
+
+    backoff.loaded(group['params'])
+    assert backoff.ready([group]) == [group]
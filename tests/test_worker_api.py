@@ -0,0 +1,217 @@
+"""
+Job-lease API: claims, heartbeats, lease expiry and a remote worker pulling
+jobs from a live server (stub backend, throwaway SQLite queue).
+"""
+
+import threading
+import urllib.error
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.serving import make_server
+
+import remote_worker
+import webui.worker_api as worker_api
+from conftest import add_jobs
+from remote_worker import RemoteWorker
+from upscale import UpscaleEngine
+from webui.models import ImageJob, db
+
+TOKEN = 'test-token'
+AUTH = {'Authorization': f'Bearer {TOKEN}'}
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setattr(worker_api, 'WORKER_TOKEN', TOKEN)
+    return app.test_client()
+
+
+@pytest.fixture
+def server(app, client, tmp_path, monkeypatch):
+    """The app served over HTTP on a free port; yields its base URL."""
+    monkeypatch.setattr(worker_api, 'OUTPUT_DIR', str(tmp_path / 'out'))
+    httpd = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+
+def _claim(client, worker_id='node:0', max_jobs=2, params=None):
+    response = client.post('/api/worker/claim', headers=AUTH,
+                           json={'worker_id': worker_id, 'max_jobs': max_jobs, 'params': params})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _expire(job_ids):
+    for job_id in job_ids:
+        db.session.get(ImageJob, job_id).lease_expires_at = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+
+
+def _worker(url, worker_id='node:0', **kwargs):
+    engine = UpscaleEngine(backend='stub', device='cpu', pool_mb=0, face_gate=False)
+    return RemoteWorker(url, TOKEN, engine, worker_id=worker_id, poll_interval=0.01, **kwargs)
+
+
+def test_token_required(app, client, monkeypatch):
+    assert client.post('/api/worker/claim', json={'worker_id': 'x'}).status_code == 401
+    monkeypatch.setattr(worker_api, 'WORKER_TOKEN', '')
+    assert client.post('/api/worker/claim', headers=AUTH, json={'worker_id': 'x'}).status_code == 503
+
+
+def test_claim_leases_one_group(client, tmp_path):
+    add_jobs(3, tmp_path)
+    add_jobs(2, tmp_path, sched_tag=10, model_name='RealESRGAN_x4plus')
+    reply = _claim(client, max_jobs=5)
+    assert len(reply['jobs']) == 3
+    assert {job['params']['model_name'] for job in reply['jobs']} == {reply['params']['model_name']}
+    for job in reply['jobs']:
+        leased = db.session.get(ImageJob, job['id'])
+        assert leased.status == 'processing' and leased.worker_id == 'node:0'
+        assert leased.lease_expires_at > datetime.utcnow()
+
+
+def test_lease_is_committed_with_the_claim(app, tmp_path):
+    (job_id,) = add_jobs(1, tmp_path)
+    expiry = datetime.utcnow() + timedelta(minutes=5)
+    ImageJob.claim_next('node:0', lease_expires_at=expiry)
+    db.session.rollback()  # nothing pending in the session: the claim's UPDATE carried the lease
+    job = db.session.get(ImageJob, job_id)
+    assert job.status == 'processing' and job.lease_expires_at == expiry
+
+
+def test_heartbeat_renews_and_reports_lost(client, tmp_path):
+    add_jobs(2, tmp_path)
+    held, taken = (job['id'] for job in _claim(client)['jobs'])
+    db.session.get(ImageJob, taken).worker_id = 'node:1'
+    db.session.commit()
+
+    reply = client.post('/api/worker/heartbeat', headers=AUTH,
+                        json={'worker_id': 'node:0', 'job_ids': [held, taken]}).get_json()
+    assert reply['renewed'] == [held] and reply['lost'] == [taken]
+
+
+def test_expired_lease_is_requeued_on_claim(client, tmp_path):
+    ids = add_jobs(2, tmp_path)
+    _expire(job['id'] for job in _claim(client, 'node:0')['jobs'])
+
+    reply = _claim(client, 'node:1')
+    assert sorted(job['id'] for job in reply['jobs']) == sorted(ids)
+    assert {db.session.get(ImageJob, job_id).crashes for job_id in ids} == {1}
+
+
+def test_sweeper_recovers_leases_without_claims(app, client, tmp_path, monkeypatch):
+    ids = add_jobs(2, tmp_path)
+    _claim(client)
+    _expire(ids)
+    monkeypatch.setattr(worker_api, 'SWEEP_SECONDS', 0.01)
+    stop = threading.Event()
+    sweeper = threading.Thread(target=worker_api.sweep_leases, args=(app, stop), daemon=True)
+    sweeper.start()
+    try:
+        for _ in range(500):
+            db.session.expire_all()
+            if ImageJob.query.filter_by(status='pending').count() == len(ids):
+                break
+            stop.wait(0.01)
+    finally:
+        stop.set()
+        sweeper.join(timeout=5)
+    assert ImageJob.query.filter_by(status='pending').count() == len(ids)
+
+
+def test_result_and_fail_need_the_lease(client, tmp_path):
+    add_jobs(2, tmp_path)
+    done, retried = (job['id'] for job in _claim(client)['jobs'])
+
+    response = client.post(f'/api/worker/jobs/{done}/fail', headers=AUTH, json={'worker_id': 'node:1'})
+    assert response.status_code == 409
+    response = client.post(f'/api/worker/jobs/{retried}/fail', headers=AUTH,
+                           json={'worker_id': 'node:0', 'retry': True})
+    assert response.get_json() == {'status': 'pending'}
+
+    out = tmp_path / 'out' / 'page.png'
+    db.session.get(ImageJob, done).output_path = str(out)
+    db.session.commit()
+    with open(db.session.get(ImageJob, done).original_path, 'rb') as f:
+        response = client.post(f'/api/worker/jobs/{done}/result', headers=AUTH,
+                               data={'worker_id': 'node:0', 'output': (f, 'page.png')})
+    assert response.status_code == 200
+    assert db.session.get(ImageJob, done).status == 'completed' and out.exists()
+
+
+def test_remote_worker_drains_queue(server, tmp_path):
+    ids = add_jobs(5, tmp_path)
+    stats = _worker(server, batch_size=2).run()
+    assert stats['completed'] == len(ids) and stats['failed'] == 0
+    db.session.expire_all()
+    assert {db.session.get(ImageJob, job_id).status for job_id in ids} == {'completed'}
+
+
+def test_remote_worker_id_is_url_encoded(server, tmp_path):
+    ids = add_jobs(2, tmp_path)
+    stats = _worker(server, worker_id='scan box #2&x=1:remote:0').run()
+    assert stats['completed'] == len(ids) and stats['failed'] == 0
+
+
+def test_remote_worker_fails_job_when_processing_raises(server, tmp_path, monkeypatch):
+    (job_id,) = add_jobs(1, tmp_path)
+    worker = _worker(server)
+
+    def explode(*args):
+        raise RuntimeError('decoder crashed')
+    monkeypatch.setattr(worker.engine, '_process_image', explode)
+
+    assert worker.run()['failed'] == 1
+    db.session.expire_all()
+    job = db.session.get(ImageJob, job_id)
+    assert job.status == 'failed' and 'decoder crashed' in job.error_message
+
+
+def test_remote_worker_hands_job_back_when_upload_fails(server, tmp_path, monkeypatch):
+    (job_id,) = add_jobs(1, tmp_path)
+    worker = _worker(server)
+
+    def unreachable(*args, **kwargs):
+        raise urllib.error.URLError('connection refused')
+    monkeypatch.setattr(worker, '_post_file', unreachable)
+    original_run_job = worker._run_job
+
+    def run_once(job, work_dir):
+        original_run_job(job, work_dir)
+        worker.engine.request_drain()  # don't claim the handed-back job again
+    monkeypatch.setattr(worker, '_run_job', run_once)
+
+    assert worker.run()['released'] == 1
+    db.session.expire_all()
+    job = db.session.get(ImageJob, job_id)
+    assert job.status == 'pending' and not job.crashes
+
+
+def test_remote_worker_survives_unreachable_server(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(remote_worker.time, 'sleep', sleeps.append)
+    monkeypatch.setattr(remote_worker, 'OUTAGE_LIMIT', 0.0)
+    worker = _worker('http://127.0.0.1:9')  # discard port: connection refused
+
+    stats = worker.run()  # gives up after OUTAGE_LIMIT instead of raising
+    assert stats['completed'] == 0
+    assert sleeps  # retried before giving up
+
+
+def test_remote_worker_backs_off_while_server_is_down(monkeypatch):
+    delays = []
+    worker = _worker('http://127.0.0.1:9', follow=True)
+
+    def sleep(seconds):
+        delays.append(seconds)
+        if len(delays) >= 12:
+            worker.engine.request_drain()
+    monkeypatch.setattr(remote_worker.time, 'sleep', sleep)
+
+    worker.run()
+    claim_delays = [d for d in delays if d not in (1, 2)]  # _request's own retry sleeps
+    assert claim_delays == sorted(claim_delays) and claim_delays[-1] <= remote_worker.BACKOFF_MAX
@@ -6,6 +6,13 @@ Uses Real-ESRGAN to upscale images with SQLite tracking.
 Usage:
     python upscale.py --input /path/to/input --output /path/to/output --scale 2.5 --workers 4
 
+    # One worker process per GPU (or CPU thread-slices), sharing the SQLite queue
+    python upscale.py -i in -o out --procs 4 --devices auto
+    python upscale.py -i in -o out --procs 2 --devices cpu --backend stub
+
+    # Extra machine draining the head node's queue over HTTP
+    WORKER_TOKEN=secret python upscale.py --remote-worker http://head:5800
+
 Available Models:
     - RealESRGAN_x4plus          # General photos (4x)
     - RealESRGAN_x4plus_anime    # Anime/comics (4x) - RECOMMENDED for comics
@@ -20,8 +27,10 @@ Denoising (--dn 0-1): Higher = more denoising, less detail
 
 import argparse
 import asyncio
+import json
 import logging
 import os
+import socket
 import sys
 import time
 from concurrent.futures import ThreadPoolExecutor
@@ -32,17 +41,14 @@ from threading import Lock
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-# Configure logging
+from buffer_pool import DEFAULT_MAX_MB, BufferPool, pooled
+from cost_watchdog import build_watchdog
+from grayscale import GRAY_MODES, is_grayscale, write_gray_png
+from log_setup import KEEP, end_rate_limit, setup_logging
+from scale_planner import QUALITY_LEVELS, apply_route, native_scale, plan_route, select_model
+
+# Logging is configured in main() (see log_setup.py), not at import time
 LOG_DIR = '/workspace/data/logs'
-os.makedirs(LOG_DIR, exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(f'{LOG_DIR}/upscale.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
 
@@ -97,29 +103,100 @@ def print_available_models():
     print()
 
 
+class StubUpscaler:
+    """Stand-in for RealESRGANer that only does a bicubic resize.
+
+    No weights, no GPU: lets the queue, worker processes and DB bookkeeping
+    be exercised on a CPU-only box.
+    """
+    
+    def __init__(self, scale: int = 4, pool=None):
+        self.scale = scale
+        self.pool = pool
+    
+    def enhance(self, img, outscale=None):
+        import cv2
+        outscale = outscale or self.scale
+        h, w = img.shape[:2]
+        size = (int(w * outscale), int(h * outscale))
+        output = cv2.resize(img, size, pooled(self.pool, size[::-1] + img.shape[2:], img.dtype),
+                            interpolation=cv2.INTER_CUBIC)
+        return output, None
+
+
+def _cuda_available() -> bool:
+    try:
+        import torch
+    except ImportError:
+        return False
+    return torch.cuda.is_available()
+
+
 class UpscaleEngine:
     """Async upscaling engine with Real-ESRGAN."""
     
     def __init__(self, scale: float = 2.5, workers: int = 4, 
                  model_name: str = 'RealESRGAN_x4plus',
                  denoise_strength: float = 0.0,
-                 face_enhance: bool = False):
+                 face_enhance: bool = False,
+                 tile_size: int = 400,
+                 face_gate: bool = True,
+                 quality: str = 'balanced',
+                 flat_threshold: float = 2.0,
+                 gray_tolerance: float = 6.0,
+                 gray_mode: str = 'gray',
+                 compile_mode: str = 'off',
+                 pool_mb: float = DEFAULT_MAX_MB,
+                 device: str = 'cuda',
+                 backend: str = 'realesrgan',
+                 follow: bool = False,
+                 poll_interval: float = 5.0):
         self.scale = scale
         self.workers = workers
         self.model_name = model_name
         self.denoise_strength = denoise_strength
         self.face_enhance = face_enhance
+        self.tile_size = tile_size
+        self.face_gate = face_gate  # detect faces on the input before running GFPGAN
+        self.quality = quality  # scale planner route policy (see scale_planner.py)
+        self.flat_threshold = flat_threshold  # tile std-dev below which the model is skipped, 0 = off
+        self.gray_tolerance = gray_tolerance  # max channel spread of a grayscale page, 0 = off
+        self.gray_mode = gray_mode  # single-channel PNG flavour (see grayscale.py)
+        self.compile_mode = compile_mode  # 'off', 'torch' or 'script' (see compiled_infer.py)
+        self.device = device
+        self.backend = backend
+        self.follow = follow  # keep polling for new jobs when the queue is empty
+        self.poll_interval = poll_interval
         self.executor = ThreadPoolExecutor(max_workers=workers)
-        self.queue = asyncio.Queue()
+        self.draining = False
         self.processing_count = 0
         self.processing_lock = Lock()
         self._model = None
         self._face_enhancer = None
+        self._face_lock = Lock()  # GFPGANer keeps per-call state in its shared face_helper
+        self._face_gate = None
+        self._compiled = None  # compiled_infer.BucketedModel when compile_mode is on
+        self._loaded = None  # (model_name, denoise_strength) of the loaded weights
+        self.params = None  # parameter group currently configured
+        self.plan_stats = {'groups': 0, 'switches': 0, 'reloads': 0}
+        self.route_stats = {}  # route name -> images
+        self.flat_stats = {'pixels': 0, 'skipped_pixels': 0}
+        self.gray_stats = {'pages': 0, 'grayscale': 0}
+        self.compile_stats = {}  # see compiled_infer.new_compile_stats
+        # Host buffers reused across images (opt-in, see buffer_pool)
+        self.buffer_pool = BufferPool(int(pool_mb * 1024 * 1024)) if pool_mb > 0 else None
         
-        logger.info(f"Initialized UpscaleEngine: scale={scale}, workers={workers}, model={model_name}, dn={denoise_strength}, face_enhance={face_enhance}")
+        logger.info(f"Initialized UpscaleEngine: scale={scale}, workers={workers}, model={model_name}, dn={denoise_strength}, face_enhance={face_enhance}, device={device}, backend={backend}, compile={compile_mode}")
     
     def load_model(self):
         """Load Real-ESRGAN model."""
+        if self.backend == 'stub':
+            self._model = StubUpscaler(scale=native_scale(self.model_name), pool=self.buffer_pool)
+            self._loaded = (self.model_name, self.denoise_strength)
+            logger.info("Using stub backend (bicubic resize, no model)")
+            if self.compile_mode != 'off':
+                logger.warning("Compiled inference needs a torch model, ignored with the stub backend")
+            return True
         try:
             from realesrgan import RealESRGANer
             from basicsr.archs.rrdbnet_arch import RRDBNet
@@ -140,14 +217,9 @@ class UpscaleEngine:
             # Get parameters for this model
             params = model_params.get(self.model_name, {'num_block': 23, 'scale': 4})
             
-            # Handle scale override for 2x models
-            effective_scale = self.scale
-            if self.model_name in ['RealESRGAN_x2plus', 'realesrgan-x2plus']:
-                effective_scale = 2
-            elif self.model_name in ['RealESRGAN_x4plus', 'RealESRGAN_x4plus_anime', 
-                                      'RealESRGAN_x4plus_anime_6B', 'RealESRNet_x4plus', 
-                                      'realesr-general-x4v3']:
-                effective_scale = params['scale']
+            # Models always run at their native scale; the scale planner
+            # reaches the requested (fractional) output scale around them
+            effective_scale = native_scale(self.model_name)
             
             # Create the model architecture (RRDBNet for Real-ESRGAN)
             model = RRDBNet(
@@ -204,11 +276,11 @@ class UpscaleEngine:
                 model_path=model_path,
                 dni_weight=None,
                 model=model,
-                tile=400,  # Moderate tile size for speed
+                tile=self.tile_size,  # 400 = moderate tile size for speed
                 tile_pad=10,
                 pre_pad=10,
-                half=True,  # Use FP16 for memory savings
-                device='cuda'
+                half=self.device.startswith('cuda'),  # FP16 for memory savings (GPU only)
+                device=self.device
             )
             
             # Apply denoising if specified
@@ -216,10 +288,17 @@ class UpscaleEngine:
                 self._model.set_denoise_strength(self.denoise_strength)
                 logger.info(f"Denoising strength: {self.denoise_strength}")
             
+            # Compile the network for a fixed set of tile shapes and warm them up
+            if self.compile_mode != 'off':
+                from compiled_infer import compile_upsampler, new_compile_stats
+                self.compile_stats = self.compile_stats or new_compile_stats()
+                self._compiled = compile_upsampler(self._model, self.compile_mode, self.compile_stats)
+            
             # Load GFPGAN face enhancer if requested
-            if self.face_enhance:
+            if self.face_enhance and self._face_enhancer is None:
                 self._load_face_enhancer()
             
+            self._loaded = (self.model_name, self.denoise_strength)
             logger.info("Model loaded successfully!")
             return True
         except Exception as e:
@@ -249,12 +328,21 @@ class UpscaleEngine:
             
             self._face_enhancer = GFPGANer(
                 model_path=gfpgan_model_path,
-                upscale=2,  # GFPGAN's internal upscaling
+                upscale=1,  # applied to the already-upscaled output
                 arch='clean',
                 channel_multiplier=2,
-                device='cuda'
+                device=self.device
             )
             
+            if self.face_gate and self._face_gate is None:
+                from face_gate import FaceGate, FaceStore, retinaface_detector
+                try:
+                    store = FaceStore()
+                except Exception as e:
+                    logger.warning(f"Face cache unavailable ({e}), detections are kept in memory only")
+                    store = None
+                self._face_gate = FaceGate(retinaface_detector(self._face_enhancer), store=store, lock=self._face_lock)
+            
             logger.info("GFPGAN face enhancer loaded!")
         except Exception as e:
             import traceback
@@ -262,7 +350,7 @@ class UpscaleEngine:
             logger.warning("Face enhancement disabled")
             self.face_enhance = False
     
-    async def upscale_single(self, job_id: int, input_path: str, output_path: str):
+    async def upscale_single(self, job_id: int, input_path: str, output_path: str, worker_id: str = None):
         """Upscale a single image."""
         loop = asyncio.get_event_loop()
         
@@ -272,91 +360,229 @@ class UpscaleEngine:
                 self.executor,
                 self._process_image,
                 input_path,
-                output_path
+                output_path,
+                job_id,
+                worker_id
             )
             return result
         except Exception as e:
             logger.error(f"Error processing {input_path}: {e}")
             return {'success': False, 'error': str(e)}
     
-    def _process_image(self, input_path: str, output_path: str) -> dict:
-        """Process image (runs in thread pool)."""
+    def _process_image(self, input_path: str, output_path: str, job_id: int = None, worker_id: str = None) -> dict:
+        """Process image (runs in thread pool); its buffers go back to the pool afterwards."""
+        if self.buffer_pool is None:
+            return self._process(input_path, output_path, job_id, worker_id)
+        with self.buffer_pool.lease():
+            return self._process(input_path, output_path, job_id, worker_id)
+    
+    def _process(self, input_path: str, output_path: str, job_id: int = None, worker_id: str = None) -> dict:
+        name = os.path.basename(input_path)
+        stages = {}
         try:
             import cv2
-            import torch
-            
-            # Clear GPU cache before processing
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
             
             # Load image using OpenCV (like original script)
+            mark = time.perf_counter()
             img = cv2.imread(input_path)
             if img is None:
                 raise ValueError(f"Failed to load image: {input_path}")
             
-            logger.info(f"Processing: {os.path.basename(input_path)} ({img.shape[:2]})")
+            # Black-and-white pages: one channel through the pipeline (GFPGAN needs BGR)
+            grayscale = self.gray_tolerance > 0 and is_grayscale(img, self.gray_tolerance)
+            if grayscale and not self.face_enhance:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, pooled(self.buffer_pool, img.shape[:2]))
+            with self.processing_lock:
+                self.gray_stats['pages'] += 1
+                self.gray_stats['grayscale'] += int(grayscale)
+            
+            stages['read'] = time.perf_counter() - mark
+            logger.debug("Processing: %s (%s%s)", name, img.shape[:2], ', grayscale' if grayscale else '')
             
-            # Process with RealESRGANer using enhance() method (like original)
-            # The outscale parameter controls the final output scale
-            output, _ = self._model.enhance(img, outscale=self.scale)
+            # Cheapest allowed route to the requested scale (see scale_planner.py)
+            route = plan_route(self.model_name, self.scale, img.shape[0], img.shape[1], self.quality)
+            logger.debug("Route for %s: %s (cost %.2f/MP)", name, route.describe(self.scale), route.cost)
+            mark = time.perf_counter()
+            output, skipped = apply_route(self._model, route, img, self.scale, self.flat_threshold, self.buffer_pool)
+            stages['infer'] = time.perf_counter() - mark
+            pixels = img.shape[0] * img.shape[1]
+            with self.processing_lock:
+                self.route_stats[route.name] = self.route_stats.get(route.name, 0) + 1
+                self.flat_stats['pixels'] += pixels
+                self.flat_stats['skipped_pixels'] += int(pixels * skipped)
+            if skipped:
+                logger.debug("Flat tiles: %.0f%% of %s skipped the model", skipped * 100, name)
             
             # Apply face enhancement if requested
-            if self.face_enhance and self._face_enhancer is not None:
-                logger.info(f"Applying GFPGAN face enhancement...")
+            mark = time.perf_counter()
+            if self.face_enhance and self._face_gate is not None:
+                faces = self._face_gate.faces_for(input_path, img)
+                if faces:
+                    from face_gate import enhance_face_regions
+                    output = enhance_face_regions(self._face_enhancer, output, faces, output.shape[1] / img.shape[1],
+                                                  self._face_lock)
+                    logger.debug("Face enhancement applied to %d face(s) in %s", len(faces), name)
+                else:
+                    logger.debug("No faces detected in %s, skipping GFPGAN", name)
+            elif self.face_enhance and self._face_enhancer is not None:
+                logger.debug("Applying GFPGAN face enhancement...")
                 # GFPGAN returns: cropped_faces, restored_faces, img_output
-                _, _, output = self._face_enhancer.enhance(
-                    output, 
-                    has_aligned=False, 
-                    only_center_face=False, 
-                    paste_back=True
-                )
-                logger.info("Face enhancement applied!")
+                with self._face_lock:
+                    _, _, output = self._face_enhancer.enhance(
+                        output, 
+                        has_aligned=False, 
+                        only_center_face=False, 
+                        paste_back=True
+                    )
+                logger.debug("Face enhancement applied!")
+            if self.face_enhance:
+                stages['face'] = time.perf_counter() - mark
             
             # Save output
+            mark = time.perf_counter()
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            cv2.imwrite(output_path, output)
+            if grayscale and output_path.lower().endswith('.png'):
+                if output.ndim == 3:
+                    output = cv2.cvtColor(output, cv2.COLOR_BGR2GRAY, pooled(self.buffer_pool, output.shape[:2]))
+                write_gray_png(output_path, output, self.gray_mode)
+            else:
+                cv2.imwrite(output_path, output)
+            
+            stages['write'] = time.perf_counter() - mark
             
             output_size = os.path.getsize(output_path) / (1024 * 1024)
-            logger.info(f"Completed: {os.path.basename(input_path)} → {output.shape[:2]}, {output_size:.2f} MB")
+            logger.info(
+                "Completed: %s → %s, %.2f MB (%s)", name, output.shape[:2], output_size, route.name,
+                extra={'job_id': job_id, 'worker_id': worker_id, 'keep': True,
+                       'stages': {stage: round(seconds, 4) for stage, seconds in stages.items()}}
+            )
             
             return {
                 'success': True,
                 'output_path': output_path,
-                'output_size': output_size
+                'output_size': output_size,
+                'pixels': pixels,
+                'route': route.name,
+                'skipped_fraction': skipped,
+                'is_grayscale': grayscale
             }
         except Exception as e:
-            import traceback
-            logger.error(f"Processing error: {e}")
-            logger.error(traceback.format_exc())
+            logger.error("Processing error for %s: %s", name, e, exc_info=True,
+                         extra={'job_id': job_id, 'worker_id': worker_id})
             return {'success': False, 'error': str(e)}
     
-    async def worker(self, db_session, ImageJob):
-        """Worker process that takes jobs from queue."""
-        while True:
-            job = await self.queue.get()
+    def configure(self, params: dict) -> bool:
+        """
+        Switch the engine to a job parameter group (see webui.scheduler.PARAM_COLUMNS).
+        Weights are only reloaded when the model or denoise strength changes;
+        scale, tile size and face enhancement are switched in place.
+        Returns False if the model for the group could not be loaded.
+        """
+        if params == self.params:
+            return True
+        
+        if self.params is not None:
+            self.plan_stats['switches'] += 1
+        self.plan_stats['groups'] += 1
+        
+        self.model_name = select_model(params['model_name'], params['scale_factor'], self.quality)
+        self.denoise_strength = params['denoising_level'] or 0.0
+        self.scale = params['scale_factor']
+        self.tile_size = params['tile_size']
+        self.face_enhance = bool(params['face_enhance'])
+        logger.info(f"Configuring for job group: {params}")
+        if self.model_name != params['model_name']:
+            logger.info(f"Scale planner: using {self.model_name} for {params['scale_factor']}x")
+        
+        if self._model is None or self._loaded != (self.model_name, self.denoise_strength):
+            if self._model is not None:
+                self.plan_stats['reloads'] += 1
+                # Old weights out: hand their cached device blocks back once, not per image
+                self._model = self._compiled = None
+                if self.backend != 'stub' and _cuda_available():
+                    import torch
+                    torch.cuda.empty_cache()
+            if not self.load_model():
+                self.params = None
+                return False
+        else:
+            if hasattr(self._model, 'tile_size'):
+                self._model.tile_size = self.tile_size
+                if self._compiled is not None:
+                    from compiled_infer import bucket_sides
+                    self._compiled.rebucket(bucket_sides(self.tile_size, self._model.tile_pad))
+            if self.face_enhance and self._face_enhancer is None and self.backend != 'stub':
+                self._load_face_enhancer()
+        
+        self.params = params
+        return True
+    
+    def load_failed(self, params: dict, backoff):
+        """
+        Handle a group whose model didn't load. An unknown model never will,
+        so its jobs are failed; anything else (download hiccup, out of memory
+        on this device) backs the group off and leaves its jobs pending.
+        """
+        from webui.scheduler import fail_group
+        if params['model_name'] not in AVAILABLE_MODELS:
+            failed = fail_group(params, f"Unknown model: {params['model_name']}")
+            logger.error(f"Failed {failed} job(s) for unknown model {params['model_name']}")
+            return
+        delay = backoff.failed(params)
+        if backoff.gave_up(params):
+            logger.error(f"Could not load {params['model_name']}, leaving its jobs pending for other workers")
+        else:
+            logger.warning(f"Could not load {params['model_name']}, retrying in {delay:.0f}s")
+    
+    def run_stats(self) -> dict:
+        """Counters for the run summary."""
+        return {
+            'plan': dict(self.plan_stats),
+            'routes': dict(self.route_stats),
+            'flat': dict(self.flat_stats),
+            'gray': dict(self.gray_stats),
+            'face': dict(self._face_gate.stats) if self._face_gate else {},
+            'compile': dict(self.compile_stats),
+            'pool': dict(self.buffer_pool.stats) if self.buffer_pool else {}
+        }
+    
+    def request_drain(self):
+        """Stop claiming new jobs; run_queue returns once in-flight jobs finish."""
+        self.draining = True
+    
+    async def worker(self, db_session, ImageJob, worker_id: str, output_dir: str, group: dict):
+        """Worker coroutine: claims jobs of one parameter group in fair-share order."""
+        from webui.scheduler import preempted
+        
+        while not self.draining:
+            if preempted(group['params'], group['priority'], group['started'], group['claimed']):
+                return
+            job_obj = ImageJob.claim_next(worker_id, params=group['params'])
+            if job_obj is None:
+                return
+            group['claimed'] += 1
+            
+            job_id = job_obj.id
+            with self.processing_lock:
+                self.processing_count += 1
             
             try:
-                # Update status to processing
-                job_obj = db_session.query(ImageJob).get(job['id'])
-                if job_obj:
-                    job_obj.status = 'processing'
-                    job_obj.started_at = datetime.utcnow()
-                    db_session.commit()
+                output_path = job_obj.output_path or default_output_path(
+                    output_dir, self.scale, job_obj.original_path
+                )
                 
                 # Process image
-                result = await self.upscale_single(
-                    job['id'],
-                    job['input_path'],
-                    job['output_path']
-                )
+                result = await self.upscale_single(job_id, job_obj.original_path, output_path, worker_id)
                 
                 # Update database
-                if db_session.query(ImageJob).get(job['id']):
-                    job_obj = db_session.query(ImageJob).get(job['id'])
+                job_obj = db_session.get(ImageJob, job_id)
+                if job_obj:
                     if result['success']:
                         job_obj.status = 'completed'
                         job_obj.progress_percent = 100
                         job_obj.output_path = result['output_path']
+                        job_obj.skipped_fraction = result['skipped_fraction']
+                        job_obj.is_grayscale = result['is_grayscale']
                         job_obj.completed_at = datetime.utcnow()
                     else:
                         job_obj.status = 'failed'
@@ -364,42 +590,69 @@ class UpscaleEngine:
                     db_session.commit()
                 
             except Exception as e:
-                logger.error(f"Worker error for job {job['id']}: {e}")
+                logger.error(f"Worker error for job {job_id}: {e}")
                 db_session.rollback()
             
             finally:
                 with self.processing_lock:
                     self.processing_count -= 1
-                self.queue.task_done()
-    
-    async def run_queue(self, jobs, db_session, ImageJob):
-        """Run all jobs from the queue."""
-        # Start workers
-        workers = []
-        for _ in range(self.workers):
-            worker_task = asyncio.create_task(self.worker(db_session, ImageJob))
-            workers.append(worker_task)
-        
-        # Add all jobs to queue
-        for job in jobs:
-            await self.queue.put(job)
-            with self.processing_lock:
-                self.processing_count += 1
+    
+    async def run_queue(self, db_session, ImageJob, output_dir: str):
+        """Run workers until no pending jobs are left in the DB queue."""
+        from webui.scheduler import execution_plan, next_group, fail_group, LoadBackoff
+        host = socket.gethostname()
+        worker_ids = [f"{host}:main:{i}" for i in range(self.workers)]
         
-        # Wait for all jobs to complete
-        await self.queue.join()
+        # Jobs a previous run of this process left half-done (a crash and
+        # Ctrl-C look the same from here, so they don't count as crashes)
+        for worker_id in worker_ids:
+            ImageJob.requeue_worker(worker_id, crashed=False)
         
-        # Cancel workers
-        for w in workers:
-            w.cancel()
+        # Execution plan: one parameter group at a time, re-planned after each
+        # group (or its quantum) so new uploads and priority changes are picked up
+        backoff = LoadBackoff(self.follow)
+        while not self.draining:
+            ImageJob.requeue_expired()  # remote leases that ran out
+            plan = execution_plan()
+            ready = backoff.ready(plan)
+            if not ready:
+                wait = backoff.wait(plan) if plan else None
+                if wait is None and not self.follow:
+                    break
+                await asyncio.sleep(min(wait, self.poll_interval) if wait is not None else self.poll_interval)
+                continue
+            
+            group = next_group(ready, self.params)
+            if not self.configure(group['params']):
+                self.load_failed(group['params'], backoff)
+                continue
+            backoff.loaded(group['params'])
+            
+            group.update(started=time.time(), claimed=0)
+            await asyncio.gather(*(
+                self.worker(db_session, ImageJob, worker_id, output_dir, group) for worker_id in worker_ids
+            ))
         
-        logger.info("All jobs completed!")
+        if self.draining:
+            logger.info("Drained: in-flight jobs finished, remaining jobs stay pending")
+        else:
+            logger.info("All jobs completed!")
+
+
+def default_output_path(output_dir: str, scale: float, input_path: str) -> str:
+    """Output location for an input image when the job doesn't specify one."""
+    return os.path.join(output_dir, f"upscale_{scale}x_{Path(input_path).stem}.png")
 
 
-def scan_images(input_dir: str, output_dir: str, scale: float, completed_filenames: set = None) -> list:
-    """Scan input directory for images and return job list (skips already completed)."""
+def scan_images(input_dir: str, output_dir: str, scale: float, completed_filenames: set = None,
+                max_megapixels: float = 64) -> list:
+    """Scan input directory for images and return job list (skips already completed).
+    
+    Every candidate's header is probed in parallel; unreadable or oversized
+    files are rejected here instead of failing inside a worker.
+    """
+    from webui.image_probe import SUPPORTED_EXTENSIONS, probe_images
     jobs = []
-    supported_extensions = {'.png', '.jpg', '.jpeg', '.jfif', '.bmp', '.tiff', '.webp'}
     
     input_path = Path(input_dir)
     if not input_path.exists():
@@ -410,7 +663,7 @@ def scan_images(input_dir: str, output_dir: str, scale: float, completed_filenam
         completed_filenames = set()
     
     for img_path in input_path.iterdir():
-        if img_path.suffix.lower() in supported_extensions:
+        if img_path.suffix.lower() in SUPPORTED_EXTENSIONS:
             filename = img_path.name
             
             # Skip if already completed
@@ -418,18 +671,24 @@ def scan_images(input_dir: str, output_dir: str, scale: float, completed_filenam
                 logger.info(f"Skipping already processed: {filename}")
                 continue
             
-            output_filename = f"upscale_{scale}x_{img_path.stem}.png"
-            output_path = os.path.join(output_dir, output_filename)
-            
             jobs.append({
                 'filename': filename,
                 'input_path': str(img_path),
-                'output_path': output_path,
+                'output_path': default_output_path(output_dir, scale, str(img_path)),
                 'scale_factor': scale
             })
     
-    logger.info(f"Found {len(jobs)} new images to process (skipped {len(completed_filenames)} completed)")
-    return jobs
+    accepted = []
+    for job, (_, info, error) in zip(jobs, probe_images([j['input_path'] for j in jobs], max_megapixels)):
+        if error:
+            logger.warning(f"Rejected {job['filename']}: {error}")
+            continue
+        job.update(width=info['width'], height=info['height'], pixel_count=info['pixel_count'])
+        accepted.append(job)
+    
+    logger.info(f"Found {len(accepted)} new images to process "
+                f"(skipped {len(completed_filenames)} completed, rejected {len(jobs) - len(accepted)})")
+    return accepted
 
 
 async def main():
@@ -439,8 +698,8 @@ async def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog=print_available_models() or ''
     )
-    parser.add_argument('--input', '-i', required=True, help='Input directory')
-    parser.add_argument('--output', '-o', required=True, help='Output directory')
+    parser.add_argument('--input', '-i', help='Input directory')
+    parser.add_argument('--output', '-o', help='Output directory')
     parser.add_argument('--scale', '-s', type=float, default=2.5, 
                         help='Scale factor (0.5-4, default: 2.5)')
     parser.add_argument('--workers', '-w', type=int, default=4, 
@@ -451,8 +710,82 @@ async def main():
                         help='Denoising strength 0-1 (default: 0, no denoising)')
     parser.add_argument('--face-enhance', action='store_true',
                         help='Enable GFPGAN face enhancement')
-    parser.add_argument('--db', '-d', default='/workspace/data/db/upscale.db', 
+    parser.add_argument('--no-face-gate', action='store_true',
+                        help='Run GFPGAN on every whole output instead of only detected face regions')
+    parser.add_argument('--quality', choices=QUALITY_LEVELS, default='balanced',
+                        help='Scale routes allowed for fractional scales: max = full model pass + downscale, '
+                             'balanced = cheaper routes where quality allows, fast = cheapest (default: balanced)')
+    parser.add_argument('--flat-threshold', type=float, default=2.0,
+                        help='Upscale tiles with std-dev below this (0-255) by interpolation instead of the model, 0 = off (default: 2.0)')
+    parser.add_argument('--gray-tolerance', type=float, default=6.0,
+                        help='Treat pages whose channels differ by at most this (0-255) as grayscale, 0 = off (default: 6)')
+    parser.add_argument('--gray-png', choices=GRAY_MODES, default='gray',
+                        help='Output for grayscale pages: 8-bit gray, 1-bit line art or 16-level palette (default: gray)')
+    parser.add_argument('--tile', type=int, default=400,
+                        help='Tile size, 0 = whole image (default: 400)')
+    parser.add_argument('--compile', choices=['off', 'torch', 'script'], default='off',
+                        help='Compiled inference: torch.compile or TorchScript over a few padded tile shapes, '
+                             'warmed up at load time; works on CPU too (default: off)')
+    parser.add_argument('--pool-mb', type=float, default=DEFAULT_MAX_MB,
+                        help=f'Free host buffers kept for reuse across images, e.g. 512; '
+                             f'raises resident memory, 0 = no pool (default: {DEFAULT_MAX_MB})')
+    parser.add_argument('--max-megapixels', type=float, default=64,
+                        help='Reject inputs larger than this at scan time, 0 = no limit (default: 64)')
+    parser.add_argument('--db', '-d', default=os.environ.get('DATABASE_PATH', '/workspace/data/db/upscale.db'), 
                         help='Database path')
+    parser.add_argument('--procs', type=int, default=1,
+                        help='Worker processes sharing the job queue (default: 1, in-process threads)')
+    parser.add_argument('--devices', default=None,
+                        help="Devices for worker processes: 'auto', 'cpu' or e.g. 'cuda:0,cuda:1'")
+    parser.add_argument('--device', default=None,
+                        help="Device for a single-process or remote worker, e.g. 'cpu' or 'cuda:1' "
+                             "(default: cuda if available, else cpu)")
+    parser.add_argument('--backend', choices=['realesrgan', 'stub'], default='realesrgan',
+                        help='Inference backend (stub = bicubic resize, for CPU-only testing)')
+    parser.add_argument('--priority', type=int, default=0, choices=[-1, 0, 1, 2],
+                        help='Priority of this batch: -1 low, 0 normal, 1 high, 2 urgent (default: 0)')
+    parser.add_argument('--batch', default=None,
+                        help='Batch id for fair-share scheduling (default: scan-<timestamp>)')
+    parser.add_argument('--follow', action='store_true',
+                        help='Keep polling for new jobs (e.g. UI uploads) instead of exiting when drained')
+    parser.add_argument('--idle-timeout', type=float, default=300,
+                        help='Drain and exit after this many idle seconds (0 = off, default: 300)')
+    parser.add_argument('--gpu-threshold', type=float, default=5.0,
+                        help='GPU utilization %% below which the GPU counts as idle (default: 5)')
+    parser.add_argument('--hourly-rate', type=float, default=0.0,
+                        help='Instance price in USD/hour, for cost tracking (default: 0)')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Drain and exit before the run costs more than this many USD')
+    parser.add_argument('--deadline', type=float, default=None,
+                        help='Drain and exit after this many minutes of wall-clock time')
+    parser.add_argument('--probe', choices=['auto', 'nvml', 'torch', 'smi', 'fake', 'none'], default='auto',
+                        help='GPU utilization probe for the watchdog (default: auto)')
+    parser.add_argument('--poll-interval', type=float, default=30,
+                        help='Watchdog poll interval in seconds (default: 30)')
+    parser.add_argument('--shutdown-file', default=f'{LOG_DIR}/watchdog_shutdown.json',
+                        help='Where the watchdog records why it stopped the run')
+    parser.add_argument('--remote-worker', metavar='URL', default=None,
+                        help='Pull jobs from a remote Flask app (e.g. http://head:5800) instead of a local queue')
+    parser.add_argument('--worker-token', default=os.environ.get('WORKER_TOKEN', ''),
+                        help='Shared token for the worker API (default: $WORKER_TOKEN)')
+    parser.add_argument('--worker-id', default=None,
+                        help='Lease owner name for --remote-worker (default: host:remote:pid)')
+    parser.add_argument('--estimate', action='store_true',
+                        help='Print a run time / cost forecast for the pending queue (or --batch) and exit; '
+                             'uses --hourly-rate, --deadline, --budget')
+    parser.add_argument('--max-nodes', type=int, default=8,
+                        help='Largest node count the --estimate planner considers (default: 8)')
+    parser.add_argument('--log-file', default=f'{LOG_DIR}/upscale.log',
+                        help='Log file, rotated by size (default: %(default)s)')
+    parser.add_argument('--log-format', choices=['json', 'text'], default='json',
+                        help='Log file format: JSON lines with job_id and stage timings, or plain text (default: json)')
+    parser.add_argument('--log-rate', type=float, default=0,
+                        help='Max INFO/DEBUG log records per second, 0 = unlimited; warnings and per-job '
+                             'completion lines always pass (default: 0)')
+    parser.add_argument('--log-max-mb', type=float, default=50,
+                        help='Rotate the log file at this size, keeping 5 old files (default: 50)')
+    parser.add_argument('--verbose', '-v', action='store_true',
+                        help='Log per-image detail (route, flat tiles, faces) at DEBUG level')
     parser.add_argument('--list-models', action='store_true',
                         help='List available models and exit')
     
@@ -462,35 +795,65 @@ async def main():
         print_available_models()
         return
     
-    logger.info(f"=== Comic Upscale Started ===")
-    logger.info(f"Input: {args.input}")
-    logger.info(f"Output: {args.output}")
-    logger.info(f"Scale: {args.scale}x")
-    logger.info(f"Workers: {args.workers}")
-    logger.info(f"Model: {args.model}")
-    logger.info(f"Denoising: {args.dn}")
-    logger.info(f"Face Enhance: {args.face_enhance}")
+    setup_logging(
+        args.log_file,
+        json_lines=args.log_format == 'json',
+        rate_limit=args.log_rate,
+        max_bytes=int(args.log_max_mb * 1024 * 1024),
+        level=logging.DEBUG if args.verbose else logging.INFO
+    )
+    
+    if args.estimate:
+        return print_estimate(args)
+    
+    if not args.remote_worker and not (args.input and args.output):
+        parser.error('--input and --output are required (unless --remote-worker is given)')
+    
+    logger.info(f"=== Comic Upscale Started ===", extra=KEEP)
+    logger.info(f"Input: {args.input}", extra=KEEP)
+    logger.info(f"Output: {args.output}", extra=KEEP)
+    logger.info(f"Scale: {args.scale}x", extra=KEEP)
+    logger.info(f"Workers: {args.workers}", extra=KEEP)
+    logger.info(f"Model: {args.model}", extra=KEEP)
+    logger.info(f"Denoising: {args.dn}", extra=KEEP)
+    logger.info(f"Face Enhance: {args.face_enhance}", extra=KEEP)
+    
+    # A record from a previous run would make wrappers stop this one
+    if os.path.exists(args.shutdown_file):
+        os.remove(args.shutdown_file)
+    
+    if args.remote_worker:
+        return run_remote_worker(args)
+    
+    # webui.app reads the database location at import time
+    os.environ['DATABASE_PATH'] = args.db
     
     # Import Flask app for database access
     sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webui'))
     from webui.app import create_app
     from webui.models import db, ImageJob, init_db
+    from webui.scheduler import schedule_batch
+    from webui.retention import archived_filenames
     
     app = create_app()
     
     # Initialize database and get completed filenames
     with app.app_context():
         init_db(app)
-        # Get already completed filenames
+        # Get already completed (or still queued) filenames
         completed = ImageJob.query.with_entities(ImageJob.filename).filter(
-            ImageJob.status == 'completed'
+            ImageJob.status.in_(['completed', 'pending', 'processing'])
         ).all()
-        completed_filenames = {row[0] for row in completed}
+        completed_filenames = {row[0] for row in completed} | archived_filenames()
+        # Workers claim any pending job in the DB (e.g. UI uploads), not just this scan
+        already_pending = ImageJob.query.filter_by(status='pending').count()
     
     # Scan images (skip already completed)
-    jobs = scan_images(args.input, args.output, args.scale, None, None, completed_filenames)
+    jobs = scan_images(args.input, args.output, args.scale, completed_filenames, args.max_megapixels)
+    
+    multiproc = args.procs > 1 or bool(args.devices)
     
-    if not jobs:
+    if not jobs and not already_pending and not args.follow:
         logger.warning("No NEW images found in input directory! (Already processed files skipped)")
         return
     
@@ -506,16 +869,69 @@ async def main():
                 original_path=job['input_path'],
                 output_path=job['output_path'],
                 scale_factor=job['scale_factor'],
+                width=job['width'],
+                height=job['height'],
+                pixel_count=job['pixel_count'],
+                model_name=args.model,
+                tile_size=args.tile,
+                face_enhance=args.face_enhance,
+                denoising_level=args.dn,
+                preset='custom',
                 status='pending',
                 progress_percent=0
             )
             db.session.add(db_job)
-            db.session.flush()
-            job['id'] = db_job.id
             db_jobs.append(db_job)
         
+        batch_id = args.batch or f"scan-{datetime.utcnow():%Y%m%d-%H%M%S}"
+        schedule_batch(db_jobs, batch_id, args.priority)
         db.session.commit()
-        logger.info(f"Created {len(db_jobs)} database entries")
+        logger.info(f"Created {len(db_jobs)} database entries (batch {batch_id}, priority {args.priority})", extra=KEEP)
+        
+        if multiproc:
+            from supervisor import WorkerSupervisor, plan_devices
+            
+            def requeue(worker_id, crashed):
+                with app.app_context():
+                    return ImageJob.requeue_worker(worker_id, crashed)
+            
+            watchdog = build_watchdog(args)
+            supervisor = WorkerSupervisor(
+                plan_devices(args.devices or 'auto', args.procs),
+                worker_config={
+                    'db': args.db,
+                    'output_dir': args.output,
+                    'scale': args.scale,
+                    'model_name': args.model,
+                    'denoise_strength': args.dn,
+                    'face_enhance': args.face_enhance,
+                    'tile_size': args.tile,
+                    'face_gate': not args.no_face_gate,
+                    'quality': args.quality,
+                    'flat_threshold': args.flat_threshold,
+                    'gray_tolerance': args.gray_tolerance,
+                    'gray_mode': args.gray_png,
+                    'compile_mode': args.compile,
+                    'pool_mb': args.pool_mb,
+                    'backend': args.backend,
+                    'follow': args.follow,
+                    'log_rate': args.log_rate,
+                    'log_level': logging.DEBUG if args.verbose else logging.INFO
+                },
+                on_crash=requeue,
+                watchdog=watchdog
+            )
+            summary = supervisor.run()
+            flush_db(db)
+            end_rate_limit()  # the run summary must not be rate-limited
+            logger.info(f"=== Upscaling Complete ===")
+            logger.info(f"Completed: {summary['completed']}")
+            logger.info(f"Failed: {summary['failed']}")
+            logger.info(f"Time elapsed: {summary['elapsed']:.2f} seconds")
+            logger.info(f"Throughput: {summary['images_per_sec']:.2f} img/s, {summary['mpix_per_sec']:.2f} MP/s")
+            log_run_stats(summary)
+            logger.info(f"Cost: ${watchdog.cost.cost():.4f} (idle ${watchdog.cost.idle_cost:.4f})")
+            return finish_shutdown(args, watchdog, summary['completed'])
         
         # Initialize upscaling engine
         engine = UpscaleEngine(
@@ -523,89 +939,184 @@ async def main():
             workers=args.workers, 
             model_name=args.model,
             denoise_strength=args.dn,
-            face_enhance=args.face_enhance
+            face_enhance=args.face_enhance,
+            tile_size=args.tile,
+            face_gate=not args.no_face_gate,
+            quality=args.quality,
+            flat_threshold=args.flat_threshold,
+            gray_tolerance=args.gray_tolerance,
+            gray_mode=args.gray_png,
+            compile_mode=args.compile,
+            pool_mb=args.pool_mb,
+            device=args.device or ('cuda' if _cuda_available() else 'cpu'),
+            backend=args.backend,
+            follow=args.follow
         )
         
-        if not engine.load_model():
-            logger.error("Failed to load model, exiting!")
-            return
-        
-        # Start watching for idle
-        idle_task = asyncio.create_task(idle_watchdog(engine, args.db))
+        # Start watching for idle / budget / deadline
+        watchdog = build_watchdog(args)
+        watchdog_task = asyncio.create_task(watchdog.run(engine))
         
         # Run upscaling
         start_time = time.time()
-        await engine.run_queue(jobs, db.session, ImageJob)
+        await engine.run_queue(db.session, ImageJob, args.output)
         elapsed = time.time() - start_time
         
-        # Cancel idle watchdog
-        idle_task.cancel()
+        watchdog_task.cancel()
+        flush_db(db)
         
         # Final stats
         completed = ImageJob.query.filter_by(status='completed').count()
         failed = ImageJob.query.filter_by(status='failed').count()
         
+        end_rate_limit()  # the run summary must not be rate-limited
         logger.info(f"=== Upscaling Complete ===")
         logger.info(f"Completed: {completed}")
         logger.info(f"Failed: {failed}")
         logger.info(f"Time elapsed: {elapsed:.2f} seconds")
-        if len(jobs) > 0:
-            logger.info(f"Average time per image: {elapsed/len(jobs):.2f} seconds")
+        processed = len(jobs) + already_pending
+        if processed > 0:
+            logger.info(f"Average time per image: {elapsed/processed:.2f} seconds")
+        log_run_stats(engine.run_stats())
+        logger.info(f"Cost: ${watchdog.cost.cost():.4f} (idle ${watchdog.cost.idle_cost:.4f})")
+        return finish_shutdown(args, watchdog, completed)
 
 
-async def idle_watchdog(engine, db_path, idle_threshold: int = 300, gpu_threshold: float = 5.0):
-    """
-    Watch GPU utilization and stop when idle.
-    Args:
-        idle_threshold: seconds of low GPU usage before stopping
-        gpu_threshold: GPU utilization threshold (percentage)
-    """
-    logger.info(f"Idle watchdog started (threshold: {idle_threshold}s < {gpu_threshold}% GPU)")
+def print_estimate(args):
+    """--estimate: capacity planner report from the job history in --db."""
+    os.environ['DATABASE_PATH'] = args.db
+    from webui.app import create_app
+    from webui.capacity import estimate
     
-    while True:
-        await asyncio.sleep(30)  # Check every 30 seconds
-        
-        # Get GPU utilization
-        try:
-            import subprocess
-            result = subprocess.run(
-                ['nvidia-smi', '--query-gpu=utilization.gpu', '--format=csv,noheader,nounits'],
-                capture_output=True,
-                text=True,
-                timeout=10
-            )
-            gpu_percent = float(result.stdout.strip().split('\n')[0])
-        except Exception as e:
-            logger.warning(f"Could not get GPU stats: {e}")
-            continue
-        
-        queue_empty = engine.queue.empty()
-        processing = engine.processing_count
-        
-        logger.debug(f"GPU: {gpu_percent}%, Queue: {queue_empty}, Processing: {processing}")
-        
-        if gpu_percent < gpu_threshold and queue_empty and processing == 0:
-            logger.info(f"GPU idle detected ({gpu_percent}%), waiting for threshold...")
-            await asyncio.sleep(idle_threshold)
-            
-            # Check again
-            try:
-                result = subprocess.run(
-                    ['nvidia-smi', '--query-gpu=utilization.gpu', '--format=csv,noheader,nounits'],
-                    capture_output=True,
-                    text=True,
-                    timeout=10
-                )
-                gpu_percent = float(result.stdout.strip().split('\n')[0])
-            except:
-                continue
-            
-            if gpu_percent < gpu_threshold and engine.queue.empty() and engine.processing_count == 0:
-                logger.info("Still idle, initiating shutdown...")
-                break
+    with create_app().app_context():
+        report = estimate(args.hourly_rate, args.deadline, args.budget, args.batch, args.max_nodes)
+    
+    print(f"\nPending: {report['pending_jobs']} job(s), {report['pending_megapixels']:.1f} MP"
+          + (f" (batch {args.batch})" if args.batch else ''))
+    for model, rate in report['throughput'].items():
+        print(f"  {model:30s} {rate['mp_per_sec']:.3f} MP/s per node ({rate['source']}, {rate['samples']} run(s))")
+    if report['options']:
+        print(f"\n  {'nodes':>5s} {'wall':>10s} {'cost':>10s}")
+        for option in report['options']:
+            mark = '  <- recommended' if option is report['recommended'] else ''
+            flags = '' if option['meets_deadline'] else '  (misses deadline)'
+            print(f"  {option['nodes']:5d} {option['wall_seconds'] / 60:8.1f} m ${option['cost_usd']:9.4f}{flags}{mark}")
+    print()
+    for line in report['advice']:
+        print(f"  - {line}")
+    print()
+
+
+def run_remote_worker(args) -> int:
+    """--remote-worker mode: lease jobs over HTTP; no local DB or input scan."""
+    from remote_worker import RemoteWorker
+    
+    engine = UpscaleEngine(
+        scale=args.scale,
+        workers=1,
+        model_name=args.model,
+        denoise_strength=args.dn,
+        face_enhance=args.face_enhance,
+        tile_size=args.tile,
+        face_gate=not args.no_face_gate,
+        quality=args.quality,
+        flat_threshold=args.flat_threshold,
+        gray_tolerance=args.gray_tolerance,
+        gray_mode=args.gray_png,
+        compile_mode=args.compile,
+        pool_mb=args.pool_mb,
+        device=args.device or ('cuda' if _cuda_available() else 'cpu'),
+        backend=args.backend,
+        follow=args.follow
+    )
+    watchdog = build_watchdog(args)
+    worker = RemoteWorker(
+        args.remote_worker,
+        args.worker_token,
+        engine,
+        worker_id=args.worker_id,
+        batch_size=args.workers,
+        follow=args.follow,
+        watchdog=watchdog
+    )
+    summary = worker.run()
+    
+    end_rate_limit()  # the run summary must not be rate-limited
+    logger.info(f"=== Remote Worker Complete ===")
+    logger.info(f"Completed: {summary['completed']}, failed: {summary['failed']}, lost leases: {summary['lost']}")
+    if summary['elapsed'] > 0:
+        logger.info(f"Throughput: {summary['completed'] / summary['elapsed']:.2f} img/s, "
+                    f"{summary['pixels'] / 1e6 / summary['elapsed']:.2f} MP/s")
+    log_run_stats(engine.run_stats())
+    logger.info(f"Cost: ${watchdog.cost.cost():.4f} (idle ${watchdog.cost.idle_cost:.4f})")
+    return finish_shutdown(args, watchdog, summary['completed'])
+
+
+def log_run_stats(stats: dict):
+    """Summary lines for engine counters (execution plan, scale routes, flat tiles, grayscale, face gate, compile, buffer pool)."""
+    plan = stats['plan']
+    if plan:
+        logger.info(f"Execution plan: {plan['groups']} parameter group(s), {plan['switches']} switch(es), {plan['reloads']} model reload(s)")
+    routes = stats['routes']
+    if routes:
+        logger.info(f"Scale routes: {', '.join(f'{name} {count}' for name, count in sorted(routes.items()))}")
+    flat = stats['flat']
+    if flat.get('pixels'):
+        logger.info(f"Flat tiles: {flat['skipped_pixels'] / flat['pixels']:.1%} of model pixels saved")
+    gray = stats['gray']
+    if gray.get('pages'):
+        logger.info(f"Grayscale: {gray['grayscale']} of {gray['pages']} page(s) written single-channel")
+    face = stats['face']
+    if face:
+        logger.info(f"Face gate: {face['checked']} checked, GFPGAN skipped on {face['skipped']}, "
+                    f"{face['with_faces']} with faces, {face['cache_hits']} cache hit(s)")
+    compiled = stats['compile']
+    if compiled.get('buckets'):
+        line = f"Compiled inference: {compiled['buckets']} shape bucket(s), {compiled['compile_seconds']:.1f}s compile + warmup"
+        if compiled['bench_runs'] and compiled['bench_compiled_seconds']:
+            eager = compiled['bench_eager_seconds'] / compiled['bench_runs']
+            fast = compiled['bench_compiled_seconds'] / compiled['bench_runs']
+            line += f"; full tile {eager * 1000:.0f} → {fast * 1000:.0f} ms ({eager / fast:.2f}x)"
+            line += (f", pays off after {compiled['compile_seconds'] / (eager - fast):.0f} tile(s)"
+                     if eager > fast else ", no steady-state gain")
+        if compiled['calls']:
+            padding = compiled['padded_pixels'] / (compiled['pixels'] + compiled['padded_pixels'])
+            line += f"; {compiled['calls']} tile(s) run, {padding:.1%} padding"
+        logger.info(line)
+    pool = stats['pool']
+    if pool.get('hits') or pool.get('misses'):
+        logger.info(f"Buffer pool: {pool['hits'] / (pool['hits'] + pool['misses']):.1%} reuse "
+                    f"({pool['hits']} hits, {pool['misses']} misses), peak {pool['peak_bytes'] / 1024 ** 2:.0f} MB, "
+                    f"{pool['evictions']} eviction(s)")
+
+
+def flush_db(db):
+    """Commit outstanding writes and checkpoint the SQLite WAL before exiting."""
+    db.session.commit()
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    db.engine.dispose()
+
+
+def finish_shutdown(args, watchdog, completed: int) -> int:
+    """Record a watchdog-initiated shutdown; returns the process exit code."""
+    if not watchdog.shutdown:
+        return 0
+    
+    record = dict(watchdog.shutdown,
+                  cost_usd=round(watchdog.cost.cost(), 4),
+                  idle_cost_usd=round(watchdog.cost.idle_cost, 4),
+                  elapsed_sec=round(watchdog.cost.elapsed(), 1),
+                  completed=completed,
+                  time=datetime.utcnow().isoformat())
+    os.makedirs(os.path.dirname(args.shutdown_file), exist_ok=True)
+    with open(args.shutdown_file, 'w') as f:
+        json.dump(record, f)
     
-    logger.info("Idle watchdog: Shutting down...")
+    logger.info(f"Watchdog shutdown ({record['policy']}): {record['reason']}, exit code {record['exit_code']}")
+    return record['exit_code']
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    sys.exit(asyncio.run(main()))
@@ -23,7 +23,8 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
         'pool_pre_ping': True,
-        'pool_recycle': 300
+        'pool_recycle': 300,
+        'connect_args': {'timeout': 30}  # worker processes share the SQLite file
     }
     
     # Initialize database
@@ -41,5 +42,7 @@ def create_app():
     # Register blueprints/routes
     from webui.routes import bp
     app.register_blueprint(bp)
+    from webui.worker_api import bp as worker_bp
+    app.register_blueprint(worker_bp)
     
     return app
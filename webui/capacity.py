@@ -0,0 +1,200 @@
+"""
+Capacity planning for the ImageJob queue.
+
+Fits per-model throughput (megapixels per second per node) from completed
+runs: a host's busy time on a batch is the sum of its jobs' durations
+(completed_at - started_at) divided by the number of worker slots it ran
+them on, so idle gaps, other models' jobs in the same batch and slow
+stragglers on another host don't count against it. Everything is
+aggregated in SQL, one row per (batch, model, worker slot), over the live
+queue and the retention archive (webui.retention), so history survives
+archiving. Models without history are derived from the measured ones
+through the scheduler's relative MODEL_COST.
+
+From that, the pending queue (or one batch) is turned into wall time and
+cost for 1..max_nodes nodes at an hourly rate, with a recommendation and
+advice on when more nodes or a lighter model would meet the deadline.
+"""
+
+from sqlalchemy import case, func, select
+from webui.models import db, ImageJob
+from webui.retention import archive_select, archive_table
+from webui.scheduler import MODEL_COST
+
+MIN_JOBS = 3  # completed jobs a batch needs to count as a sample
+STARTUP_SECONDS = 60  # per node: container start + model load
+DEFAULT_MP_PER_SEC = 0.1  # RealESRGAN_x4plus-equivalent guess with no history at all
+
+
+def _megapixels(jobs=ImageJob.__table__.c):
+    """SQL expression: input megapixels of a job (probed, else back out of est_cost)."""
+    model_cost = case(MODEL_COST, value=jobs.model_name, else_=1.0)
+    return func.coalesce(
+        func.nullif(jobs.pixel_count, 0) / 1e6,
+        func.nullif(jobs.est_cost, 0) / model_cost,
+        1.0
+    )
+
+
+def _slot_totals(table):
+    """Completed work per (batch, model, worker slot) of a job table."""
+    jobs = table.c
+    # A worker slot (worker_id) runs one job at a time, so its job durations
+    # add up to its busy time
+    seconds = (func.julianday(jobs.completed_at) - func.julianday(jobs.started_at)) * 86400
+    return select(
+        jobs.batch_id, jobs.model_name, jobs.worker_id,
+        func.count(), func.sum(_megapixels(jobs)), func.sum(seconds)
+    ).where(
+        jobs.status == 'completed',
+        jobs.started_at.isnot(None),
+        jobs.completed_at.isnot(None),
+        jobs.completed_at > jobs.started_at
+    ).group_by(jobs.batch_id, jobs.model_name, jobs.worker_id)
+
+
+def fit_throughput() -> dict:
+    """Measured throughput per model: {model: {'mp_per_sec', 'samples', 'source'}}."""
+    rows = db.session.execute(_slot_totals(ImageJob.__table__)).all()
+    rows += archive_select(_slot_totals(archive_table()))
+
+    runs = {}  # (batch, model) -> {host: [jobs, megapixels, slot-seconds, worker slots]}
+    for batch_id, model, worker_id, count, megapixels, busy in rows:
+        host = (worker_id or 'local').split(':')[0]
+        run = runs.setdefault((batch_id, model), {}).setdefault(host, [0, 0.0, 0.0, set()])
+        run[0] += count
+        run[1] += megapixels
+        run[2] += busy
+        run[3].add(worker_id)  # a slot may be half archived, half live
+
+    totals = {}  # model -> [megapixels, node-seconds, samples]
+    for (_, model), hosts in runs.items():
+        if sum(h[0] for h in hosts.values()) < MIN_JOBS:
+            continue
+        total = totals.setdefault(model, [0.0, 0.0, 0])
+        for _, megapixels, busy, slots in hosts.values():
+            # Slots on one host run side by side: node time is slot time / slots
+            total[0] += megapixels
+            total[1] += busy / len(slots)
+        total[2] += 1
+
+    return {
+        model: {'mp_per_sec': mp / node_seconds, 'samples': samples, 'source': 'history'}
+        for model, (mp, node_seconds, samples) in totals.items()
+    }
+
+
+def model_throughput(fitted: dict, model: str) -> dict:
+    """Throughput of a model, derived from the measured ones if it has no history."""
+    if model in fitted:
+        return fitted[model]
+    if fitted:
+        # x4plus-equivalent rate of the best-sampled model, scaled by relative cost
+        ref_model, ref = max(fitted.items(), key=lambda item: item[1]['samples'])
+        base = ref['mp_per_sec'] * MODEL_COST.get(ref_model, 1.0)
+    else:
+        base = DEFAULT_MP_PER_SEC
+    return {'mp_per_sec': base / MODEL_COST.get(model, 1.0), 'samples': 0, 'source': 'derived'}
+
+
+def _pending_work(batch_id: str = None) -> tuple:
+    """Pending megapixels per model and the pending job count."""
+    query = db.session.query(
+        ImageJob.model_name, func.count(ImageJob.id), func.sum(_megapixels())
+    ).filter(ImageJob.status.in_(['pending', 'processing']))
+    if batch_id:
+        query = query.filter(ImageJob.batch_id == batch_id)
+    rows = query.group_by(ImageJob.model_name).all()
+    return {model: megapixels for model, _, megapixels in rows}, sum(count for _, count, _ in rows)
+
+
+def _option(work_seconds: float, nodes: int, hourly_rate: float, deadline: float, budget: float) -> dict:
+    wall = STARTUP_SECONDS + work_seconds / nodes
+    cost = nodes * hourly_rate * wall / 3600
+    return {
+        'nodes': nodes,
+        'wall_seconds': round(wall, 1),
+        'cost_usd': round(cost, 4),
+        'meets_deadline': deadline is None or wall <= deadline,
+        'within_budget': budget is None or cost <= budget
+    }
+
+
+def _pick(options: list) -> dict:
+    """Fewest nodes meeting deadline and budget, else fewest meeting the deadline, else the fastest."""
+    for check in (lambda o: o['meets_deadline'] and o['within_budget'], lambda o: o['meets_deadline']):
+        fitting = [o for o in options if check(o)]
+        if fitting:
+            return fitting[0]
+    return min(options, key=lambda o: o['wall_seconds'])
+
+
+def _minutes(seconds: float) -> str:
+    return f"{seconds / 60:.1f} min"
+
+
+def estimate(hourly_rate: float = 0.0, deadline_minutes: float = None, budget: float = None,
+             batch_id: str = None, max_nodes: int = 8) -> dict:
+    """Wall time / cost forecast for the pending queue (or one batch)."""
+    deadline = deadline_minutes * 60 if deadline_minutes else None
+    fitted = fit_throughput()
+    work, pending_jobs = _pending_work(batch_id)
+    rates = {model: model_throughput(fitted, model) for model in work}
+    work_seconds = sum(mp / rates[model]['mp_per_sec'] for model, mp in work.items())
+
+    report = {
+        'pending_jobs': pending_jobs,
+        'pending_megapixels': round(sum(work.values()), 2),
+        'throughput': rates,
+        'options': [],
+        'recommended': None,
+        'alternatives': [],
+        'advice': []
+    }
+    if not work:
+        report['advice'].append('Nothing pending.')
+        return report
+
+    options = [_option(work_seconds, n, hourly_rate, deadline, budget) for n in range(1, max_nodes + 1)]
+    best = _pick(options)
+    report['options'] = options
+    report['recommended'] = best
+
+    # Same megapixels through a single lighter / heavier model
+    total_mp = sum(work.values())
+    for model in sorted(MODEL_COST):
+        if set(work) == {model}:
+            continue
+        seconds = total_mp / model_throughput(fitted, model)['mp_per_sec']
+        alt_options = [_option(seconds, n, hourly_rate, deadline, budget) for n in range(1, max_nodes + 1)]
+        report['alternatives'].append(dict(_pick(alt_options), model=model))
+    report['alternatives'].sort(key=lambda a: (a['nodes'], a['cost_usd']))
+
+    advice = report['advice']
+    single = options[0]
+    advice.append(f"1 node: {_minutes(single['wall_seconds'])}, ${single['cost_usd']:.4f}")
+    if deadline is not None:
+        if single['meets_deadline']:
+            advice.append(f"One node meets the {deadline_minutes:g} min deadline.")
+        elif best['meets_deadline']:
+            advice.append(
+                f"Adding nodes: {best['nodes']} nodes finish in {_minutes(best['wall_seconds'])} "
+                f"(${best['cost_usd']:.4f}), meeting the {deadline_minutes:g} min deadline."
+            )
+        else:
+            advice.append(
+                f"Even {max_nodes} nodes need {_minutes(options[-1]['wall_seconds'])}; "
+                f"the {deadline_minutes:g} min deadline can't be met with the current model(s)."
+            )
+        faster = [a for a in report['alternatives'] if a['meets_deadline']]
+        if faster and (not best['meets_deadline'] or faster[0]['nodes'] < best['nodes']):
+            alt = faster[0]
+            advice.append(
+                f"Switching to {alt['model']}: {alt['nodes']} node(s), {_minutes(alt['wall_seconds'])}, "
+                f"${alt['cost_usd']:.4f} (different output quality)."
+            )
+    if budget is not None and not best['within_budget']:
+        advice.append(f"Recommended plan costs ${best['cost_usd']:.4f}, over the ${budget:.4f} budget.")
+    if any(r['source'] == 'derived' for r in rates.values()):
+        advice.append('Some rates are derived from relative model cost, not measured history.')
+    return report
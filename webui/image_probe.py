@@ -0,0 +1,219 @@
+"""
+Header-only image probe for Comic Upscale.
+Reads just enough of each file to know its format, dimensions, channels and
+bit depth (PNG, JPEG, BMP, WebP, TIFF), without decoding pixels. Only
+formats the worker's decoder (cv2.imread) reads are accepted: GIF headers
+are recognised, but rejected with a clear error.
+
+Runs at scan / upload time, in parallel, so corrupt or oversized files are
+rejected before they tie up a worker slot and a loaded model, and the
+pixel count is known to the scheduler's cost estimates.
+"""
+
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MAX_MEGAPIXELS = 64
+
+# File extensions picked up by directory scans (same formats as the probe accepts)
+SUPPORTED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.jfif', '.bmp', '.tif', '.tiff', '.webp'}
+
+
+class ProbeError(ValueError):
+    """File is not a readable image (or is too large to process)."""
+
+
+def _read(f, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) < size:
+        raise ProbeError('truncated header')
+    return data
+
+
+def _png(f, head):
+    f.seek(8)
+    length, chunk = struct.unpack('>I4s', _read(f, 8))
+    if chunk != b'IHDR' or length < 13:
+        raise ProbeError('missing IHDR chunk')
+    width, height, bit_depth, color_type = struct.unpack('>IIBB', _read(f, 10))
+    channels = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}.get(color_type)
+    if channels is None:
+        raise ProbeError(f'bad PNG color type {color_type}')
+    return 'png', width, height, channels, bit_depth
+
+
+def _gif(f, head):
+    raise ProbeError('GIF is not supported (OpenCV cannot decode it), convert to PNG')
+
+
+def _bmp(f, head):
+    f.seek(14)
+    header_size = struct.unpack('<I', _read(f, 4))[0]
+    if header_size == 12:  # BITMAPCOREHEADER
+        width, height, _, bpp = struct.unpack('<hhHH', _read(f, 8))
+    elif header_size >= 40:
+        width, height, _, bpp = struct.unpack('<iiHH', _read(f, 12))
+    else:
+        raise ProbeError(f'bad BMP header size {header_size}')
+    return 'bmp', width, abs(height), 4 if bpp == 32 else 3, 8
+
+
+def _webp(f, head):
+    f.seek(12)
+    chunk = _read(f, 4)
+    f.seek(20)
+    data = _read(f, 10)
+    if chunk == b'VP8 ':
+        if data[3:6] != b'\x9d\x01\x2a':
+            raise ProbeError('bad VP8 frame header')
+        width, height = struct.unpack('<HH', data[6:10])
+        return 'webp', width & 0x3fff, height & 0x3fff, 3, 8
+    if chunk == b'VP8L':
+        if data[0] != 0x2f:
+            raise ProbeError('bad VP8L signature')
+        bits = struct.unpack('<I', data[1:5])[0]
+        alpha = (bits >> 28) & 1
+        return 'webp', (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1, 4 if alpha else 3, 8
+    if chunk == b'VP8X':
+        alpha = data[0] & 0x10
+        width = int.from_bytes(data[4:7], 'little') + 1
+        height = int.from_bytes(data[7:10], 'little') + 1
+        return 'webp', width, height, 4 if alpha else 3, 8
+    raise ProbeError(f'unknown WebP chunk {chunk!r}')
+
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg(f, head):
+    f.seek(2)
+    while True:
+        byte = _read(f, 1)[0]
+        if byte != 0xFF:
+            raise ProbeError('bad JPEG marker')
+        marker = _read(f, 1)[0]
+        while marker == 0xFF:  # fill bytes
+            marker = _read(f, 1)[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue  # no payload
+        if marker in (0xD9, 0xDA):
+            raise ProbeError('no JPEG frame header before scan data')
+        length = struct.unpack('>H', _read(f, 2))[0]
+        if marker in _SOF_MARKERS:
+            precision, height, width, components = struct.unpack('>BHHB', _read(f, 6))
+            return 'jpeg', width, height, components, precision
+        f.seek(length - 2, 1)
+
+
+# TIFF field types: byte size and struct code
+_TIFF_TYPES = {3: (2, 'H'), 4: (4, 'I'), 16: (8, 'Q')}
+
+
+def _tiff(f, head):
+    order = '<' if head[:2] == b'II' else '>'
+    big = struct.unpack(order + 'H', head[2:4])[0] == 43
+    if big:
+        f.seek(8)
+        offset = struct.unpack(order + 'Q', _read(f, 8))[0]
+        count_fmt, entry_fmt, entry_size, inline = 'Q', 'HHQ', 20, 8
+    else:
+        offset = struct.unpack(order + 'I', head[4:8])[0]
+        count_fmt, entry_fmt, entry_size, inline = 'H', 'HHI', 12, 4
+
+    f.seek(offset)
+    count = struct.unpack(order + count_fmt, _read(f, struct.calcsize(count_fmt)))[0]
+    tags = {}
+    for _ in range(min(count, 512)):
+        entry = _read(f, entry_size)
+        tag, field_type, values = struct.unpack(order + entry_fmt, entry[:entry_size - inline])
+        if tag not in (256, 257, 258, 277) or field_type not in _TIFF_TYPES:
+            continue
+        size, code = _TIFF_TYPES[field_type]
+        raw = entry[entry_size - inline:]
+        if size * values > inline:  # stored elsewhere; first value is enough
+            pointer = struct.unpack(order + ('Q' if big else 'I'), raw)[0]
+            position = f.tell()
+            f.seek(pointer)
+            raw = _read(f, size)
+            f.seek(position)
+        tags[tag] = struct.unpack(order + code, raw[:size])[0]
+
+    if 256 not in tags or 257 not in tags:
+        raise ProbeError('TIFF without image dimensions')
+    return 'tiff', tags[256], tags[257], tags.get(277, 1), tags.get(258, 1)
+
+
+_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', _png),
+    (b'\xff\xd8', _jpeg),
+    (b'GIF87a', _gif),
+    (b'GIF89a', _gif),
+    (b'BM', _bmp),
+    (b'II*\x00', _tiff),
+    (b'MM\x00*', _tiff),
+    (b'II+\x00', _tiff),
+    (b'MM\x00+', _tiff),
+]
+
+
+def probe_image(path: str) -> dict:
+    """
+    Header information of an image file.
+    Returns:
+        {'format', 'width', 'height', 'channels', 'bit_depth', 'pixel_count'}
+    Raises:
+        ProbeError if the file is unreadable or not a supported image
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(16)
+            if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+                parser = _webp
+            else:
+                parser = next((p for sig, p in _SIGNATURES if head.startswith(sig)), None)
+            if parser is None:
+                raise ProbeError('unrecognized image format')
+            fmt, width, height, channels, bit_depth = parser(f, head)
+    except (OSError, struct.error) as e:
+        raise ProbeError(str(e)) from e
+
+    if width <= 0 or height <= 0:
+        raise ProbeError(f'invalid dimensions {width}x{height}')
+    return {
+        'format': fmt,
+        'width': width,
+        'height': height,
+        'channels': channels,
+        'bit_depth': bit_depth,
+        'pixel_count': width * height
+    }
+
+
+def check_image(path: str, max_megapixels: float = DEFAULT_MAX_MEGAPIXELS) -> dict:
+    """probe_image() plus the size limit."""
+    info = probe_image(path)
+    if max_megapixels and info['pixel_count'] > max_megapixels * 1e6:
+        raise ProbeError(
+            f"{info['width']}x{info['height']} is {info['pixel_count'] / 1e6:.1f} MP "
+            f"(limit {max_megapixels:g} MP)"
+        )
+    return info
+
+
+def probe_images(paths: list, max_megapixels: float = DEFAULT_MAX_MEGAPIXELS, workers: int = 16) -> list:
+    """
+    Probe many files in parallel (header reads are I/O bound).
+    Returns:
+        list of (path, info or None, error or None), in input order
+    """
+    def probe(path):
+        try:
+            return path, check_image(path, max_megapixels), None
+        except ProbeError as e:
+            return path, None, str(e)
+
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+        return list(executor.map(probe, paths))
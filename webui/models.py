@@ -58,6 +58,9 @@ PRESETS = {
     }
 }
 
+# Worker deaths a job may cause before it is failed instead of requeued
+MAX_CRASHES = 3
+
 # Available models
 AVAILABLE_MODELS = [
     ('RealESRGAN_x4plus', 'Real-ESRGAN 4x (General)'),
@@ -82,10 +85,26 @@ class ImageJob(db.Model):
     denoising_level = db.Column(db.Float, default=0)
     preset = db.Column(db.String(20), default='art')  # art, drawing, photo
     
+    # Input image (header probe, see webui/image_probe.py)
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    pixel_count = db.Column(db.Integer, nullable=True)
+    
+    # Scheduling (see webui/scheduler.py)
+    priority = db.Column(db.Integer, default=0)  # -1 low .. 2 urgent
+    batch_id = db.Column(db.String(64), nullable=True, index=True)  # upload/scan batch
+    est_cost = db.Column(db.Float, nullable=True)  # megapixels x model cost
+    sched_tag = db.Column(db.Float, nullable=True, index=True)  # virtual finish tag, claimed in ascending order
+    
     # Status tracking
     status = db.Column(db.String(20), nullable=False, default='pending')
     progress_percent = db.Column(db.Integer, default=0)
     error_message = db.Column(db.Text, nullable=True)
+    worker_id = db.Column(db.String(64), nullable=True)  # host:slot that claimed the job
+    lease_expires_at = db.Column(db.DateTime, nullable=True)  # remote workers only, renewed by heartbeat
+    crashes = db.Column(db.Integer, default=0)  # workers that died holding the job (see MAX_CRASHES)
+    skipped_fraction = db.Column(db.Float, nullable=True)  # share of a whole-image model pass saved by flat tiles
+    is_grayscale = db.Column(db.Boolean, nullable=True)  # written as single-channel output
     
     # Timestamps
     started_at = db.Column(db.DateTime, nullable=True)
@@ -103,11 +122,117 @@ class ImageJob(db.Model):
             'model': self.model_name,
             'face_enhance': self.face_enhance,
             'preset': self.preset,
+            'width': self.width,
+            'height': self.height,
+            'priority': self.priority,
+            'batch_id': self.batch_id,
             'error': self.error_message,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'worker_id': self.worker_id,
+            'skipped_fraction': self.skipped_fraction,
+            'is_grayscale': self.is_grayscale
         }
 
+    @staticmethod
+    def claim_next(worker_id, batch_size=8, params=None, lease_expires_at=None):
+        """Atomically claim the next pending job for a worker (None if queue empty).
+
+        Jobs are handed out in fair-share order (lowest sched_tag first),
+        optionally only those matching a parameter group (column -> value).
+        Safe across processes sharing one SQLite file: the status flip is a
+        conditional UPDATE, so a job claimed by another worker in between is
+        simply skipped. Remote claims pass lease_expires_at, which is set in
+        that same UPDATE, so no claimed job is ever left without a lease.
+        """
+        candidates = ImageJob.query.with_entities(ImageJob.id).filter_by(
+            status='pending', **(params or {})
+        ).order_by(db.func.coalesce(ImageJob.sched_tag, 0), ImageJob.id).limit(batch_size).all()
+        for (job_id,) in candidates:
+            claimed = ImageJob.query.filter_by(id=job_id, status='pending').update({
+                'status': 'processing',
+                'worker_id': worker_id,
+                'started_at': datetime.utcnow(),
+                'lease_expires_at': lease_expires_at
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return db.session.get(ImageJob, job_id)
+        return None
+
+    @staticmethod
+    def _requeue(query, crashed=True):
+        """Return claimed jobs to the pending queue; returns (requeued, failed).
+
+        With crashed=True the job counts against MAX_CRASHES: a page that
+        keeps killing its worker (decoder segfault, OOM kill) is failed
+        instead of being handed straight to the next worker.
+        """
+        failed = 0
+        if crashed:
+            query.update({'crashes': db.func.coalesce(ImageJob.crashes, 0) + 1}, synchronize_session=False)
+            failed = query.filter(ImageJob.crashes >= MAX_CRASHES).update({
+                'status': 'failed',
+                'error_message': f'Worker died while processing this job {MAX_CRASHES} times',
+                'lease_expires_at': None
+            }, synchronize_session=False)
+        requeued = query.update({
+            'status': 'pending',
+            'worker_id': None,
+            'started_at': None,
+            'lease_expires_at': None
+        }, synchronize_session=False)
+        db.session.commit()
+        return requeued, failed
+
+    @staticmethod
+    def requeue_worker(worker_id, crashed=True):
+        """Return jobs left 'processing' by a dead worker to the pending queue."""
+        return ImageJob._requeue(ImageJob.query.filter_by(status='processing', worker_id=worker_id), crashed)
+
+    @staticmethod
+    def requeue_expired():
+        """Return jobs whose remote-worker lease ran out to the pending queue."""
+        query = ImageJob.query.filter(
+            ImageJob.status == 'processing',
+            ImageJob.lease_expires_at < datetime.utcnow()
+        )
+        if not db.session.query(query.exists()).scalar():
+            return 0, 0  # the common case: no write, no lock on the shared file
+        return ImageJob._requeue(query)
+
+    @staticmethod
+    def renew_leases(worker_id, job_ids, expires_at):
+        """Extend a remote worker's leases; returns the ids it still holds."""
+        held = ImageJob.query.filter(
+            ImageJob.id.in_(job_ids),
+            ImageJob.status == 'processing',
+            ImageJob.worker_id == worker_id
+        )
+        held.update({'lease_expires_at': expires_at}, synchronize_session=False)
+        db.session.commit()
+        return [job_id for (job_id,) in held.with_entities(ImageJob.id)]
+
+
+def _migrate_columns():
+    """Add columns introduced after a database was created (create_all won't)."""
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=db.engine.dialect)}'
+            if column.default is not None and column.default.is_scalar:
+                value = column.default.arg
+                ddl += f" DEFAULT '{value}'" if isinstance(value, str) else f' DEFAULT {int(value) if isinstance(value, bool) else value}'
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(ddl)
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
 
 def init_db(app):
     """Initialize database with app context."""
@@ -116,6 +241,11 @@ def init_db(app):
     db.init_app(app)
     with app.app_context():
         db.create_all()
+        _migrate_columns()
+        if db.engine.dialect.name == 'sqlite':
+            # WAL lets the UI read while worker processes write
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql('PRAGMA journal_mode=WAL')
         # Create default admin user if not exists
         if not User.query.first():
             admin = User(username='admin')
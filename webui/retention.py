@@ -0,0 +1,398 @@
+"""
+Retention for the ImageJob queue.
+
+Completed / failed jobs older than the policy are moved into a compact
+job_archive table in a separate SQLite file (ARCHIVE_PATH, default
+archive.db next to the queue database), so dashboard queries, the
+scheduler and backups only see live work. The archive is ATTACHed to the
+queue connection, but in WAL mode a transaction spanning two attached
+databases is not atomic, so the copy is committed first and the delete of
+the exported rows runs in a second transaction. A crash in between leaves
+a row in both files; the next run skips the copy it already has and
+deletes it, so no row is lost and none stays duplicated. Archive rows have
+their own key: SQLite hands out job ids again once the queue table is
+empty, so a job is identified by (id, created_at), never by id alone.
+After export, outputs are kept, deleted or moved to cold storage; the
+archive row records which.
+
+The queue database is switched to auto_vacuum=INCREMENTAL once (one full
+VACUUM); every later run hands free pages back to the filesystem with
+PRAGMA incremental_vacuum instead of rebuilding the whole file.
+
+Usage:
+    python -m webui.retention                       # dry-run report
+    python -m webui.retention --apply --days 30 --outputs move --move-to /mnt/cold
+    python -m webui.retention --apply --every 24    # keep running, once a day
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import column, table
+from sqlalchemy.exc import OperationalError
+from webui.models import db, ImageJob
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_TABLE = 'job_archive'
+# Columns kept per archived job (enough for audits and for the capacity
+# planner's throughput fit, see webui.capacity)
+ARCHIVE_COLUMNS = (
+    'id', 'filename', 'original_path', 'output_path', 'status', 'error_message',
+    'model_name', 'scale_factor', 'preset', 'batch_id', 'priority',
+    'width', 'height', 'pixel_count', 'est_cost', 'worker_id', 'skipped_fraction', 'is_grayscale',
+    'started_at', 'completed_at', 'created_at'
+)
+OUTPUT_ACTIONS = ('keep', 'delete', 'move')
+DEFAULT_DAYS = 30
+CHUNK = 500  # ids per statement (SQLite variable limit)
+
+
+def archive_path() -> str:
+    """Archive database file (ARCHIVE_PATH, else archive.db beside the queue DB)."""
+    return os.environ.get('ARCHIVE_PATH') or os.path.join(
+        os.path.dirname(db.engine.url.database), 'archive.db'
+    )
+
+
+def _column_type(name: str) -> str:
+    return ImageJob.__table__.c[name].type.compile(dialect=db.engine.dialect)
+
+
+def _create_archive(conn):
+    """Create the archive table, or bring one from an older version up to date.
+
+    Archives written before archive_id keyed rows on the job id (which SQLite
+    reuses); they are copied into the new layout once.
+    """
+    existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA archive.table_info({ARCHIVE_TABLE})')}
+    legacy = bool(existing) and 'archive_id' not in existing
+    if legacy:
+        conn.exec_driver_sql(f'ALTER TABLE archive.{ARCHIVE_TABLE} RENAME TO {ARCHIVE_TABLE}_old')
+    columns = ', '.join(f'{name} {_column_type(name)}' for name in ARCHIVE_COLUMNS)
+    conn.exec_driver_sql(
+        f'CREATE TABLE IF NOT EXISTS archive.{ARCHIVE_TABLE} ('
+        f'archive_id INTEGER PRIMARY KEY AUTOINCREMENT, {columns}, '
+        f'archived_at DATETIME, output_state VARCHAR(10), UNIQUE (id, created_at))'
+    )
+    if legacy:
+        kept = ', '.join(name for name in (*ARCHIVE_COLUMNS, 'archived_at', 'output_state') if name in existing)
+        conn.exec_driver_sql(
+            f'INSERT OR IGNORE INTO archive.{ARCHIVE_TABLE} ({kept}) '
+            f'SELECT {kept} FROM archive.{ARCHIVE_TABLE}_old'
+        )
+        conn.exec_driver_sql(f'DROP TABLE archive.{ARCHIVE_TABLE}_old')
+        logger.info("Archive table migrated to its own row key")
+    elif existing:
+        for name in ARCHIVE_COLUMNS:
+            if name not in existing:
+                conn.exec_driver_sql(f'ALTER TABLE archive.{ARCHIVE_TABLE} ADD COLUMN {name} {_column_type(name)}')
+    conn.commit()
+
+
+@contextmanager
+def _attached(create: bool = True):
+    """Queue connection with the archive attached as 'archive'."""
+    path = archive_path()
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('ATTACH DATABASE ? AS archive', (path,))
+        try:
+            if create:
+                _create_archive(conn)
+            yield conn
+        finally:
+            conn.rollback()
+            conn.exec_driver_sql('DETACH DATABASE archive')
+
+
+def archive_table():
+    """The attached archive table, for SQLAlchemy selects run through archive_select()."""
+    return table(ARCHIVE_TABLE, *(column(name) for name in ARCHIVE_COLUMNS), schema='archive')
+
+
+def archive_select(statement) -> list:
+    """Rows of a select over archive_table() ([] when there is no archive yet)."""
+    if not os.path.exists(archive_path()):
+        return []
+    with _attached() as conn:  # brings an older archive's columns up to date
+        return conn.execute(statement).all()
+
+
+def _expired(days: float, failed_days: float = None, statuses=('completed', 'failed'), batch_id: str = None):
+    """Query of jobs past their retention (never pending or processing)."""
+    now = datetime.utcnow()
+    finished = db.func.coalesce(ImageJob.completed_at, ImageJob.created_at)
+    clauses = []
+    if 'completed' in statuses:
+        clauses.append(db.and_(ImageJob.status == 'completed', finished <= now - timedelta(days=days)))
+    if 'failed' in statuses:
+        cutoff = now - timedelta(days=days if failed_days is None else failed_days)
+        clauses.append(db.and_(ImageJob.status == 'failed', finished <= cutoff))
+    query = ImageJob.query.filter(db.or_(*clauses) if clauses else db.false())
+    if batch_id:
+        query = query.filter(ImageJob.batch_id == batch_id)
+    return query
+
+
+def _pragma(conn, name: str) -> int:
+    return conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+
+
+def storage() -> dict:
+    """Queue database size, free pages and vacuum mode."""
+    with db.engine.connect() as conn:
+        page_size = _pragma(conn, 'page_size')
+        pages = _pragma(conn, 'page_count')
+        free = _pragma(conn, 'freelist_count')
+        mode = _pragma(conn, 'auto_vacuum')
+    return {
+        'db_bytes': pages * page_size,
+        'free_bytes': free * page_size,
+        'auto_vacuum': {0: 'none', 1: 'full', 2: 'incremental'}.get(mode, str(mode))
+    }
+
+
+def report(days: float = DEFAULT_DAYS, failed_days: float = None, statuses=('completed', 'failed'),
+           batch_id: str = None) -> dict:
+    """Dry run: what a retention pass with this policy would archive and reclaim."""
+    jobs = _expired(days, failed_days, statuses, batch_id).with_entities(
+        ImageJob.status, ImageJob.output_path
+    ).all()
+    total_rows = ImageJob.query.count()
+
+    by_status = {}
+    outputs, output_bytes = 0, 0
+    for status, output_path in jobs:
+        by_status[status] = by_status.get(status, 0) + 1
+        if output_path and os.path.exists(output_path):
+            outputs += 1
+            output_bytes += os.path.getsize(output_path)
+
+    space = storage()
+    used = space['db_bytes'] - space['free_bytes']
+    return {
+        'policy': {'days': days, 'failed_days': days if failed_days is None else failed_days,
+                   'statuses': list(statuses), 'batch_id': batch_id},
+        'archive_path': archive_path(),
+        'rows': len(jobs),
+        'rows_by_status': by_status,
+        'rows_remaining': total_rows - len(jobs),
+        'outputs': outputs,
+        'output_bytes': output_bytes,
+        # rows are roughly uniform in size, so the table shrinks proportionally
+        'db_bytes_estimate': int(used * len(jobs) / total_rows) if total_rows else 0,
+        'storage': space
+    }
+
+
+def _dispose_output(job_id: int, output_path: str, action: str, move_to: str):
+    """Apply the output action to one file; returns (state, path)."""
+    if not output_path or not os.path.exists(output_path):
+        return 'missing', output_path
+    if action == 'delete':
+        os.remove(output_path)
+        return 'deleted', output_path
+    if action == 'move':
+        target = os.path.join(move_to, os.path.basename(output_path))
+        if os.path.exists(target):
+            target = os.path.join(move_to, f"{job_id}_{os.path.basename(output_path)}")
+        shutil.move(output_path, target)
+        return 'moved', target
+    return 'kept', output_path
+
+
+def archive_jobs(days: float = DEFAULT_DAYS, failed_days: float = None, statuses=('completed', 'failed'),
+                 batch_id: str = None, outputs: str = 'keep', move_to: str = None) -> dict:
+    """
+    Move expired jobs into the archive and dispose of their outputs.
+    Args:
+        days: age (since completion) after which completed jobs are archived
+        failed_days: same for failed jobs (default: days)
+        statuses: which finished states to archive
+        outputs: 'keep', 'delete' or 'move' (to move_to) the output files
+    Returns:
+        {'archived', 'outputs': {state: count}, 'freed_output_bytes'}
+    """
+    if outputs not in OUTPUT_ACTIONS:
+        raise ValueError(f"Unknown output action: {outputs}")
+    if outputs == 'move':
+        if not move_to:
+            raise ValueError("outputs='move' needs move_to")
+        os.makedirs(move_to, exist_ok=True)
+
+    ids = [job_id for (job_id,) in _expired(days, failed_days, statuses, batch_id).with_entities(ImageJob.id)]
+    result = {'archived': 0, 'outputs': {}, 'freed_output_bytes': 0}
+    if not ids:
+        return result
+
+    columns = ', '.join(ARCHIVE_COLUMNS)
+    archived_at = datetime.utcnow().isoformat(sep=' ')
+    with _attached() as conn:
+        for start in range(0, len(ids), CHUNK):
+            chunk = ids[start:start + CHUNK]
+            marks = ', '.join('?' * len(chunk))
+            # Copy, commit, then delete what the archive now holds (a WAL-mode
+            # transaction over both files isn't atomic, so never delete first).
+            # A copy left by an interrupted pass is skipped, not replaced.
+            conn.exec_driver_sql(
+                f'INSERT INTO archive.{ARCHIVE_TABLE} ({columns}, archived_at, output_state) '
+                f'SELECT {columns}, ?, NULL FROM {ImageJob.__tablename__} AS job '
+                f'WHERE job.id IN ({marks}) AND NOT EXISTS ('
+                f'SELECT 1 FROM archive.{ARCHIVE_TABLE} AS a WHERE a.id = job.id AND a.created_at IS job.created_at)',
+                (archived_at, *chunk)
+            )
+            conn.commit()
+            deleted = conn.exec_driver_sql(
+                f'DELETE FROM {ImageJob.__tablename__} WHERE id IN ({marks}) AND EXISTS ('
+                f'SELECT 1 FROM archive.{ARCHIVE_TABLE} AS a '
+                f'WHERE a.id = {ImageJob.__tablename__}.id AND a.created_at IS {ImageJob.__tablename__}.created_at)',
+                tuple(chunk)
+            ).rowcount
+            conn.commit()
+            result['archived'] += deleted
+
+        # Outputs only after their rows are safely exported (including rows
+        # an interrupted earlier run exported but didn't get to)
+        rows = conn.exec_driver_sql(
+            f'SELECT archive_id, id, output_path FROM archive.{ARCHIVE_TABLE} WHERE output_state IS NULL'
+        ).all()
+        for archive_id, job_id, output_path in rows:
+            size = os.path.getsize(output_path) if output_path and os.path.exists(output_path) else 0
+            try:
+                state, path = _dispose_output(job_id, output_path, outputs, move_to)
+            except OSError as e:
+                logger.warning(f"Could not {outputs} output of job {job_id}: {e}")
+                state, path = 'kept', output_path
+            if state in ('deleted', 'moved'):
+                result['freed_output_bytes'] += size
+            result['outputs'][state] = result['outputs'].get(state, 0) + 1
+            conn.exec_driver_sql(
+                f'UPDATE archive.{ARCHIVE_TABLE} SET output_state = ?, output_path = ? WHERE archive_id = ?',
+                (state, path, archive_id)
+            )
+        conn.commit()
+
+    logger.info(f"Archived {result['archived']} job(s) to {archive_path()}, outputs: {result['outputs']}")
+    return result
+
+
+def compact(pages: int = 0) -> dict:
+    """
+    Return free pages of the queue database to the filesystem.
+    The first call switches the file to auto_vacuum=INCREMENTAL (a one-off
+    full VACUUM, which needs a moment without writers); after that only
+    free pages are moved, so workers keep running.
+    Args:
+        pages: free pages to release per call, 0 = all
+    """
+    before = storage()
+    with db.engine.connect() as conn:
+        if before['auto_vacuum'] != 'incremental':
+            try:
+                conn.exec_driver_sql('PRAGMA auto_vacuum=INCREMENTAL')
+                conn.exec_driver_sql('VACUUM')
+                logger.info("Queue database switched to incremental auto-vacuum")
+            except OperationalError as e:
+                logger.warning(f"Could not switch to incremental auto-vacuum (database busy?): {e}")
+        conn.exec_driver_sql(f'PRAGMA incremental_vacuum({int(pages)})')
+        conn.commit()
+        # In WAL mode the file only shrinks once the log is checkpointed
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)').all()
+    after = storage()
+    return {'before': before, 'after': after, 'reclaimed_bytes': before['db_bytes'] - after['db_bytes']}
+
+
+def archived_filenames(status: str = 'completed') -> set:
+    """Filenames of archived jobs (so input scans don't redo them)."""
+    if not os.path.exists(archive_path()):
+        return set()
+    with _attached(create=False) as conn:
+        try:
+            rows = conn.exec_driver_sql(
+                f'SELECT filename FROM archive.{ARCHIVE_TABLE} WHERE status = ?', (status,)
+            ).all()
+        except OperationalError:
+            return set()  # archive file without the table yet
+    return {row[0] for row in rows}
+
+
+def run_retention(apply: bool = False, vacuum_pages: int = 0, **policy) -> dict:
+    """One retention pass: dry-run report, or archive + compact when apply is set."""
+    result = report(**{k: v for k, v in policy.items() if k not in ('outputs', 'move_to')})
+    result['applied'] = apply
+    if apply:
+        result['archive'] = archive_jobs(**policy)
+        result['compact'] = compact(vacuum_pages)
+    return result
+
+
+def _print(result: dict):
+    mb = 1024 * 1024
+    space = result['storage']
+    print(f"\nRetention {'run' if result['applied'] else 'dry run'}: "
+          f"completed > {result['policy']['days']:g} d, failed > {result['policy']['failed_days']:g} d")
+    print(f"  rows to archive: {result['rows']} {result['rows_by_status']} ({result['rows_remaining']} stay)")
+    print(f"  outputs: {result['outputs']} file(s), {result['output_bytes'] / mb:.1f} MB")
+    print(f"  queue DB: {space['db_bytes'] / mb:.1f} MB, {space['free_bytes'] / mb:.1f} MB free pages, "
+          f"auto_vacuum={space['auto_vacuum']}, ~{result['db_bytes_estimate'] / mb:.1f} MB in expired rows")
+    print(f"  archive: {result['archive_path']}")
+    if result['applied']:
+        print(f"  archived {result['archive']['archived']} job(s), outputs {result['archive']['outputs']}, "
+              f"{result['archive']['freed_output_bytes'] / mb:.1f} MB of outputs freed")
+        print(f"  compacted: {result['compact']['reclaimed_bytes'] / mb:.1f} MB returned to the filesystem")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive old jobs and compact the queue database')
+    parser.add_argument('--days', type=float, default=DEFAULT_DAYS,
+                        help=f'Archive completed jobs finished more than this many days ago (default: {DEFAULT_DAYS})')
+    parser.add_argument('--failed-days', type=float, default=None,
+                        help='Same for failed jobs (default: --days)')
+    parser.add_argument('--status', choices=['completed', 'failed', 'both'], default='both',
+                        help='Which finished jobs to archive (default: both)')
+    parser.add_argument('--batch', default=None, help='Only jobs of this batch')
+    parser.add_argument('--outputs', choices=OUTPUT_ACTIONS, default='keep',
+                        help='What to do with output files of archived jobs (default: keep)')
+    parser.add_argument('--move-to', default=None, help='Target directory for --outputs move')
+    parser.add_argument('--vacuum-pages', type=int, default=0,
+                        help='Free pages released per pass, 0 = all (default: 0)')
+    parser.add_argument('--apply', action='store_true', help='Actually archive (default: dry-run report)')
+    parser.add_argument('--every', type=float, default=0,
+                        help='Repeat every this many hours instead of exiting (default: 0 = once)')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+    if args.outputs == 'move' and not args.move_to:
+        parser.error('--outputs move needs --move-to')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from webui.app import create_app
+    app = create_app()
+    with app.app_context():
+        while True:
+            result = run_retention(
+                apply=args.apply,
+                vacuum_pages=args.vacuum_pages,
+                days=args.days,
+                failed_days=args.failed_days,
+                statuses=('completed', 'failed') if args.status == 'both' else (args.status,),
+                batch_id=args.batch,
+                outputs=args.outputs,
+                move_to=args.move_to
+            )
+            if args.json:
+                print(json.dumps(result, indent=2, default=str))
+            else:
+                _print(result)
+            if not args.every:
+                break
+            time.sleep(args.every * 3600)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 """
 Flask routes for Comic Upscale Admin UI.
-Routes: /login, /, /upload, /download/<id>, /api/status
+Routes: /login, /, /upload, /download/<id>, /batch/<id>/priority, /api/status, /api/estimate, /api/retention
 """
 
 import os
@@ -8,12 +8,26 @@ import uuid
 from flask import Blueprint, render_template, request, redirect, url_for, flash, send_file, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from webui.models import db, ImageJob, User, AVAILABLE_MODELS, PRESETS
+from webui.scheduler import PRIORITIES, schedule_batch, reprioritize, batch_summary
+from webui.image_probe import probe_images
+from webui.capacity import estimate
+from webui.retention import DEFAULT_DAYS, report as retention_report
 from datetime import datetime
 
 bp = Blueprint('routes', __name__)
 
 OUTPUT_DIR = os.environ.get('OUTPUT_DIR', '/workspace/data/output')
 INPUT_DIR = os.environ.get('INPUT_DIR', '/workspace/data/input')
+MAX_MEGAPIXELS = float(os.environ.get('MAX_MEGAPIXELS', 64))
+
+
+def _form_priority():
+    """Priority field of the posted form, or None if it isn't one of PRIORITIES."""
+    try:
+        priority = int(request.form.get('priority', 0))
+    except ValueError:
+        return None
+    return priority if priority in dict(PRIORITIES) else None
 
 
 @bp.route('/login', methods=['GET', 'POST'])
@@ -70,7 +84,8 @@ def dashboard():
         'progress': progress
     }
     
-    return render_template('dashboard.html', stats=stats, jobs=recent_jobs, presets=PRESETS)
+    return render_template('dashboard.html', stats=stats, jobs=recent_jobs, presets=PRESETS,
+                           batches=batch_summary(), priorities=PRIORITIES)
 
 
 @bp.route('/upload', methods=['GET', 'POST'])
@@ -81,6 +96,10 @@ def upload():
         # Get parameters
         preset = request.form.get('preset', 'art')
         custom = request.form.get('custom') == 'on'
+        priority = _form_priority()
+        if priority is None:
+            flash(f"Unknown priority: {request.form.get('priority')}", 'error')
+            return redirect(url_for('routes.upload'))
         
         if custom:
             # Custom parameters
@@ -107,34 +126,51 @@ def upload():
         # Ensure input directory exists
         os.makedirs(INPUT_DIR, exist_ok=True)
         
-        jobs_created = 0
+        batch_id = f"upload-{uuid.uuid4().hex[:8]}"
+        saved = []
         for file in files:
             if file.filename:
                 # Save file
                 filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
                 filepath = os.path.join(INPUT_DIR, filename)
                 file.save(filepath)
-                
-                # Create job
-                job = ImageJob(
-                    filename=file.filename,
-                    original_path=filepath,
-                    scale_factor=scale,
-                    model_name=model,
-                    tile_size=tile,
-                    face_enhance=face_enhance,
-                    denoising_level=denoising,
-                    preset=preset if not custom else 'custom',
-                    status='pending'
-                )
-                db.session.add(job)
-                jobs_created += 1
+                saved.append((file.filename, filepath))
         
+        # Header probe: reject unreadable / oversized images before queueing
+        new_jobs = []
+        rejected = []
+        for (name, filepath), (_, info, error) in zip(saved, probe_images([p for _, p in saved], MAX_MEGAPIXELS)):
+            if error:
+                os.remove(filepath)
+                rejected.append(f'{name} ({error})')
+                continue
+            
+            # Create job
+            job = ImageJob(
+                filename=name,
+                original_path=filepath,
+                width=info['width'],
+                height=info['height'],
+                pixel_count=info['pixel_count'],
+                scale_factor=scale,
+                model_name=model,
+                tile_size=tile,
+                face_enhance=face_enhance,
+                denoising_level=denoising,
+                preset=preset if not custom else 'custom',
+                status='pending'
+            )
+            db.session.add(job)
+            new_jobs.append(job)
+        
+        if rejected:
+            flash(f'Rejected {len(rejected)} file(s): ' + ', '.join(rejected), 'error')
+        schedule_batch(new_jobs, batch_id, priority)
         db.session.commit()
-        flash(f'Created {jobs_created} job(s) with preset: {preset}', 'success')
+        flash(f'Created {len(new_jobs)} job(s) with preset: {preset} (batch {batch_id})', 'success')
         return redirect(url_for('routes.dashboard'))
     
-    return render_template('upload.html', presets=PRESETS, models=AVAILABLE_MODELS)
+    return render_template('upload.html', presets=PRESETS, models=AVAILABLE_MODELS, priorities=PRIORITIES)
 
 
 @bp.route('/upload/preset/<preset_name>')
@@ -145,7 +181,8 @@ def upload_preset(preset_name):
         flash(f'Unknown preset: {preset_name}', 'error')
         return redirect(url_for('routes.upload'))
     
-    return render_template('upload.html', presets=PRESETS, models=AVAILABLE_MODELS, selected_preset=preset_name)
+    return render_template('upload.html', presets=PRESETS, models=AVAILABLE_MODELS, priorities=PRIORITIES,
+                           selected_preset=preset_name)
 
 
 @bp.route('/download/<int:job_id>')
@@ -169,6 +206,20 @@ def download(job_id):
     )
 
 
+@bp.route('/batch/<batch_id>/priority', methods=['POST'])
+@login_required
+def batch_priority(batch_id):
+    """Change the priority of a batch's pending jobs."""
+    priority = _form_priority()
+    if priority is None:
+        flash(f"Unknown priority: {request.form.get('priority')}", 'error')
+        return redirect(url_for('routes.dashboard'))
+    
+    count = reprioritize(batch_id, priority)
+    flash(f'Batch {batch_id}: {count} pending job(s) set to {dict(PRIORITIES)[priority]}', 'success')
+    return redirect(url_for('routes.dashboard'))
+
+
 @bp.route('/job/<int:job_id>')
 @login_required
 def job_detail(job_id):
@@ -206,6 +257,42 @@ def api_stats():
     })
 
 
+@bp.route('/api/batches')
+@login_required
+def api_batches():
+    """JSON API for queued batches and their priorities."""
+    return jsonify({
+        'batches': batch_summary(),
+        'priorities': dict(PRIORITIES)
+    })
+
+
+@bp.route('/api/estimate')
+@login_required
+def api_estimate():
+    """JSON API for run time / cost forecasts of the pending queue (or ?batch_id=)."""
+    return jsonify(estimate(
+        hourly_rate=request.args.get('hourly_rate', 0.0, type=float),
+        deadline_minutes=request.args.get('deadline', None, type=float),
+        budget=request.args.get('budget', None, type=float),
+        batch_id=request.args.get('batch_id') or None,
+        max_nodes=request.args.get('max_nodes', 8, type=int)
+    ))
+
+
+@bp.route('/api/retention')
+@login_required
+def api_retention():
+    """JSON API for a retention dry run: rows, outputs and DB space a pass would reclaim."""
+    status = request.args.get('status', 'both')
+    return jsonify(retention_report(
+        days=request.args.get('days', DEFAULT_DAYS, type=float),
+        failed_days=request.args.get('failed_days', None, type=float),
+        statuses=('completed', 'failed') if status == 'both' else (status,),
+        batch_id=request.args.get('batch_id') or None
+    ))
+
+
 @bp.route('/api/presets')
 @login_required
 def api_presets():
@@ -0,0 +1,274 @@
+"""
+Priority and fair-share scheduling for the ImageJob queue.
+
+Self-clocked weighted fair queuing between upload batches: every job gets a
+virtual finish tag (``sched_tag``) when it is enqueued, and workers claim
+pending jobs in tag order (see ImageJob.claim_next). A batch's tags advance
+by ``cost / weight``, so a high-priority batch advances slowly and wins, and
+a small batch submitted late starts at the current head of the queue instead
+of behind a 5,000-page upload. Within a batch jobs are tagged shortest-first.
+"""
+
+import os
+import time
+from sqlalchemy import and_, func, not_, or_
+from webui.models import db, ImageJob
+
+# Priority levels offered in the UI (value -> label)
+PRIORITIES = [
+    (-1, 'Low'),
+    (0, 'Normal'),
+    (1, 'High'),
+    (2, 'Urgent'),
+]
+
+# Relative inference cost per megapixel (RealESRGAN_x4plus = 1.0)
+MODEL_COST = {
+    'RealESRGAN_x4plus': 1.0,
+    'RealESRNet_x4plus': 1.0,
+    'RealESRGAN_x4plus_anime': 0.3,
+    'RealESRGAN_x4plus_anime_6B': 0.3,
+    'RealESRGAN_x2plus': 0.3,  # pixel-unshuffled input, 1/4 of the x4 compute
+    'realesrgan-x2plus': 0.15,
+    'realesr-general-x4v3': 0.15,
+}
+
+
+def priority_weight(priority) -> float:
+    """Fair-share weight of a batch; each level is worth 4x the one below."""
+    return 4.0 ** (priority or 0)
+
+
+def estimate_cost(job) -> float:
+    """Estimated work for a job: megapixels x model cost.
+
+    Uses the probed pixel count; falls back to the file size (~1 byte/pixel
+    for comic PNGs) for jobs created before probing.
+    """
+    pixels = job.pixel_count
+    if not pixels:
+        try:
+            pixels = os.path.getsize(job.original_path)
+        except OSError:
+            pixels = 1e6
+    return max(pixels / 1e6, 0.01) * MODEL_COST.get(job.model_name, 1.0)
+
+
+def virtual_time() -> float:
+    """Current system virtual time: tag at the head of the pending queue."""
+    head = db.session.query(func.min(ImageJob.sched_tag)).filter(
+        ImageJob.status == 'pending'
+    ).scalar()
+    if head is not None:
+        return head
+    last = db.session.query(func.max(ImageJob.sched_tag)).filter(
+        ImageJob.status != 'pending'
+    ).scalar()
+    return last or 0.0
+
+
+def _assign_tags(jobs, priority, start):
+    """Tag jobs shortest-first from a virtual start time."""
+    weight = priority_weight(priority)
+    for job in sorted(jobs, key=lambda j: (j.est_cost, j.filename)):
+        job.priority = priority
+        start += job.est_cost / weight
+        job.sched_tag = start
+
+
+def schedule_batch(jobs, batch_id: str, priority: int = 0):
+    """Tag newly created (uncommitted) jobs of one batch for fair dispatch."""
+    last = db.session.query(func.max(ImageJob.sched_tag)).filter(
+        ImageJob.batch_id == batch_id,
+        ImageJob.status == 'pending'
+    ).scalar()
+    start = max(virtual_time(), last or 0.0)
+    for job in jobs:
+        job.batch_id = batch_id
+        if job.est_cost is None:
+            job.est_cost = estimate_cost(job)
+    _assign_tags(jobs, priority, start)
+
+
+def reprioritize(batch_id: str, priority: int) -> int:
+    """Re-tag the pending jobs of a batch at a new priority; returns count."""
+    jobs = ImageJob.query.filter_by(batch_id=batch_id, status='pending').all()
+    if not jobs:
+        return 0
+    start = db.session.query(func.min(ImageJob.sched_tag)).filter(
+        ImageJob.status == 'pending',
+        or_(ImageJob.batch_id != batch_id, ImageJob.batch_id.is_(None))
+    ).scalar()
+    if start is None:
+        start = virtual_time()
+    for job in jobs:
+        if job.est_cost is None:
+            job.est_cost = estimate_cost(job)
+    _assign_tags(jobs, priority, start)
+    db.session.commit()
+    return len(jobs)
+
+
+def batch_summary() -> list:
+    """Batches that still have queued work, highest priority first."""
+    rows = db.session.query(
+        ImageJob.batch_id,
+        func.max(ImageJob.priority),
+        func.count(ImageJob.id),
+        func.min(ImageJob.created_at)
+    ).filter(
+        ImageJob.status == 'pending'
+    ).group_by(ImageJob.batch_id).all()
+    batches = [{
+        'batch_id': batch_id,
+        'priority': priority or 0,
+        'pending': pending,
+        'created_at': created_at.isoformat() if created_at else None
+    } for batch_id, priority, pending, created_at in rows]
+    return sorted(batches, key=lambda b: (-b['priority'], b['created_at'] or ''))
+
+
+# Job parameters that need a distinct engine configuration
+PARAM_COLUMNS = ('model_name', 'scale_factor', 'tile_size', 'face_enhance', 'denoising_level')
+
+# A worker leaves its parameter group for an equally urgent group with an
+# older fair-share tag after this many jobs or seconds, whichever comes first
+GROUP_QUANTUM_JOBS = 8
+GROUP_QUANTUM_SECONDS = 30.0
+
+# Back-off after a model fails to load: doubled per failure, capped
+LOAD_RETRY_SECONDS = 30.0
+LOAD_RETRY_MAX = 600.0
+LOAD_ATTEMPTS = 4  # per group, before a non-following worker leaves it to others
+
+
+def _matches(params: dict):
+    return [getattr(ImageJob, name) == value for name, value in params.items()]
+
+
+def execution_plan() -> list:
+    """Pending jobs grouped by identical parameters, in execution order.
+
+    Each group runs under one model configuration; groups are ordered by
+    their highest priority, then by the fair-share tag at their head.
+    """
+    columns = [getattr(ImageJob, name) for name in PARAM_COLUMNS]
+    rows = db.session.query(
+        *columns,
+        func.count(ImageJob.id),
+        func.max(ImageJob.priority),
+        func.min(func.coalesce(ImageJob.sched_tag, 0))
+    ).filter(
+        ImageJob.status == 'pending'
+    ).group_by(*columns).all()
+
+    groups = [{
+        'params': dict(zip(PARAM_COLUMNS, row[:len(PARAM_COLUMNS)])),
+        'pending': row[-3],
+        'priority': row[-2] or 0,
+        'head_tag': row[-1]
+    } for row in rows]
+    return sorted(groups, key=lambda g: (-g['priority'], g['head_tag']))
+
+
+def next_group(plan: list, current: dict = None) -> dict:
+    """Pick the group to run next: top priority, then the oldest fair-share tag.
+
+    Staying on one group is bounded by the quantum in preempted(), not
+    decided here. On a tag tie the currently configured group wins, then
+    one sharing its model (no weight reload).
+    """
+    eligible = [g for g in plan if g['priority'] == plan[0]['priority']]
+
+    def switch_cost(group):
+        if not current or group['params'] == current:
+            return 0
+        return 1 if group['params']['model_name'] == current['model_name'] else 2
+
+    return min(eligible, key=lambda g: (g['head_tag'], switch_cost(g)))
+
+
+def preempted(params: dict, priority: int, started: float = None, jobs: int = 0) -> bool:
+    """True if the worker should leave its parameter group and re-plan.
+
+    A more urgent job with different parameters always preempts. Once the
+    group has had its quantum (GROUP_QUANTUM_JOBS jobs claimed or
+    GROUP_QUANTUM_SECONDS since started), an equally urgent group whose
+    head tag is older than this group's takes over, so batches with
+    different parameters interleave at their fair share instead of one
+    running until it is empty.
+    """
+    others = ImageJob.query.filter(
+        ImageJob.status == 'pending',
+        not_(and_(*_matches(params)))
+    )
+    top = others.with_entities(func.max(func.coalesce(ImageJob.priority, 0))).scalar()
+    if top is None or top < priority:
+        return False
+    if top > priority:
+        return True
+    if started is None or (jobs < GROUP_QUANTUM_JOBS and time.time() - started < GROUP_QUANTUM_SECONDS):
+        return False
+
+    tag = func.min(func.coalesce(ImageJob.sched_tag, 0))
+    other_head = others.filter(func.coalesce(ImageJob.priority, 0) == priority).with_entities(tag).scalar()
+    own_head = ImageJob.query.filter(
+        ImageJob.status == 'pending', *_matches(params)
+    ).with_entities(tag).scalar()
+    return own_head is not None and other_head < own_head
+
+
+class LoadBackoff:
+    """Per-worker back-off for parameter groups whose model failed to load.
+
+    A failed load (weight download hiccup, out of memory on this device)
+    says nothing about the jobs, so they stay pending: this worker retries
+    the group after a growing delay and runs other groups meanwhile, and
+    other workers are not affected. After LOAD_ATTEMPTS failures a worker
+    that is not following the queue gives up on the group and leaves its
+    jobs for other workers or the next run.
+    """
+
+    def __init__(self, follow: bool = False):
+        self.follow = follow
+        self._failures = {}  # params key -> consecutive failures
+        self._retry_at = {}  # params key -> time.time() of the next attempt
+
+    @staticmethod
+    def _key(params: dict) -> tuple:
+        return tuple(sorted(params.items()))
+
+    def failed(self, params: dict) -> float:
+        """Record a failed load; returns the delay before the next attempt."""
+        key = self._key(params)
+        failures = self._failures[key] = self._failures.get(key, 0) + 1
+        delay = min(LOAD_RETRY_SECONDS * 2 ** (failures - 1), LOAD_RETRY_MAX)
+        self._retry_at[key] = time.time() + delay
+        return delay
+
+    def loaded(self, params: dict):
+        self._failures.pop(self._key(params), None)
+        self._retry_at.pop(self._key(params), None)
+
+    def gave_up(self, params: dict) -> bool:
+        return not self.follow and self._failures.get(self._key(params), 0) >= LOAD_ATTEMPTS
+
+    def ready(self, plan: list) -> list:
+        """Groups of the plan this worker may try now."""
+        now = time.time()
+        return [g for g in plan
+                if not self.gave_up(g['params']) and self._retry_at.get(self._key(g['params']), 0) <= now]
+
+    def wait(self, plan: list) -> float:
+        """Seconds until a backed-off group of the plan can be retried (None if all were given up)."""
+        pending = [self._retry_at[self._key(g['params'])] for g in plan if not self.gave_up(g['params'])]
+        return max(min(pending) - time.time(), 0.0) if pending else None
+
+
+def fail_group(params: dict, error: str) -> int:
+    """Fail every pending job of a parameter group (e.g. its model is unknown)."""
+    count = ImageJob.query.filter(
+        ImageJob.status == 'pending', *_matches(params)
+    ).update({'status': 'failed', 'error_message': error}, synchronize_session=False)
+    db.session.commit()
+    return count
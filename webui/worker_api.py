@@ -0,0 +1,178 @@
+"""
+Job-lease API for remote workers (upscale.py --remote-worker URL).
+Routes: /api/worker/claim, /api/worker/heartbeat, /api/worker/jobs/<id>/input,
+        /api/worker/jobs/<id>/result, /api/worker/jobs/<id>/fail
+
+Remote nodes pull work instead of getting their own SQLite file: a claim
+leases jobs of one parameter group for LEASE_SECONDS, heartbeats renew the
+lease, and a lease that runs out (node died, network gone) puts the job
+back in the queue for someone else. Expired leases are swept by a
+background thread as well as on every claim, so jobs of a node that died
+are recovered even when no other worker is claiming. Every request carries
+the shared WORKER_TOKEN as a bearer token; without one configured the API
+is off.
+"""
+
+import hmac
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from flask import Blueprint, request, jsonify, send_file, abort
+from werkzeug.utils import secure_filename
+from webui.models import db, ImageJob
+from webui.scheduler import PARAM_COLUMNS, execution_plan, next_group
+
+bp = Blueprint('worker_api', __name__, url_prefix='/api/worker')
+
+OUTPUT_DIR = os.environ.get('OUTPUT_DIR', '/workspace/data/output')
+WORKER_TOKEN = os.environ.get('WORKER_TOKEN', '')
+LEASE_SECONDS = int(os.environ.get('WORKER_LEASE_SECONDS', 120))
+MAX_CLAIM = 16
+SWEEP_SECONDS = max(LEASE_SECONDS // 4, 5)
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_leases(app, stop: threading.Event = None):
+    """Requeue expired leases every SWEEP_SECONDS (runs in a daemon thread)."""
+    stop = stop or threading.Event()
+    while not stop.wait(SWEEP_SECONDS):
+        try:
+            with app.app_context():
+                requeued, failed = ImageJob.requeue_expired()
+        except Exception as e:
+            logger.warning(f"Lease sweep failed: {e}")
+            continue
+        if requeued or failed:
+            logger.info(f"Lease sweep: {requeued} job(s) requeued, {failed} failed after repeated crashes")
+
+
+@bp.record_once
+def start_sweeper(state):
+    if WORKER_TOKEN:
+        threading.Thread(target=sweep_leases, args=(state.app,), name='lease-sweeper', daemon=True).start()
+
+
+@bp.before_request
+def check_token():
+    """Bearer-token auth for every worker endpoint."""
+    if not WORKER_TOKEN:
+        abort(503, description='Worker API disabled (WORKER_TOKEN not set)')
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(supplied, WORKER_TOKEN):
+        abort(401)
+
+
+def _lease_expiry():
+    return datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+
+
+def _leased_job(job_id, worker_id):
+    """The job, if it is still leased to this worker (else 409)."""
+    job = db.session.get(ImageJob, job_id) or abort(404)
+    if job.status != 'processing' or job.worker_id != worker_id:
+        abort(409, description='Job is not leased to this worker')
+    return job
+
+
+@bp.route('/claim', methods=['POST'])
+def claim():
+    """Lease up to max_jobs jobs of one parameter group.
+
+    The worker sends the parameters it is configured for, so the group it
+    already has loaded is preferred (see scheduler.next_group).
+    """
+    body = request.get_json(force=True)
+    worker_id = body['worker_id']
+    max_jobs = max(1, min(int(body.get('max_jobs', 1)), MAX_CLAIM))
+
+    ImageJob.requeue_expired()
+    plan = execution_plan()
+    if not plan:
+        return jsonify({'jobs': [], 'lease_seconds': LEASE_SECONDS})
+    group = next_group(plan, body.get('params'))
+
+    jobs = []
+    while len(jobs) < max_jobs:
+        job = ImageJob.claim_next(worker_id, params=group['params'], lease_expires_at=_lease_expiry())
+        if job is None:
+            break
+        jobs.append(job)
+
+    return jsonify({
+        'params': group['params'],
+        'lease_seconds': LEASE_SECONDS,
+        'jobs': [{
+            'id': job.id,
+            'filename': job.filename,
+            'params': {name: getattr(job, name) for name in PARAM_COLUMNS}
+        } for job in jobs]
+    })
+
+
+@bp.route('/heartbeat', methods=['POST'])
+def heartbeat():
+    """Renew leases; jobs the worker no longer holds are reported as lost."""
+    body = request.get_json(force=True)
+    job_ids = [int(job_id) for job_id in body.get('job_ids', [])]
+    held = ImageJob.renew_leases(body['worker_id'], job_ids, _lease_expiry())
+    return jsonify({
+        'renewed': held,
+        'lost': [job_id for job_id in job_ids if job_id not in held],
+        'lease_seconds': LEASE_SECONDS
+    })
+
+
+@bp.route('/jobs/<int:job_id>/input')
+def job_input(job_id):
+    """Original image of a leased job."""
+    job = _leased_job(job_id, request.args.get('worker_id'))
+    if not os.path.exists(job.original_path):
+        abort(410, description='Input file missing on server')
+    return send_file(job.original_path, download_name=job.filename)
+
+
+@bp.route('/jobs/<int:job_id>/result', methods=['POST'])
+def job_result(job_id):
+    """Store the upscaled image of a leased job and complete it."""
+    job = _leased_job(job_id, request.form.get('worker_id'))
+    upload = request.files.get('output') or abort(400, description='Missing output file')
+
+    output_path = job.output_path or os.path.join(
+        OUTPUT_DIR, f"upscale_{job.scale_factor}x_{Path(job.original_path).stem}.png"
+    )
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    partial = f"{output_path}.{secure_filename(job.worker_id)}.part"
+    upload.save(partial)
+    os.replace(partial, output_path)
+
+    job.status = 'completed'
+    job.progress_percent = 100
+    job.output_path = output_path
+    job.completed_at = datetime.utcnow()
+    job.lease_expires_at = None
+    if request.form.get('skipped_fraction'):
+        job.skipped_fraction = float(request.form['skipped_fraction'])
+    if request.form.get('is_grayscale'):
+        job.is_grayscale = request.form['is_grayscale'] == '1'
+    db.session.commit()
+    return jsonify({'status': 'completed', 'output_path': output_path})
+
+
+@bp.route('/jobs/<int:job_id>/fail', methods=['POST'])
+def job_fail(job_id):
+    """Mark a leased job failed (retry=true puts it back in the queue instead)."""
+    body = request.get_json(force=True)
+    job = _leased_job(job_id, body.get('worker_id'))
+    if body.get('retry'):
+        job.status = 'pending'
+        job.worker_id = None
+        job.started_at = None
+    else:
+        job.status = 'failed'
+        job.error_message = body.get('error', 'Remote worker failure')
+    job.lease_expires_at = None
+    db.session.commit()
+    return jsonify({'status': job.status})